@@ -0,0 +1,540 @@
+"""
+	Benchmarks for the data tools
+
+	Measure before and after changing anything that is supposed to be faster.
+	Jython and CPython disagree on what is cheap, so run these where the code runs.
+"""
+
+from array import array
+from datetime import datetime
+from json import dumps, loads
+from timeit import default_timer
+import __future__
+import math, os, random, sys, tempfile
+
+from shared.tools.profile import time_it, convert_to_human_readable
+from shared.data import stats
+from shared.data.expression import Expression, CompiledExpression, ExpressionCache
+from shared.data.expression import write_expression_bundle, load_expression_bundle
+from shared.data.simulators.drunk import DrunkenWalk
+
+
+__copyright__ = """Copyright (C) 2020 Corso Systems"""
+__license__ = 'Apache 2.0'
+__maintainer__ = 'Andrew Geiger'
+__email__ = 'andrew.geiger@corsosystems.com'
+
+
+DEFAULT_ARRAY_PATH_SIZES = (10000, 1000000, 10000000)
+DEFAULT_STATS_SIZES = (1000, 10000, 100000)
+DEFAULT_SEED = 42
+
+
+#
+# Reproducible data
+#
+# Every generator takes the number of samples and a seed,
+# and the same pair always gives the same list.
+#
+
+def generate_uniform(size, seed=DEFAULT_SEED, low=0.0, high=1.0):
+	rng = random.Random(seed)
+	return [rng.uniform(low, high) for _ in xrange(size)]
+
+
+def generate_normal(size, seed=DEFAULT_SEED, mu=0.0, sigma=1.0):
+	rng = random.Random(seed)
+	return [rng.gauss(mu, sigma) for _ in xrange(size)]
+
+
+def generate_heavy_tailed(size, seed=DEFAULT_SEED, alpha=1.5):
+	"""Pareto distributed, so a few values are enormous"""
+	rng = random.Random(seed)
+	return [rng.paretovariate(alpha) for _ in xrange(size)]
+
+
+def generate_with_holes(size, seed=DEFAULT_SEED, missing_fraction=0.1, generator=generate_normal):
+	"""Data from the generator with a fraction of the values replaced with None"""
+	rng = random.Random(seed)
+	return [None if rng.random() < missing_fraction else x 
+			for x in generator(size, seed)]
+
+
+def generate_drunken_walk(size, seed=DEFAULT_SEED, **walk_configuration):
+	"""Output of a DrunkenWalk, one stumble per sample.
+	The walker uses the module level random, so its state is set aside and restored.
+	"""
+	state = random.getstate()
+	try:
+		random.seed(seed)
+		walker = DrunkenWalk(**walk_configuration)
+		return [walker.stumble() for _ in xrange(size)]
+	finally:
+		random.setstate(state)
+
+
+DATA_GENERATORS = {
+	'uniform': generate_uniform,
+	'normal': generate_normal,
+	'heavy tailed': generate_heavy_tailed,
+	'holes': generate_with_holes,
+	'drunken walk': generate_drunken_walk,
+}
+
+
+# every public function (and accumulator) in stats, called on a dataset
+STATS_FUNCTIONS = {
+	'least':              stats.least,
+	'most':               stats.most,
+	'summation':          stats.summation,
+	'mean':               stats.mean,
+	'geometric_mean':     stats.geometric_mean,
+	'harmonic_mean':      stats.harmonic_mean,
+	'variance':           stats.variance,
+	'standard_deviation': stats.standard_deviation,
+	'median':             stats.median,
+	'quantiles':          stats.quantiles,
+	'multimode':          stats.multimode,
+	'mode':               stats.mode,
+	'histogram':          stats.histogram,
+	'format_histogram':   stats.format_histogram,
+	'describe':           stats.describe,
+	'parallel_describe':  lambda data: stats.parallel_describe(data[i:i+10000] for i in xrange(0, len(data), 10000)),
+	'RunningDescription': stats.RunningDescription,
+	'QuantileSketch':     lambda data: stats.QuantileSketch(data, seed=DEFAULT_SEED).quantiles(),
+	'StreamingHistogram': lambda data: stats.StreamingHistogram().extend(data),
+	'FrequentItems':      stats.FrequentItems,
+	'ExponentialMovingStatistics': lambda data: stats.ExponentialMovingStatistics(span=100).extend(data),
+}
+
+
+# name, list path call, array path call
+ARRAY_PATH_FUNCTIONS = [
+	('mean',           lambda l: stats.mean(l),           lambda a, m: stats.array_mean(a, m)),
+	('variance',       lambda l: stats.variance(l),       lambda a, m: stats.array_variance(a, m)),
+	('histogram',      lambda l: stats.histogram(l),      lambda a, m: stats.array_histogram(a, m)),
+	('quantiles',      lambda l: stats.quantiles(l),      lambda a, m: stats.array_quantiles(a, m)),
+	('geometric_mean', lambda l: stats.geometric_mean(l), lambda a, m: stats.array_geometric_mean(a, m)),
+	('harmonic_mean',  lambda l: stats.harmonic_mean(l),  lambda a, m: stats.array_harmonic_mean(a, m)),
+]
+
+
+def benchmark_array_path(sizes=DEFAULT_ARRAY_PATH_SIZES, missing_fraction=0.05, seed=42,
+						 iterations=1, setup_executions=3):
+	"""Time the list-of-floats path against the array-backed path.
+
+	Each size gets the same data three ways: a list with None holes,
+	an array.array('d') with a validity mask, and (when importable) a NumPy array and mask.
+	Returns a list of rows with the average seconds per call for each path,
+	and each array path's speedup over the list (below 1 is slower), separately,
+	since only NumPy is expected to be much faster.
+	"""
+	rng = random.Random(seed)
+
+	rows = []
+	for size in sizes:
+		# strictly positive so the geometric and harmonic means are defined
+		samples = [None if rng.random() < missing_fraction else 1.0 - rng.random()
+				   for _ in xrange(size)]
+		values = array('d', (0.0 if x is None else x for x in samples))
+		mask = array('b', (x is not None for x in samples))
+
+		if stats.numpy is not None:
+			np_values = stats.numpy.array(values, dtype=float)
+			np_mask = stats.numpy.array(mask, dtype=bool)
+
+		for name, list_call, array_call in ARRAY_PATH_FUNCTIONS:
+			row = {'function': name, 'size': size}
+
+			row['list'] = time_it(lambda: list_call(samples),
+								  iterations=iterations, setup_executions=setup_executions)['statement avg']
+			row['array'] = time_it(lambda: array_call(values, mask),
+								   iterations=iterations, setup_executions=setup_executions)['statement avg']
+			if stats.numpy is not None:
+				row['numpy'] = time_it(lambda: array_call(np_values, np_mask),
+									   iterations=iterations, setup_executions=setup_executions)['statement avg']
+
+			row['array speedup'] = row['list'] / (row['array'] or 1e-12)
+			if 'numpy' in row:
+				row['numpy speedup'] = row['list'] / (row['numpy'] or 1e-12)
+			rows.append(row)
+
+	return rows
+
+
+def format_array_path_benchmark(rows):
+	"""Returns a text table of the results from benchmark_array_path"""
+	has_numpy = any('numpy' in row for row in rows)
+
+	lines = ['%-16s %10s %14s %14s %7s%s' % (
+				'function', 'size', 'list', 'array', 'speedup', 
+				' %14s %7s' % ('numpy', 'speedup') if has_numpy else '')]
+	for row in rows:
+		lines.append('%-16s %10d %14s %14s %6.1fx%s' % (
+			row['function'], row['size'],
+			convert_to_human_readable(row['list']),
+			convert_to_human_readable(row['array']),
+			row['array speedup'],
+			' %14s %6.1fx' % (convert_to_human_readable(row['numpy']), row['numpy speedup']) if has_numpy else '',
+		))
+	return '\n'.join(lines)
+
+
+
+#
+# Whole module benchmark
+#
+
+def run_stats_benchmark(sizes=DEFAULT_STATS_SIZES, datasets=None, functions=None, seed=DEFAULT_SEED,
+						iterations=1, setup_executions=3):
+	"""Time each stats function on each dataset at each size.
+	
+	Returns a report (plain dicts and lists, ready for JSON) with a row per 
+	function, dataset, and size. Functions that can not handle a dataset
+	(like a geometric mean of negative numbers) get the error instead of timings.
+	"""
+	datasets = datasets or sorted(DATA_GENERATORS)
+	functions = functions or sorted(STATS_FUNCTIONS)
+	
+	report = {
+		'started': datetime.now().isoformat(' '),
+		'python': sys.version,
+		'platform': sys.platform,
+		'seed': seed,
+		'iterations': iterations,
+		'setup_executions': setup_executions,
+		'results': [],
+	}
+	
+	for size in sizes:
+		for dataset in datasets:
+			data = DATA_GENERATORS[dataset](size, seed)
+			for name in functions:
+				function = STATS_FUNCTIONS[name]
+				row = {'function': name, 'dataset': dataset, 'size': size}
+				try:
+					function(data)
+				except Exception, error:
+					row['error'] = repr(error)
+				else:
+					timing = time_it(lambda: function(data), 
+									 iterations=iterations, setup_executions=setup_executions)
+					row['seconds'] = timing['statement avg']
+					row['std dev'] = timing.get('est statement std dev')
+				report['results'].append(row)
+	
+	report['finished'] = datetime.now().isoformat(' ')
+	return report
+
+
+def write_benchmark_report(report, path):
+	"""Dump the report as JSON, so runs can be compared across versions"""
+	with open(path, 'w') as f:
+		f.write(dumps(report, indent=1, sort_keys=True))
+
+
+def read_benchmark_report(path):
+	with open(path, 'r') as f:
+		return loads(f.read())
+
+
+def compare_benchmark_reports(baseline, candidate, threshold=1.25):
+	"""Returns the rows that got slower by more than the threshold ratio, worst first.
+	Each is (function, dataset, size, baseline seconds, candidate seconds, ratio).
+	"""
+	timings = dict(((row['function'], row['dataset'], row['size']), row.get('seconds'))
+				   for row in baseline['results'])
+	
+	regressions = []
+	for row in candidate['results']:
+		key = (row['function'], row['dataset'], row['size'])
+		before, after = timings.get(key), row.get('seconds')
+		if not (before and after):
+			continue
+		ratio = after / before
+		if ratio > threshold:
+			regressions.append(key + (before, after, ratio))
+	
+	regressions.sort(key=lambda regression: regression[-1], reverse=True)
+	return regressions
+
+
+
+#
+# Expression backends
+#
+
+DEFAULT_EXPRESSION_DEPTHS = (1, 2, 4, 8, 16, 32, 64)
+
+_EXPRESSION_OPERANDS = ('x', 'y', 'z', '2', '3')
+_EXPRESSION_OPERATORS = ('+', '*', '-')
+
+
+def generate_expression(depth, operators=_EXPRESSION_OPERATORS):
+	"""Returns an expression with depth binary operators, like 'x + y * z - 2 + 3'"""
+	terms = [_EXPRESSION_OPERANDS[0]]
+	for i in range(depth):
+		terms.append(operators[i % len(operators)])
+		terms.append(_EXPRESSION_OPERANDS[(i + 1) % len(_EXPRESSION_OPERANDS)])
+	return ' '.join(terms)
+
+
+def benchmark_expression_backends(depths=DEFAULT_EXPRESSION_DEPTHS, iterations=10000, setup_executions=3,
+								  backends=None, operators=_EXPRESSION_OPERATORS):
+	"""Time calling the closure tree (Expression) against the compiled function (CompiledExpression).
+	Returns a row per depth with the average seconds per call for each backend.
+	"""
+	backends = backends or [('closure', Expression), ('compiled', CompiledExpression)]
+	arguments = (1.5, 0.5, 0.25)
+	
+	rows = []
+	for depth in depths:
+		source = generate_expression(depth, operators)
+		row = {'depth': depth, 'expression': source}
+		for name, backend in backends:
+			expression = backend(source)
+			row[name] = time_it(lambda: expression(*arguments),
+								iterations=iterations, setup_executions=setup_executions)['statement avg']
+		row['speedup'] = row[backends[0][0]] / (row[backends[-1][0]] or 1e-12)
+		rows.append(row)
+	return rows
+
+
+def format_expression_benchmark(rows, backends=('closure', 'compiled')):
+	"""Returns a text table of the results from benchmark_expression_backends"""
+	lines = ['%6s ' % 'depth' + ' '.join('%14s' % name for name in backends) + ' %9s' % 'speedup']
+	for row in rows:
+		lines.append('%6d ' % row['depth'] 
+					 + ' '.join('%14s' % convert_to_human_readable(row[name]) for name in backends) 
+					 + ' %8.1fx' % row['speedup'])
+	return '\n'.join(lines)
+
+
+DEFAULT_COLUMN_SIZES = (10000, 100000, 1000000)
+
+
+def benchmark_evaluate_many(sizes=DEFAULT_COLUMN_SIZES, expression='x*x - y + 3*x', seed=DEFAULT_SEED,
+							iterations=1, setup_executions=3, backend=CompiledExpression):
+	"""Time evaluating an expression over columns: calling it per row, 
+	evaluate_many on lists (the row loop), and (when importable) evaluate_many on NumPy arrays.
+	Returns a row per size with the average seconds per whole column.
+	"""
+	expression = backend(expression)
+	
+	rows = []
+	for size in sizes:
+		columns = dict((field, generate_uniform(size, seed + i)) 
+					   for i, field in enumerate(expression._fields))
+		arguments = zip(*[columns[field] for field in expression._fields])
+		
+		row = {'size': size}
+		row['per call'] = time_it(lambda: [expression(*args) for args in arguments],
+								  iterations=iterations, setup_executions=setup_executions)['statement avg']
+		row['loop'] = time_it(lambda: expression.evaluate_many(columns),
+							  iterations=iterations, setup_executions=setup_executions)['statement avg']
+		if stats.numpy is not None:
+			np_columns = dict((field, stats.numpy.array(column)) for field, column in columns.items())
+			row['numpy'] = time_it(lambda: expression.evaluate_many(np_columns),
+								   iterations=iterations, setup_executions=setup_executions)['statement avg']
+		
+		row['speedup'] = row['per call'] / (min(row.get('numpy', row['loop']), row['loop']) or 1e-12)
+		rows.append(row)
+	return rows
+
+
+def benchmark_expression_startup(count=1000, depth=8, backend=Expression, iterations=1, setup_executions=3):
+	"""Time getting count distinct expressions from an empty cache, parsing each (cold start),
+	against first loading them all from a bundle file (warm start).
+	"""
+	sources = ['%s + %d' % (generate_expression(depth), i) for i in range(count)]
+	
+	handle, path = tempfile.mkstemp(suffix='.json')
+	os.close(handle)
+	try:
+		write_expression_bundle(path, sources)
+		
+		def cold_start():
+			cache = ExpressionCache(count)
+			for source in sources:
+				cache.get(source, backend)
+		
+		def warm_start():
+			cache = ExpressionCache(count)
+			load_expression_bundle(path, cache)
+			for source in sources:
+				cache.get(source, backend)
+		
+		row = {'count': count, 'depth': depth, 'bundle bytes': os.path.getsize(path)}
+		row['cold'] = time_it(cold_start, iterations=iterations, setup_executions=setup_executions)['statement avg']
+		row['warm'] = time_it(warm_start, iterations=iterations, setup_executions=setup_executions)['statement avg']
+	finally:
+		os.remove(path)
+	
+	row['speedup'] = row['cold'] / (row['warm'] or 1e-12)
+	return row
+
+
+
+#
+# Differential fuzzing against eval
+#
+# Random expressions are evaluated by an expression backend and by Python itself,
+# and any disagreement (in value, type, or exception) is a bug in one of the parsers.
+# Constructs the expression language knowingly does differently are not generated:
+#   - 'in' is backwards and 'is' is identity of intermediate values
+#   - ** is left associative (so it is always parenthesized here)
+#   - comparisons don't chain (so they only appear in logical terms)
+#   - and/or are bitwise (so they only join comparisons, where that's the same)
+#   - no unary minus or invert
+# and/or are also eager: both sides are always evaluated, so where Python short circuits
+#   past an error the backend raises it (or raises a different one first). 
+#   Those are counted as 'eager', not as mismatches.
+#
+
+FUZZ_FIELDS = ('x', 'y', 'z')
+
+_FUZZ_ARITHMETIC = ('+', '-', '*', '/', '//', '%', '&', '|', '^')
+_FUZZ_COMPARISONS = ('<', '<=', '>', '>=', '==', '!=')
+_FUZZ_CONSTANTS = ('0', '1', '2', '3', '7', '0.5', '2.5', '10', 'math.pi')
+
+
+def generate_random_expression(rng, depth=4):
+	"""Returns a random well formed expression with up to depth levels of nested operations"""
+	
+	def arithmetic(depth):
+		choice = rng.random()
+		if depth <= 0 or choice < 0.15:
+			if rng.random() < 0.6:
+				return rng.choice(FUZZ_FIELDS)
+			return rng.choice(_FUZZ_CONSTANTS)
+		
+		if choice < 0.65:
+			term = '%s %s %s' % (arithmetic(depth - 1), rng.choice(_FUZZ_ARITHMETIC), arithmetic(depth - 1))
+		elif choice < 0.72:
+			term = '(%s) ** %d' % (arithmetic(depth - 1), rng.randint(0, 3))
+		elif choice < 0.77:
+			term = '%s %s %d' % (arithmetic(depth - 1), rng.choice(('<<', '>>')), rng.randint(0, 4))
+		elif choice < 0.84:
+			term = '%s(%s)' % (rng.choice(('max', 'min')), 
+							   ', '.join(arithmetic(depth - 1) for _ in range(rng.randint(2, 3))))
+		elif choice < 0.88:
+			return '%s.%s' % (rng.choice(FUZZ_FIELDS), rng.choice(('real', 'imag')))
+		elif choice < 0.92:
+			return 'v[%d]' % rng.randint(0, 2)
+		else:
+			return '(%s)' % logical(depth - 1)
+		
+		if rng.random() < 0.3:
+			return '(%s)' % term
+		return term
+	
+	def logical(depth):
+		choice = rng.random()
+		if depth <= 1 or choice < 0.6:
+			return '%s %s %s' % (arithmetic(depth - 1), rng.choice(_FUZZ_COMPARISONS), arithmetic(depth - 1))
+		if choice < 0.85:
+			return '%s %s %s' % (logical(depth - 1), rng.choice(('and', 'or')), logical(depth - 1))
+		return 'not %s' % logical(depth - 1)
+	
+	if rng.random() < 0.75:
+		return arithmetic(depth)
+	return logical(depth)
+
+
+def generate_random_arguments(rng):
+	"""Returns values for the fuzzed fields: a mix of ints and floats, plus the list v"""
+	arguments = dict((field, rng.choice((rng.randint(0, 9), rng.randint(0, 99), round(rng.uniform(0, 10), 2))))
+					 for field in FUZZ_FIELDS)
+	arguments['v'] = [rng.randint(0, 9) for _ in range(3)]
+	return arguments
+
+
+def _outcome(function):
+	"""Returns ('value', result) or ('error', exception type)"""
+	try:
+		return ('value', function())
+	except Exception, error:
+		return ('error', type(error))
+
+
+def _outcomes_agree(left, right):
+	if left[0] != right[0]:
+		return False
+	if left[0] == 'error':
+		return left[1] is right[1]
+	left, right = left[1], right[1]
+	if type(left) is not type(right):
+		return False
+	return left == right or (left != left and right != right) # NaN
+
+
+FUZZ_EVAL_GLOBALS = {'__builtins__': {'max': max, 'min': min}, 'math': math}
+
+
+def fuzz_expressions(count=1000, depth=4, seed=DEFAULT_SEED, backend=Expression, repeats=10):
+	"""Differentially test the backend against Python's eval on random expressions.
+	
+	Each expression is evaluated both ways (eval with true division, and nothing but 
+	max, min, and math available) and the outcomes must match: the same value and type, 
+	or the same exception (short circuits past an error are tallied as 'eager', since 
+	and/or always evaluate both sides). Where both succeed, each is timed for repeats calls, and the 
+	running ratio of backend to eval time is reported, so it can be tracked across releases.
+	Returns a report (ready for JSON, see write_benchmark_report) listing any mismatches.
+	"""
+	rng = random.Random(seed)
+	timer = default_timer
+	
+	report = {
+		'started': datetime.now().isoformat(' '),
+		'python': sys.version,
+		'backend': backend.__name__,
+		'count': count, 'depth': depth, 'seed': seed, 'repeats': repeats,
+		'agreed': 0,
+		'eager': 0,
+		'timed': 0,
+		'mismatches': [],
+		'backend seconds': 0.0,
+		'eval seconds': 0.0,
+	}
+	
+	for _ in xrange(count):
+		source = generate_random_expression(rng, depth)
+		arguments = generate_random_arguments(rng)
+		
+		code = compile(source, '<fuzz>', 'eval', __future__.division.compiler_flag)
+		built = _outcome(lambda: backend(source))
+		if built[0] == 'error':
+			report['mismatches'].append({'source': source, 'arguments': arguments, 
+										 'backend': 'failed to build: %s' % built[1].__name__})
+			continue
+		expression = built[1]
+		
+		bound = dict((field, arguments[field]) for field in expression._fields)
+		call_backend = lambda: expression(**bound)
+		call_eval = lambda: eval(code, FUZZ_EVAL_GLOBALS, arguments)
+		
+		result, expected = _outcome(call_backend), _outcome(call_eval)
+		if not _outcomes_agree(result, expected):
+			if result[0] == 'error' and (' and ' in source or ' or ' in source):
+				report['eager'] += 1
+				continue
+			report['mismatches'].append({'source': source, 'arguments': arguments, 
+										 'backend': repr(result[1]), 'eval': repr(expected[1])})
+			continue
+		report['agreed'] += 1
+		
+		if result[0] == 'value' and repeats:
+			start = timer()
+			for _ in xrange(repeats):
+				call_backend()
+			report['backend seconds'] += timer() - start
+			
+			start = timer()
+			for _ in xrange(repeats):
+				call_eval()
+			report['eval seconds'] += timer() - start
+			report['timed'] += 1
+	
+	report['ratio'] = report['backend seconds'] / (report['eval seconds'] or 1e-12)
+	report['finished'] = datetime.now().isoformat(' ')
+	return report
@@ -344,7 +344,26 @@ class Easing(object):
 
 	def interpolate_scale(self, fraction):
 		return self.start + (fraction * (self.span))
-	
+
+	def next_event(self, t):
+		"""The next time after t that the easing starts, steps, or finishes (None once it's finished)"""
+		if self.steps:
+			# stepped, t counts the steps taken (see normalize_time)
+			if self.step_by_count:
+				t_last = self.steps * 1.0
+			else:
+				t_last = self.time_span / self.steps
+			if t < 0:
+				return 0.0
+			if t >= t_last:
+				return None
+			return min(math.floor(t) + 1.0, t_last)
+
+		for t_event in (self.time_start, self.time_end):
+			if t < t_event:
+				return t_event
+		return None
+
 	
 	@property
 	def scale_bounds(self):
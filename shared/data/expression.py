@@ -3,10 +3,22 @@
 """
 
 import __builtin__
+import math
 import operator as op
 import tokenize
+from array import array
 from ast import literal_eval
+from itertools import imap, izip
+from json import dumps, loads
 from StringIO import StringIO
+from collections import OrderedDict, defaultdict
+from threading import RLock, local
+from timeit import default_timer
+
+try:
+	import numpy
+except ImportError:
+	numpy = None
 
 from shared.tools.enum import MetaEnum, Enum
 
@@ -16,7 +28,8 @@ __license__ = 'Apache 2.0'
 __maintainer__ = 'Andrew Geiger'
 __email__ = 'andrew.geiger@corsosystems.com'
 
-__all__ = ['Expression']
+__all__ = ['Expression', 'CompiledExpression', 'ExpressionCache', 'cached_expression', 'ExpressionProfiler',
+		   'write_expression_bundle', 'load_expression_bundle']
 
 TOKENS = MetaEnum(
      'TOKENS', 
@@ -172,6 +185,7 @@ def convert_to_postfix(expression):
 
 	# Handle the tokens gathered in order.
 	# Assume that tokens are provided in INFIX notation
+	previousTuple = (None, None)
 	for tokenTuple in tokens:
 		tokenType, token = tokenTuple
 		
@@ -196,8 +210,12 @@ def convert_to_postfix(expression):
 					
 					# Count the compounding
 					dots = 0
-					while opstack and opstack[-1][0] == tokenize.NAME:
+					while len(opstack) > dots and opstack[-1-dots][0] == tokenize.NAME:
 						dots += 1
+					# ... but an enclosing call's name is not part of this one (`max(min(x), y)`)
+					if not (len(opstack) > dots and opstack[-1-dots] == (tokenize.OP, '.')):
+						dots = 0
+					for i in range(dots):
 						output.append(opstack.pop())
 					for i in range(dots):
 						if opstack and opstack[-1][0] == tokenize.OP and opstack[-1][1] == '.':
@@ -214,7 +232,9 @@ def convert_to_postfix(expression):
 			else:
 				# If we're starting a parenthetical group, check if there's a name right before it.
 				#   If so, then assume it's a call, and add that to the stack instead of the '('
-				if token == '(' and output and (output[-1][0] == tokenize.NAME or output[-1] == (tokenize.OP, '.')):
+				#   (the name must be the previous token - `x - (y)` is not a call of x)
+				if (token == '(' and (previousTuple[0] == tokenize.NAME or previousTuple[1] == '__getitem__')
+					and output and (output[-1][0] == tokenize.NAME or output[-1] == (tokenize.OP, '.'))):
 					if output[-1] == (tokenize.OP, '.'):
 						opstack.append(output.pop())	
 						opstack.append(output.pop())
@@ -233,6 +253,10 @@ def convert_to_postfix(expression):
 				elif token == '.':
 					opstack.append(tokenTuple)
 				
+				# Prefix operators have no left operand, so nothing before them can be completed yet
+				elif token in one_argument_operators:
+					opstack.append(tokenTuple)
+				
 				# Otherwise it's a normal token that has to follow the rules of precedence
 				else:
 					# get the value of this token in relation to others
@@ -255,7 +279,8 @@ def convert_to_postfix(expression):
 			# check if this gets resolved as an attribute (effectively very high precedence operator, next to () )
 			if opstack and opstack[-1][1] == '.':
 				output.append(opstack.pop())
-			
+		
+		previousTuple = tokenTuple
 
 		# print '=> %s\n   %-50s\n   %s\n' % (tokenTuple, '   OPS >> %r' % opstack, '<< OUT    %r' % output)
 
@@ -283,6 +308,58 @@ whitelisted_builtins = set((
 ))
 
 
+# calls that always give the same result for the same inputs, and do nothing else
+pure_functions = set(
+	[value for value in vars(math).values() if isCallable(value)]
+	+ [max, min]
+)
+
+
+# Numbers never concatenate or repeat, so the plain operators do the same as the overloads
+# without probing types on every call (see Expression's signature).
+numeric_types = set((int, long, float, complex, bool))
+
+numeric_two_argument_operators = dict(two_argument_operators)
+numeric_two_argument_operators.update({
+	'+' : op.add,
+	'*' : op.mul,
+	'-' : op.sub,
+})
+
+# ... but these make (or take apart) things that aren't numbers, so can't be specialized
+non_numeric_operators = set((',', 'in', '__getitem__', 'is'))
+
+
+def is_numeric_specializable(postfixStack):
+	"""True if, given only numbers, every step of the expression only sees numbers, too"""
+	for tokenType, token in postfixStack:
+		if tokenType == tokenize.STRING:
+			return False
+		if tokenType == tokenize.OP and token in non_numeric_operators:
+			return False
+		if tokenType == tokenize.NAME and token in whitelisted_modules and token != 'math':
+			return False
+	return True
+
+
+def function_label(function):
+	"""A readable name for an expression's function (the operator token, for lambdas)"""
+	name = getattr(function, '__name__', None)
+	if name and name != '<lambda>':
+		return name
+	for token, operator in two_argument_operators.items():
+		if operator is function:
+			return token
+	return repr(function)
+
+
+def isPure(function):
+	try:
+		return function in pure_functions
+	except TypeError: # unhashable
+		return False
+
+
 class REF_TYPE(Enum):
 	CONSTANT = -2
 	ARGUMENT = -4
@@ -292,21 +369,172 @@ class REF_TYPE(Enum):
 
 class Expression(object):
 	
-	__slots__ = ('_fields', '_eval_func',
-				 '_arguments', '_constants', '_functions', '_externals'
+	__slots__ = ('_fields', '_eval_func', '_typed_func',
+				 '_arguments', '_constants', '_functions', '_externals',
+				 '_expression', '_postfix', '_options',
 				)
 	
-	def __init__(self, expression):
-		if isinstance(expression, str):
+	def __init__(self, expression, optimize=True, hoist_calls=False, signature=None, 
+				 parsed=None):
+		"""Optimizing evaluates operators on constants once, here, rather than every call
+		(and for CompiledExpression, reuses the result of identical subexpressions).
+		Hoisting calls does the same for pure calls, like math.sqrt(2), on constants.
+		
+		A signature declares the fields numeric: a type per field (in order, or as a dict),
+		or 'infer' to decide on the first call made with only numbers. Calls with only 
+		numbers then use plain arithmetic operators instead of the generic ones 
+		(that check for sequences every time). Anything else still takes the generic path.
+		
+		Parsed is the expression's (postfix stack, fields) if it's already been parsed,
+		like from a bundle (see read_expression_bundle), so it isn't parsed again.
+		"""
+		if parsed is not None:
+			self._expression = expression
+			postfixStack, fields = parsed
+			postfixStack = tuple(postfixStack)
+		elif isinstance(expression, str):
+			self._expression = expression
 			# convert the expression to something we can resolve reliably
 			postfixStack = convert_to_postfix(expression)
-			# ... and map it to the properties here
-			self._resolve_function(postfixStack)
+			fields = None
 		else:
-			self._resolve_function(expression)
+			self._expression = ' '.join(str(token) for _,token in expression)
+			postfixStack = tuple(expression)
+			fields = None
 		
-	def _resolve_function(self, postfixStack):
+		self._postfix = postfixStack
+		self._options = (optimize, hoist_calls)
 		
+		# ... and map it to the properties here
+		self._resolve_function(postfixStack, optimize, hoist_calls)
+		
+		if fields is not None and tuple(fields) != self._fields:
+			raise ValueError('Expression %r was parsed with fields %r, but resolves to %r' % (
+								self._expression, list(fields), list(self._fields)))
+		
+		self._typed_func = None
+		if signature == 'infer':
+			self._typed_func = self._infer_signature
+		elif signature is not None:
+			self._check_signature(signature)
+			self._typed_func = self._specialize()
+	
+	
+	def _check_signature(self, signature):
+		if isinstance(signature, dict):
+			missing = set(self._fields) - set(signature)
+			if missing:
+				raise TypeError('Signature is missing types for %r' % sorted(missing))
+			signature = [signature[field] for field in self._fields]
+		elif len(signature) != len(self._fields):
+			raise TypeError('Signature needs exactly %d type%s for %r (%d given)' % (
+								len(self._fields), 's' if len(self._fields) != 1 else '', list(self._fields), len(signature)))
+		
+		if not numeric_types.issuperset(signature):
+			raise TypeError('Only numeric signatures can be specialized, not %r' % (tuple(signature),))
+	
+	def _specialize(self):
+		"""Returns the evaluation function built with the numeric operators,
+		or None if the expression does anything with non-numbers (see is_numeric_specializable).
+		"""
+		if not is_numeric_specializable(self._postfix):
+			return None
+		typed = object.__new__(type(self))
+		typed._expression = self._expression
+		typed._resolve_function(self._postfix, *self._options, numeric=True)
+		return typed._eval_func
+	
+	def _infer_signature(self, *call):
+		"""Stands in for the typed function until the first call with only numbers"""
+		self._typed_func = self._specialize()
+		return (self._typed_func or self._eval_func)(*call)
+		
+	def _operand(self, refType, ix):
+		"""Returns a function of the call's arguments that resolves the referenced operand.
+		Constants resolve to themselves, since there's nothing to look up at call time.
+		"""
+		if refType == REF_TYPE.FUNCTION:
+			return self._functions[ix]
+		elif refType == REF_TYPE.ARGUMENT:
+			return op.itemgetter(ix)
+		else:
+			return lambda args, value=self._constants[ix]: value
+	
+	def _apply_one(self, function, refType, ix):
+		"""Close the function over its operand. The closure takes the call's arguments."""
+		if refType == REF_TYPE.CONSTANT:
+			return lambda args, function=function, c1=self._constants[ix]: function(c1)
+		else:
+			return lambda args, function=function, get1=self._operand(refType, ix): function(get1(args))
+	
+	def _apply_two(self, function, refType1, ix1, refType2, ix2):
+		"""Close the function over its two operands. The closure takes the call's arguments.
+		The operands are resolved when called, in order, and nothing is shared between calls.
+		"""
+		if refType1 == REF_TYPE.CONSTANT:
+			if refType2 == REF_TYPE.CONSTANT:
+				return lambda args, function=function, c1=self._constants[ix1], c2=self._constants[ix2]: function(
+										c1,
+										c2
+									)
+			else:
+				return lambda args, function=function, c1=self._constants[ix1], get2=self._operand(refType2, ix2): function(
+										c1,
+										get2(args)
+									)
+		else:
+			if refType2 == REF_TYPE.CONSTANT:
+				return lambda args, function=function, get1=self._operand(refType1, ix1), c2=self._constants[ix2]: function(
+										get1(args),
+										c2
+									)
+			else:
+				return lambda args, function=function, get1=self._operand(refType1, ix1), get2=self._operand(refType2, ix2): function(
+										get1(args),
+										get2(args)
+									)
+	
+	def _profiled(self, function, label, node=None):
+		"""Record the function's calls in the active ExpressionProfiler, if any.
+		That's only checked while building, so unprofiled expressions pay nothing for it.
+		"""
+		profiler = ExpressionProfiler.current()
+		if profiler is None:
+			return function
+		if node is None:
+			node = len(self._functions) + 1
+		source = '%s(%r)' % (type(self).__name__, self._expression)
+		return profiler.instrument(function, source, node, label)
+	
+	def _apply(self, function, operands, fold=False, label=None):
+		"""Returns the reference to the function applied to the operands (a list of references).
+		When folding and the operands are all constants, it is evaluated now into a new constant.
+		"""
+		if fold and all(refType == REF_TYPE.CONSTANT for refType,_ in operands):
+			try:
+				self._constants.append(function(*[self._constants[ix] for _,ix in operands]))
+				return (REF_TYPE.CONSTANT, len(self._constants) - 1)
+			except Exception:
+				pass # leave the error for call time, same as unoptimized
+		
+		function = self._profiled(function, label or function_label(function))
+		
+		if len(operands) == 1:
+			(argType1,argIx1), = operands
+			self._functions.append(self._apply_one(function, argType1, argIx1))
+		else:
+			(argType1,argIx1), (argType2,argIx2) = operands
+			self._functions.append(self._apply_two(function, argType1, argIx1, argType2, argIx2))
+		return (REF_TYPE.FUNCTION, len(self._functions) - 1)
+	
+	def _resolve_function(self, postfixStack, optimize=True, hoist_calls=False, numeric=False):
+		"""Build the closures for the postfix stack.
+		
+		Every closure takes the call's arguments (a tuple) and passes them down,
+		so evaluation is reentrant: one Expression can be called from many threads
+		at once, with no locking, since nothing is written to during a call.
+		"""
+		operators = numeric_two_argument_operators if numeric else two_argument_operators
 		self._arguments = []
 		self._constants = []
 		self._functions = []
@@ -319,15 +547,18 @@ class Expression(object):
 			REF_TYPE.CONSTANT: self._constants,
 			REF_TYPE.EXTERNAL: self._externals,
 		}
+		uses = {} # how many times each argument is referred to (see analyze_postfix)
 		
-		reference_names = {
-			REF_TYPE.FUNCTION: 'func',
-			REF_TYPE.ARGUMENT: 'args',
-			REF_TYPE.CONSTANT: 'const',
-			REF_TYPE.EXTERNAL: 'ext',
-		}
+		def attribute_name(ix):
+			"""The name after a dot was an attribute, not an argument, after all.
+			It's only a field if something else refers to it too (and if not, 
+			it was just added, so it's last and nothing has its index yet)."""
+			attribute = self._arguments[ix]
+			uses[attribute] -= 1
+			if not uses[attribute]:
+				self._arguments.pop(ix)
+			return attribute
 		
-	
 		for tokenType,token in postfixStack:
 
 			if tokenType == tokenize.OP:
@@ -341,25 +572,15 @@ class Expression(object):
 					
 					if argType1 == REF_TYPE.FUNCTION and self._functions[argIx1] in self._externals and argType2 == REF_TYPE.ARGUMENT:
 						
-						attribute = self._arguments.pop(argIx2)
+						attribute = attribute_name(argIx2)
 						
 						external = getattr(self._functions[argIx1], attribute)
 						self._externals.append(external)
 						
 						if isCallable(external):
-							argType3,argIx3 = opstack.pop()
-							argRef3 = references[argType3]
-							
-							if argType3 == REF_TYPE.FUNCTION:
-								self._functions.append(lambda function=external, ar1=argRef3, aix1=argIx3: function(
-													ar1[aix1]()
-												) )
-							else:
-								self._functions.append(lambda function=external, ar1=argRef3, aix1=argIx3: function(
-													ar1[aix1]
-												) )
-
-							opstack.append( (REF_TYPE.FUNCTION, len(self._functions) - 1) )
+							opstack.append(self._apply(external, [opstack.pop()], 
+													   fold=hoist_calls and isPure(external),
+													   label='%s.%s' % (self._functions[argIx1].__name__, attribute)))
 						else:
 							self._constants.append(external)
 							opstack.append( (REF_TYPE.CONSTANT, len(self._constants) - 1) )
@@ -369,22 +590,15 @@ class Expression(object):
 					# This is something like a.b where a is an argument and b is some sort of attribute of that type.
 					elif (argType1 == REF_TYPE.ARGUMENT or argType1 == REF_TYPE.FUNCTION) and argType2 == REF_TYPE.ARGUMENT:
 						
-						argRefs = references[argType1]
-	
-						attribute = self._arguments.pop(argIx2)
+						attribute = attribute_name(argIx2)
 						
 						# Treat as an attribute lookup on the first
-						# Check if it needs calling before resolution, though
-						if argType1 == REF_TYPE.ARGUMENT:
-							self._functions.append(lambda self=self, argRefs=argRefs, aix1=argIx1, attribute=attribute: getattr(
-													argRefs[aix1],
-													attribute
-												) )
-						else: # argType1 == REF_TYPE.FUNCTION:
-							self._functions.append(lambda self=self, argRefs=argRefs, aix1=argIx1, attribute=attribute: getattr(
-													argRefs[aix1](),
-													attribute
-												) )
+						# (resolving it first, if it's an argument or needs calling)
+						self._functions.append(lambda args, get1=self._operand(argType1, argIx1), attribute=attribute, 
+														   getattr=self._profiled(getattr, '.' + attribute): getattr(
+												get1(args),
+												attribute
+											) )
 
 						opstack.append( (REF_TYPE.FUNCTION, len(self._functions) - 1) )
 				
@@ -397,55 +611,15 @@ class Expression(object):
 				elif token in two_argument_operators: 
 					(argType2,argIx2), (argType1,argIx1) = opstack.pop(), opstack.pop()
 					
-					argRef1 = references[argType1]
-					argRef2 = references[argType2]
+					function = operators[token]
 					
-					function = two_argument_operators[token]
-					
-					# Resolve the way we call the arguments in
-					#   it needs a late binding, so it kind of has to be broken out like this 
-					#   (I don't know how to do this without adding more indirection)
-					if argType1 == REF_TYPE.FUNCTION:
-						if argType2 == REF_TYPE.FUNCTION:
-							self._functions.append(lambda self=self, function=function, ar1=argRef1, aix1=argIx1, ar2=argRef2, aix2=argIx2: function(
-												ar1[aix1](),
-												ar2[aix2]()
-											) )
-						else:
-							self._functions.append(lambda self=self, function=function, ar1=argRef1, aix1=argIx1, ar2=argRef2, aix2=argIx2: function(
-												ar1[aix1](),
-												ar2[aix2]
-											) )
-					else:
-						if argType2 == REF_TYPE.FUNCTION:
-							self._functions.append(lambda self=self, function=function, ar1=argRef1, aix1=argIx1, ar2=argRef2, aix2=argIx2: function(
-												ar1[aix1],
-												ar2[aix2]()
-											) )
-						else:
-							self._functions.append(lambda self=self, function=function, ar1=argRef1, aix1=argIx1, ar2=argRef2, aix2=argIx2: function(
-												ar1[aix1],
-												ar2[aix2]
-											) )
-							
-					opstack.append( (REF_TYPE.FUNCTION, len(self._functions) - 1) )
+					opstack.append(self._apply(function, [(argType1,argIx1), (argType2,argIx2)], fold=optimize))
 
 				if token in one_argument_operators:
 				
-					(argType1,argIx1)= opstack.pop()
+					function = one_argument_operators[token]
 					
-					argRef1 = references[argType1]
-					
-					if argType1 == REF_TYPE.FUNCTION:
-						self._functions.append(lambda self=self, function=function, ar1=argRef1, aix1=argIx1: function(
-											ar1[aix1]()
-										) )
-					else:
-						self._functions.append(lambda self=self, function=function, ar1=argRef1, aix1=argIx1: function(
-											ar1[aix1]
-										) )
-						
-					opstack.append( (REF_TYPE.FUNCTION, len(self._functions) - 1) )
+					opstack.append(self._apply(function, [opstack.pop()], fold=optimize))
 					
 			elif tokenType == tokenize.NAME:
 				# Check if it's a variable or module we trust
@@ -462,28 +636,18 @@ class Expression(object):
 					function = getattr(__builtin__,token)
 
 					self._externals.append(function)
-					#self._functions.append(self._externals[-1])
-					#opstack.append( (FUNCTION, len(self._functions) - 1) )
 
-					(argType1,argIx1)= opstack.pop()
-					
-					argRef1 = references[argType1]
-					
-					if argType1 == REF_TYPE.FUNCTION:
-						self._functions.append(lambda self=self, function=function, ar1=argRef1, aix1=argIx1: function(
-											ar1[aix1]()
-										) )
-					else:
-						self._functions.append(lambda self=self, function=function, ar1=argRef1, aix1=argIx1: function(
-											ar1[aix1]
-										) )
-						
-					opstack.append( (REF_TYPE.FUNCTION, len(self._functions) - 1) )                    
+					opstack.append(self._apply(function, [opstack.pop()], fold=hoist_calls))
 					
 				else:
 					if not token in self._arguments:
+						uses[token] = 1
 						self._arguments.append(token)
 						opstack.append( (REF_TYPE.ARGUMENT, len(self._arguments) - 1) )
+					else:
+						# repeated names refer back to the same argument
+						uses[token] += 1
+						opstack.append( (REF_TYPE.ARGUMENT, self._arguments.index(token)) )
 
 			elif tokenType == tokenize.NUMBER:
 				self._constants.append(literal_eval(token))
@@ -493,26 +657,686 @@ class Expression(object):
 				self._constants.append(str(token))
 				opstack.append( (REF_TYPE.CONSTANT, len(self._constants) - 1) )
 
-			# print 'Token: %s, %s' % (tokenTypeLookup[tokenType], token)
-			# print '  Opstack: ',['%s[%d]=%s' % (reference_names[t],ix,references[t][ix]) for t,ix in opstack]
-			
 		self._fields = tuple(self._arguments)
 		self._arguments[:] = []
 		
 		opType,opIx = opstack.pop()
-		if opType in (REF_TYPE.CONSTANT, REF_TYPE.ARGUMENT):
-			self._eval_func = lambda: references[opType][opIx]
-		else:
-			self._eval_func = references[opType][opIx]
+		self._eval_func = self._profiled(self._operand(opType, opIx), '<expression>', node=0)
 
 
-	def __call__(self, *args, **kwargs):
+	def _bind_arguments(self, args, kwargs):
+		"""Line up the call's arguments with the expression's fields"""
 		if kwargs:
-			self._arguments[:] = [kwargs.get(field, args[i] if len(args) > i else None) for i,field  in enumerate(self._fields)]
-		else:
-			self._arguments[:] = args
+			args = tuple(kwargs.get(field, args[i] if len(args) > i else None) for i,field  in enumerate(self._fields))
 		
-		if len(self._arguments) < len(self._fields):
+		if len(args) < len(self._fields):
 			raise TypeError('Expression takes exactly %d argument%s: %r (%d given)' % (
-								len(self._fields), 's' if len(self._fields) > 1 else '', list(self._fields), len(self._arguments)))     
-		return self._eval_func()    
+								len(self._fields), 's' if len(self._fields) > 1 else '', list(self._fields), len(args)))     
+		return args
+
+
+	def __call__(self, *args, **kwargs):
+		args = self._bind_arguments(args, kwargs)
+		if self._typed_func is not None and numeric_types.issuperset(imap(type, args)):
+			return self._typed_func(args)
+		return self._eval_func(args)
+
+
+	def evaluate_many(self, columns, vectorize=True):
+		"""Evaluate the expression for every row of the columns, returning the output column.
+		
+		Columns are a dict of equal length sequences keyed by field name,
+		or a dataset (converted with shared.tools.data.datasetToDictList).
+		
+		When NumPy is available and every column read is a NumPy array or a 
+		numeric array.array, the expression is evaluated once on the whole columns
+		and a NumPy array is returned. That follows NumPy's rules (integers wrap
+		on overflow, dividing by zero gives inf or nan), so pass vectorize=False
+		to insist on Python's. Otherwise - or if NumPy can't do it elementwise - 
+		this falls back to a tight loop over the rows, returning a list.
+		"""
+		if hasattr(columns, 'getColumnNames'):
+			from shared.tools.data import datasetToDictList
+			rows = columns.getRowCount()
+			columns = datasetToDictList(columns)
+		else:
+			rows = None
+		
+		try:
+			field_columns = [columns[field] for field in self._fields]
+		except KeyError, error:
+			raise TypeError('Expression needs columns for %r (missing %s)' % (list(self._fields), error))
+		
+		# every column, not just the ones read, so ragged input fails the same on either path
+		lengths = dict((name, len(column)) for name, column in columns.items())
+		if len(set(lengths.values())) > 1:
+			raise ValueError('Columns must all be the same length (got lengths %r)' % sorted(lengths.items()))
+		lengths = set(lengths.values())
+		if rows is None:
+			rows = lengths.pop() if lengths else 0
+		
+		# nothing varies, so it's the same for every row
+		if not field_columns:
+			return [self._evaluate_once(())] * rows
+		
+		if vectorize and numpy is not None:
+			arrays = _as_ndarrays(field_columns)
+			if arrays is not None:
+				try:
+					result = self._evaluate_once(arrays)
+				except Exception:
+					result = None
+				if isinstance(result, numpy.ndarray) and result.shape == (rows,):
+					return result
+		
+		return self._evaluate_rows(field_columns)
+
+
+	def _evaluate_once(self, values):
+		return self._eval_func(tuple(values))
+	
+	def _evaluate_rows(self, columns):
+		return map(self._eval_func, izip(*columns))
+
+
+# array.array typecodes that NumPy reads as the same type
+_NUMPY_TYPECODES = set('bBhHiIlLfd')
+
+
+def _as_ndarrays(columns):
+	"""Returns the columns as NumPy arrays (viewing array.array buffers, not copying)
+	or None if any of them isn't a numeric array.
+	"""
+	arrays = []
+	for column in columns:
+		if isinstance(column, numpy.ndarray):
+			arrays.append(column)
+		elif isinstance(column, array) and column.typecode in _NUMPY_TYPECODES:
+			arrays.append(numpy.frombuffer(column, dtype=column.typecode))
+		else:
+			return None
+	return arrays
+
+
+
+# Operators that behave exactly like the plain Python syntax can be inlined when compiling.
+# (Note that 'in' is backwards, since it's op.contains, and '__getitem__' is too.)
+inline_operators = {
+	'-' : '%(left)s - %(right)s',
+	'//': '%(left)s // %(right)s',
+	'%' : '%(left)s %% %(right)s',
+	'**': '%(left)s ** %(right)s',
+	'&' : '%(left)s & %(right)s', 'and': '%(left)s & %(right)s',
+	'^' : '%(left)s ^ %(right)s',
+	'|' : '%(left)s | %(right)s', 'or': '%(left)s | %(right)s',
+	'<<': '%(left)s << %(right)s',
+	'>>': '%(left)s >> %(right)s',
+	'<' : '%(left)s < %(right)s',
+	'<=': '%(left)s <= %(right)s',
+	'==': '%(left)s == %(right)s',
+	'!=': '%(left)s != %(right)s',
+	'>=': '%(left)s >= %(right)s',
+	'>' : '%(left)s > %(right)s',
+	'is': '%(left)s is %(right)s',
+	'in': '%(right)s in %(left)s',
+	'__getitem__': '%(right)s[%(left)s]',
+}
+
+inline_one_argument_operators = {
+	'not': 'not %(operand)s', '!': 'not %(operand)s',
+}
+
+# ... and when only numbers are involved, so can the overloaded ones
+numeric_inline_operators = dict(inline_operators)
+numeric_inline_operators.update({
+	'+' : '%(left)s + %(right)s',
+	'*' : '%(left)s * %(right)s',
+})
+
+
+def analyze_postfix(postfixStack):
+	"""Resolve a postfix stack into a tree of nodes, following the same rules as Expression.
+	
+	Nodes are tuples:
+	  ('constant', index)                 constants[index]
+	  ('argument', name)                  the call's argument for that field
+	  ('module', index)                   a whitelisted module in externals[index]
+	  ('call', index, operand)            externals[index](operand)
+	  ('attribute', name, operand)        getattr(operand, name)
+	  ('operator', token, left, right)    two_argument_operators[token](left, right)
+	  ('unary', token, operand)           one_argument_operators[token](operand)
+	
+	Returns the root node, the fields (argument names in order), and the constants and externals.
+	"""
+	fields = []
+	references = {} # how many times each name is used as an argument
+	constants = []
+	externals = []
+	stack = []
+	
+	for tokenType, token in postfixStack:
+		
+		if tokenType == tokenize.OP:
+			
+			if token == '.':
+				node2, node1 = stack.pop(), stack.pop()
+				
+				if node2[0] != 'argument':
+					raise AttributeError('Not sure what to do with this:\nArg 1: %r\nArg 2: %r' % (node1, node2))
+				
+				# the name after the dot was an attribute, not an argument, after all
+				attribute = node2[1]
+				references[attribute] -= 1
+				if not references[attribute]:
+					fields.remove(attribute)
+				
+				if node1[0] == 'module':
+					external = getattr(externals[node1[1]], attribute)
+					
+					if isCallable(external):
+						externals.append(external)
+						stack.append( ('call', len(externals) - 1, stack.pop()) )
+					else:
+						constants.append(external)
+						stack.append( ('constant', len(constants) - 1) )
+				
+				elif node1[0] != 'constant':
+					stack.append( ('attribute', attribute, node1) )
+				
+				else:
+					raise AttributeError('Not sure what to do with this:\nArg 1: %r\nArg 2: %r' % (node1, node2))
+			
+			elif token in two_argument_operators:
+				right, left = stack.pop(), stack.pop()
+				stack.append( ('operator', token, left, right) )
+			
+			if token in one_argument_operators:
+				stack.append( ('unary', token, stack.pop()) )
+		
+		elif tokenType == tokenize.NAME:
+			if token in whitelisted_modules:
+				externals.append(__import__(token))
+				stack.append( ('module', len(externals) - 1) )
+			
+			elif token in whitelisted_builtins:
+				externals.append(getattr(__builtin__,token))
+				stack.append( ('call', len(externals) - 1, stack.pop()) )
+			
+			else:
+				if not token in references:
+					references[token] = 0
+				if not references[token]:
+					fields.append(token)
+				references[token] += 1
+				stack.append( ('argument', token) )
+		
+		elif tokenType == tokenize.NUMBER:
+			constants.append(literal_eval(token))
+			stack.append( ('constant', len(constants) - 1) )
+		
+		elif tokenType == tokenize.STRING:
+			constants.append(str(token))
+			stack.append( ('constant', len(constants) - 1) )
+	
+	return stack.pop(), tuple(fields), constants, externals
+
+
+def optimize_tree(root, constants, externals, fold_constants=True, hoist_calls=False):
+	"""Returns the tree with its constant parts evaluated once, now.
+	
+	Operators whose operands are all constants are folded into a new constant
+	(appended to constants), and with hoist_calls so are pure calls (see pure_functions).
+	Anything that raises is left alone, so the error still happens when called.
+	Equal constants (and calls to the same function) share one index, so identical 
+	subtrees compare equal (which is how generate_source recognizes them to reuse).
+	"""
+	canonical = {}
+	called = {}
+	
+	def constant(ix):
+		# repr, since 0 == 0.0 == -0.0 == False, but they don't act the same
+		value = constants[ix]
+		return ('constant', canonical.setdefault((type(value), repr(value)), ix))
+	
+	def fold(function, operands):
+		try:
+			constants.append(function(*[constants[operand[1]] for operand in operands]))
+		except Exception:
+			return None
+		return constant(len(constants) - 1)
+	
+	def visit(node):
+		kind = node[0]
+		
+		if kind == 'constant':
+			return constant(node[1])
+		
+		if kind == 'operator':
+			token, left, right = node[1], visit(node[2]), visit(node[3])
+			if fold_constants and left[0] == right[0] == 'constant':
+				folded = fold(two_argument_operators[token], (left, right))
+				if folded:
+					return folded
+			return ('operator', token, left, right)
+		
+		if kind == 'unary':
+			token, operand = node[1], visit(node[2])
+			if fold_constants and operand[0] == 'constant':
+				folded = fold(one_argument_operators[token], (operand,))
+				if folded:
+					return folded
+			return ('unary', token, operand)
+		
+		if kind == 'call':
+			ix, operand = called.setdefault(id(externals[node[1]]), node[1]), visit(node[2])
+			if hoist_calls and operand[0] == 'constant' and isPure(externals[ix]):
+				folded = fold(externals[ix], (operand,))
+				if folded:
+					return folded
+			return ('call', ix, operand)
+		
+		if kind == 'attribute':
+			return ('attribute', node[1], visit(node[2]))
+		
+		return node
+	
+	return visit(root)
+
+
+def generate_source(root, fields, constants, externals, reuse_subexpressions=False, numeric=False):
+	"""Write out the tree as the source of one flat function, one operation per line.
+	
+	The function is wrapped in a builder that takes the constants, externals, 
+	and operator functions it needs, so they are closed over (fast lookups) 
+	rather than globals. Returns the source and the values to pass the builder.
+	
+	Reusing subexpressions computes identical subtrees once, like min(x,y)*min(x,y).
+	Only subtrees of operators and pure calls (see pure_functions) are reused:
+	an attribute could be a property that does something different every time.
+	Numeric inlines the arithmetic operators, too (see is_numeric_specializable).
+	"""
+	inlined = numeric_inline_operators if numeric else inline_operators
+	bindings = []      # builder parameter names
+	bound_values = []  # ... and the values for them
+	bound_ids = {}
+	
+	def bind(prefix, value):
+		if id(value) not in bound_ids:
+			bound_ids[id(value)] = '_%s%d' % (prefix, len(bindings))
+			bindings.append(bound_ids[id(value)])
+			bound_values.append(value)
+		return bound_ids[id(value)]
+	
+	parameters = ['_a%d' % i for i in range(len(fields))]
+	lines = []
+	emitted = {}
+	reusable = {}
+	
+	def is_reusable(node):
+		"""True if computing the node once gives the same as computing it each time it appears"""
+		if node not in reusable:
+			kind = node[0]
+			if kind in ('argument', 'constant', 'module'):
+				reusable[node] = True
+			elif kind == 'operator':
+				reusable[node] = is_reusable(node[2]) and is_reusable(node[3])
+			elif kind == 'unary':
+				reusable[node] = is_reusable(node[2])
+			elif kind == 'call':
+				reusable[node] = isPure(externals[node[1]]) and is_reusable(node[2])
+			else:
+				reusable[node] = False
+		return reusable[node]
+	
+	def emit(node):
+		"""Returns the name (or literal expression) holding the node's value"""
+		kind = node[0]
+		
+		if reuse_subexpressions and node in emitted:
+			return emitted[node]
+		
+		if kind == 'argument':
+			return parameters[fields.index(node[1])]
+		if kind == 'constant':
+			return bind('k', constants[node[1]])
+		if kind == 'module':
+			return bind('x', externals[node[1]])
+		
+		if kind == 'operator':
+			token, left, right = node[1:]
+			arguments = {'left': emit(left), 'right': emit(right)}
+			if token in inlined:
+				statement = inlined[token] % arguments
+			else:
+				statement = '%s(%s, %s)' % (bind('o', two_argument_operators[token]), arguments['left'], arguments['right'])
+		elif kind == 'unary':
+			token, operand = node[1:]
+			statement = inline_one_argument_operators[token] % {'operand': emit(operand)}
+		elif kind == 'call':
+			ix, operand = node[1:]
+			statement = '%s(%s)' % (bind('x', externals[ix]), emit(operand))
+		elif kind == 'attribute':
+			name, operand = node[1:]
+			statement = '%s.%s' % (emit(operand), name)
+		else:
+			raise ValueError('Unknown expression node: %r' % (node,))
+		
+		temporary = '_t%d' % len(lines)
+		lines.append('%s = %s' % (temporary, statement))
+		if reuse_subexpressions and is_reusable(node):
+			emitted[node] = temporary
+		return temporary
+	
+	result = emit(root)
+	
+	source = '\n'.join(
+		['def _build(%s):' % ', '.join(bindings),
+		 '\tdef _expression(%s):' % ', '.join(parameters)]
+		+ ['\t\t%s' % line for line in lines]
+		+ ['\t\treturn %s' % result,
+		   '\treturn _expression'])
+	
+	return source, bound_values
+
+
+def compile_source(source, bound_values):
+	"""Compile the builder source once and return the flat function"""
+	namespace = {}
+	exec compile(source + '\n', '<expression>', 'exec') in namespace
+	return namespace['_build'](*bound_values)
+
+
+
+class CompiledExpression(Expression):
+	"""An Expression compiled into a single flat Python function.
+	
+	The postfix stack is resolved with the same rules and whitelists as 
+	Expression, but instead of a tree of closures passing the arguments down,
+	it is written out as Python source (see generate_source) and compiled once.
+	Each call is then a single function call with the arguments as locals,
+	so like Expression it is safe to share across threads.
+	"""
+	__slots__ = ('_source',)
+	
+	def _resolve_function(self, postfixStack, optimize=True, hoist_calls=False, numeric=False):
+		root, self._fields, self._constants, self._externals = analyze_postfix(postfixStack)
+		self._arguments = []
+		self._functions = []
+		
+		if optimize or hoist_calls:
+			root = optimize_tree(root, self._constants, self._externals, optimize, hoist_calls)
+		
+		self._source, bound_values = generate_source(root, self._fields, self._constants, self._externals,
+													 reuse_subexpressions=optimize, numeric=numeric)
+		
+		if ExpressionProfiler.current() is not None:
+			bound_values = [self._profiled(value, function_label(value), node=ix + 1) if isCallable(value) else value
+							for ix, value in enumerate(bound_values)]
+		
+		self._eval_func = self._profiled(compile_source(self._source, bound_values), '<expression>', node=0)
+	
+	
+	def __call__(self, *args, **kwargs):
+		if kwargs or len(args) != len(self._fields):
+			args = self._bind_arguments(args, kwargs)[:len(self._fields)]
+		if self._typed_func is not None and numeric_types.issuperset(imap(type, args)):
+			return self._typed_func(*args)
+		return self._eval_func(*args)
+	
+	
+	def _evaluate_once(self, values):
+		return self._eval_func(*values)
+	
+	def _evaluate_rows(self, columns):
+		return map(self._eval_func, *columns)
+
+
+
+
+def normalize_source(source):
+	"""Collapse the whitespace in the source, so trivially different spellings share a cache entry.
+	Whitespace inside string literals matters, so anything quoted is only stripped.
+	"""
+	source = source.strip()
+	if "'" in source or '"' in source:
+		return source
+	return ' '.join(source.split())
+
+
+class ExpressionCache(object):
+	"""A bounded, least recently used cache of built expressions, keyed by normalized source.
+	
+	Expressions keep no state between calls, so one instance can be handed out
+	to everything that asks for the same source (on any thread).
+	Hits and misses are counted to see if the cache is earning its keep.
+	"""
+	__slots__ = ('capacity', 'hits', 'misses', '_entries', '_precompiled', '_lock')
+	
+	def __init__(self, capacity=256):
+		self.capacity = capacity
+		self.hits = 0
+		self.misses = 0
+		self._entries = OrderedDict()
+		self._precompiled = {} # normalized source: (postfix stack, fields)
+		self._lock = RLock()
+	
+	def preload(self, source, postfix, fields):
+		"""Remember the source's postfix stack and fields, so building it later skips parsing"""
+		with self._lock:
+			self._precompiled[normalize_source(source)] = (postfix, fields)
+	
+	def sources(self):
+		"""Every (normalized) source cached or preloaded"""
+		with self._lock:
+			return set(key[1] for key in self._entries) | set(self._precompiled)
+	
+	def get(self, source, backend=Expression, **options):
+		"""Returns the backend's expression for the source (built with the options, like a signature), 
+		building it only if it isn't cached.
+		"""
+		# profiled expressions are instrumented as they're built, so don't share them
+		if not isinstance(source, basestring) or ExpressionProfiler.current() is not None:
+			return backend(source, **options)
+		
+		key = (backend, normalize_source(source), tuple(sorted(options.items())))
+		try:
+			hash(key)
+		except TypeError: # like a dict signature
+			return backend(source, **options)
+		
+		with self._lock:
+			try:
+				expression = self._entries.pop(key)
+			except KeyError:
+				pass
+			else:
+				self.hits += 1
+				self._entries[key] = expression # most recently used is last
+				return expression
+			self.misses += 1
+		
+		# build outside the lock, so a slow parse doesn't hold up other lookups
+		expression = backend(source, parsed=self._precompiled.get(key[1]), **options)
+		
+		with self._lock:
+			self._entries[key] = expression
+			while len(self._entries) > self.capacity:
+				self._entries.popitem(last=False)
+		return expression
+	
+	def clear(self):
+		with self._lock:
+			self._entries.clear()
+			self._precompiled.clear()
+			self.hits = 0
+			self.misses = 0
+	
+	def __len__(self):
+		return len(self._entries)
+	
+	@property
+	def statistics(self):
+		return {
+			'hits': self.hits,
+			'misses': self.misses,
+			'size': len(self._entries),
+			'capacity': self.capacity,
+		}
+
+
+EXPRESSION_CACHE = ExpressionCache()
+
+
+def cached_expression(source, backend=Expression, **options):
+	"""Returns a shared expression for the source from EXPRESSION_CACHE"""
+	return EXPRESSION_CACHE.get(source, backend, **options)
+
+
+
+#
+# Bundles of parsed expressions
+#
+# Parsing is most of the cost of building an expression, and it's the same every time.
+# A bundle is a JSON file of the postfix stacks (and fields) of many expressions,
+# keyed by normalized source, so they can all be read at once on startup.
+#
+# The version changes whenever parsing does (2: calls and groups after operators),
+#   since a bundle holds the parser's output and would otherwise outlive a fix.
+#
+
+EXPRESSION_BUNDLE_VERSION = 2
+
+
+def write_expression_bundle(path, sources=None, cache=EXPRESSION_CACHE):
+	"""Save the parsed form of the expressions to path (by default, everything the cache has seen).
+	Returns how many expressions were written.
+	"""
+	if sources is None:
+		sources = cache.sources()
+	
+	expressions = {}
+	for source in sources:
+		postfix = convert_to_postfix(source)
+		expressions[normalize_source(source)] = {
+			'postfix': [[int(tokenType), token] for tokenType, token in postfix],
+			'fields': list(analyze_postfix(postfix)[1]),
+		}
+	
+	with open(path, 'w') as f:
+		f.write(dumps({'version': EXPRESSION_BUNDLE_VERSION, 'expressions': expressions}, 
+					  separators=(',',':'), sort_keys=True))
+	return len(expressions)
+
+
+def _native(text):
+	"""JSON reads strings back as unicode, but tokens are plain strings (when they can be)"""
+	try:
+		return str(text)
+	except UnicodeEncodeError:
+		return text
+
+
+def read_expression_bundle(path):
+	"""Returns {normalized source: (postfix stack, fields)} for the bundle at path"""
+	with open(path, 'r') as f:
+		bundle = loads(f.read())
+	
+	if bundle.get('version') != EXPRESSION_BUNDLE_VERSION:
+		raise ValueError('Expression bundle %r is version %r, but only version %r can be read' % (
+							path, bundle.get('version'), EXPRESSION_BUNDLE_VERSION))
+	
+	return dict(
+		(_native(source), (
+			tuple((tokenTypeLookup[tokenType], _native(token)) for tokenType, token in entry['postfix']),
+			tuple(_native(field) for field in entry['fields']),
+		))
+		for source, entry in bundle['expressions'].items()
+	)
+
+
+def load_expression_bundle(path, cache=EXPRESSION_CACHE):
+	"""Preload the cache with a bundle, so getting any of its expressions skips parsing.
+	Returns how many expressions were loaded.
+	"""
+	bundle = read_expression_bundle(path)
+	for source, (postfix, fields) in bundle.items():
+		cache.preload(source, postfix, fields)
+	return len(bundle)
+
+
+
+
+class ExpressionProfiler(object):
+	"""Opt-in call counts and timing for expressions, per expression and per operator.
+	
+	Expressions built while a profiler is active (in its with block, on the same thread) 
+	record into it for as long as they are used. Anything built otherwise - including
+	on other threads meanwhile - has no instrumentation at all.
+	The closure backend (Expression) records each operator, attribute lookup, and call.
+	CompiledExpression inlines most operators, so it only records the functions it calls.
+	
+	Results are compatible with pstats, so shared.tools.profile.log_profile reports them.
+	Entries are keyed by the expression (its backend and source), the node's position 
+	in it (0 is the whole expression), and the operator's function. The whole expression's own time
+	is the overhead outside of its operators, like binding the arguments.
+	Counts are not locked, so profile one thread at a time for exact numbers.
+	
+	>>> profiler = ExpressionProfiler()
+	>>> with profiler:
+	...     expression = Expression('x * 2 + y')
+	>>> expression(3, 4)
+	10
+	>>> sorted((node, label, calls) for (source, node, label), (calls, seconds) in profiler.timings.items())
+	[(0, '<expression>', 1), (1, 'overload_mul_rep', 1), (2, 'overload_concat_add', 1)]
+	"""
+	_threads = local() # each thread's stack of active profilers
+	
+	def __init__(self):
+		self.timings = {} # (source, node, label): [calls, seconds]
+		self.stats = {}
+	
+	@classmethod
+	def current(cls):
+		"""The profiler active on this thread, if any"""
+		active = getattr(cls._threads, 'active', None)
+		return active[-1] if active else None
+	
+	def __enter__(self):
+		try:
+			self._threads.active.append(self)
+		except AttributeError:
+			self._threads.active = [self]
+		return self
+	
+	def __exit__(self, exc_type, exc_value, exc_traceback):
+		self._threads.active.pop()
+	
+	def instrument(self, function, source, node, label):
+		"""Returns the function wrapped to count its calls and their time"""
+		timing = self.timings.setdefault((source, node, label), [0, 0.0])
+		timer = default_timer
+		
+		def profiled(*args):
+			start = timer()
+			try:
+				return function(*args)
+			finally:
+				timing[1] += timer() - start
+				timing[0] += 1
+		return profiled
+	
+	def reset(self):
+		for timing in self.timings.values():
+			timing[:] = [0, 0.0]
+	
+	def create_stats(self):
+		"""Fill in stats the way pstats expects: {(file, line, function): (primitive calls, calls, own, cumulative, callers)}"""
+		operator_seconds = defaultdict(float)
+		for (source, node, label), (calls, seconds) in self.timings.items():
+			if node:
+				operator_seconds[source] += seconds
+		
+		self.stats = {}
+		for (source, node, label), (calls, seconds) in self.timings.items():
+			own = seconds if node else max(0.0, seconds - operator_seconds[source])
+			self.stats[(source, node, label)] = (calls, calls, own, seconds, {})
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""
+	Monte Carlo ensembles of simulators
+
+	The definition is parsed once, and each member is a fresh Process built from it,
+	with its own random.Random and start values. Members run concurrently and each is
+	summarized as it steps (in constant memory), then the summaries are
+	combined per variable with the shared.data.stats combiners.
+"""
+from copy import deepcopy
+import random
+
+from shared.data.stats import RunningDescription, describe, reduce_descriptions, parallel_map, StatisticsError
+from shared.data.simulators.process import parse_simulator, simulator_class
+
+
+def member_start_values(start, seed):
+	"""
+	Resolve the start value overrides for the member with the given seed.
+	Start may be None, a dict (the same for every member), or a callable
+	that takes a random.Random (seeded for the member) and returns a dict.
+	The seed may also be the member's random.Random itself, to draw from.
+	"""
+	if start is None:
+		return {}
+	if callable(start):
+		return start(seed if isinstance(seed, random.Random) else random.Random(seed))
+	return dict(start)
+
+
+def run_member(Simulator, configuration, n_steps, seed, start_values=None, variables=None, generator=None):
+	"""
+	Build one member from the parsed configuration, step it n_steps times, and summarize it.
+	
+	The member's functions draw from the generator (a random.Random), 
+	or if there isn't one, a random.Random seeded with seed (see Process).
+
+	Returns the member's seed, its final state and values, and a description
+	of each numeric variable over the run (None if it had no numbers).
+	"""
+	configuration = deepcopy(configuration) # the Process keeps (and amends) its configuration
+	configuration['seed'] = seed if generator is None else generator
+	if start_values:
+		configuration['start'] = dict(configuration.get('start') or {}, **start_values)
+
+	simulator = Simulator(**configuration)
+
+	current = simulator._variables
+	if variables is None:
+		variables = sorted(variable for variable in current if not variable.startswith('_'))
+
+	accumulators = [(RunningDescription(), variable) for variable in variables]
+	numeric = dict((variable, True) for variable in variables)
+
+	step = simulator.step
+	for _ in xrange(n_steps):
+		step()
+		for accumulator, variable in accumulators:
+			try:
+				accumulator.push(current[variable])
+			except TypeError: # not a number, so there's nothing to describe
+				numeric[variable] = False
+
+	descriptions = {}
+	for accumulator, variable in accumulators:
+		try:
+			descriptions[variable] = accumulator.describe() if numeric[variable] else None
+		except StatisticsError:
+			descriptions[variable] = None
+
+	return {
+		'seed': seed,
+		'state': simulator.state,
+		'final': dict((variable, current[variable]) for variable in variables),
+		'descriptions': descriptions,
+	}
+
+
+def _run_member_process(arguments):
+	"""Run a member in another process (module level so it pickles)"""
+	mixins, mixins_package, configuration, n_steps, seed, start_values, variables, generator = arguments
+	Simulator = simulator_class(mixins, mixins_package)
+	return run_member(Simulator, configuration, n_steps, seed, start_values, variables, generator)
+
+
+def summarize_members(members):
+	"""
+	Reduce member summaries to an ensemble summary, per variable:
+	  'final'   - description of the final values across members
+	  'overall' - description of every value of every member's run
+	and how many members ended in each state.
+	"""
+	variables = set()
+	for member in members:
+		variables.update(member['descriptions'])
+
+	final = {}
+	overall = {}
+	for variable in sorted(variables):
+		try:
+			final[variable] = describe(member['final'].get(variable) for member in members)
+		except (StatisticsError, TypeError):
+			final[variable] = None
+		try:
+			overall[variable] = reduce_descriptions(member['descriptions'].get(variable)
+													for member in members)
+		except StatisticsError:
+			overall[variable] = None
+
+	states = {}
+	for member in members:
+		states[member['state']] = states.get(member['state'], 0) + 1
+
+	return {
+		'members': len(members),
+		'seeds': [member['seed'] for member in members],
+		'states': states,
+		'final': final,
+		'overall': overall,
+	}
+
+
+def run_ensemble(definition, n_members, n_steps, seed=0, start=None, variables=None,
+				 workers=4, processes=False, mixins_package='shared.data.simulators.mixins'):
+	"""
+	Run n_members simulations of the same definition for n_steps each, and summarize them.
+
+	The definition is the YAML text, parsed once, or the (Simulator, configuration) pair
+	parse_simulator returns (so Python functions can be added to the configuration).
+	Member i gets a random.Random seeded with seed + i, which draws its start values
+	(see member_start_values) and then is handed to its simulation (see Process), 
+	so the same seeds make the same ensemble however the members are run.
+	
+	By default a pool of threads does the work, which runs in parallel on Jython
+	(and the members share the compiled expressions). On CPython, set processes=True
+	to use a multiprocessing pool instead (see shared.data.stats.parallel_map).
+
+	Returns the summary from summarize_members, with each member's summary under 'runs'.
+	"""
+	if isinstance(definition, tuple):
+		Simulator, configuration = definition
+	else:
+		Simulator, configuration = parse_simulator(definition, mixins_package)
+
+	seeds = [seed + ix for ix in range(n_members)]
+	generators = [random.Random(member_seed) for member_seed in seeds]
+	starts = [member_start_values(start, generator) for generator in generators]
+	members = zip(seeds, starts, generators)
+
+	if processes:
+		members = parallel_map(_run_member_process, [
+				(Simulator._mixins, Simulator._mixins_package, configuration,
+				 n_steps, member_seed, start_values, variables, generator)
+				for member_seed, start_values, generator in members], 
+			workers, processes=True)
+	else:
+		members = parallel_map(lambda (member_seed, start_values, generator): 
+								   run_member(Simulator, configuration, n_steps, 
+											  member_seed, start_values, variables, generator), 
+							   members, workers, name='simulator-ensemble')
+
+	summary = summarize_members(members)
+	summary['steps'] = n_steps
+	summary['runs'] = members
+	return summary
@@ -1,5 +1,5 @@
 from shared.data.simulators.mixins.support import MixinFunctionSupport
-from shared.data.expression import Expression
+from shared.data.expression import Expression, cached_expression
 
 
 class ExpressionMixin(MixinFunctionSupport):
@@ -10,7 +10,9 @@ class ExpressionMixin(MixinFunctionSupport):
 		return {}
 		
 	def _configure_function_(self, expression):
-		return Expression(expression)
+		# cached, so rebuilding after a state change doesn't parse again
+		# (and simulations are mostly numbers, so let it specialize for them)
+		return cached_expression(expression, signature='infer')
 
 	# Additional overrides to intercept configuration
 	
@@ -30,10 +32,18 @@ class ExpressionMixin(MixinFunctionSupport):
 		if isinstance(some_callable, Expression):
 			return some_callable._fields
 		return super(ExpressionMixin, self)._resolve_arguments(some_callable)
+
+
+	def _resolve_purity(self, some_callable):
+		# expressions only compute on their arguments
+		# (and an argument that can change in place is taken to change every step, see Process)
+		if isinstance(some_callable, Expression):
+			return True
+		return super(ExpressionMixin, self)._resolve_purity(some_callable)
 		
 
 	def _initialize_conditional(self, conditional):
 		if isinstance(conditional, (str, unicode)):
-			return self._close_function(Expression(conditional))
+			return self._close_function(cached_expression(conditional, signature='infer'))
 			
 		return super(ExpressionMixin, self)._initialize_conditional(conditional)
\ No newline at end of file
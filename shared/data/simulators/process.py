@@ -1,5 +1,8 @@
 # -*- coding: utf-8 -*-
 import math, re
+import random
+from array import array
+from time import time, sleep
 from types import FunctionType
 
 from transitions import State, Machine
@@ -18,6 +21,35 @@ except ImportError:
 from shared.data.simulators.mixins.support import MixinFunctionSupport
 
 
+class SimulationVariables(dict):
+	"""
+	The simulation's variables, noting which are assigned (by anything - a step,
+	the escapement, a tag) so a step only has to look at those to see what changed.
+	Values changed in place (like appending to a list) are not assignments.
+	"""
+	
+	def __init__(self, *args, **kwargs):
+		super(SimulationVariables, self).__init__(*args, **kwargs)
+		self.assigned = set()
+	
+	def __setitem__(self, variable, value):
+		self.assigned.add(variable)
+		dict.__setitem__(self, variable, value)
+	
+	def update(self, *args, **kwargs):
+		if len(args) == 1 and not kwargs and isinstance(args[0], dict):
+			values = args[0]
+		else:
+			values = dict(*args, **kwargs)
+		self.assigned.update(values)
+		dict.update(self, values)
+	
+	def setdefault(self, variable, value=None):
+		if not variable in self:
+			self[variable] = value
+		return self[variable]
+
+
 class WrappedSimulationFunction(object):
 	
 	def __init__(self, datasource, function, aliases=None, name_override=None):
@@ -106,8 +138,14 @@ class WrappedSimulationFunction(object):
 		return self._datasource._variables.keys()
 	
 	
+	@property
+	def sources(self):
+		"""The variables read for each call (after aliasing)"""
+		return self._sources
+	
 	def _resolve_getters(self):
 		getters = []
+		sources = []
 		for argix, argument in enumerate(self.arguments):
 			if argument in self.aliases:
 				argument = self.aliases[argument]
@@ -122,8 +160,10 @@ class WrappedSimulationFunction(object):
 			if not argument in self.source_variables:
 				continue
 			getters.append(lambda self=self, argument=argument: self.current_value(argument) )
+			sources.append(argument)
 		
 		self._getters = getters
+		self._sources = tuple(sources)
 		
 		
 	def __call__(self):
@@ -140,19 +180,47 @@ class Process(MixinFunctionSupport, Machine):
 	
 	Provide variables and their functions. Set the initial conditions. 
 	
+	Stepping is incremental: pure functions (see _resolve_purity) whose inputs
+	did not change since the last step are not evaluated again, since they
+	would give the same value. Likewise transition guards are only checked again
+	when the variables they read change, and the state machine is only triggered
+	once a transition can pass. Set incremental to False to evaluate everything,
+	or index_guards to False to leave every guard to the state machine each step.
+	
+	The functions built for a state are reused when it is entered again 
+	(if nothing they were configured with changed). Set reuse_functions 
+	to False to build them fresh every time.
+	
+	Variables holding containers (see _MUTABLE_TYPES) are taken to change every step,
+	since they can be changed in place, without being assigned.
+	
+	Functions that take a _random argument get the simulation's own random.Random,
+	seeded with seed (or seed may be a random.Random to draw from), so a seeded
+	simulation runs the same every time, whatever else is drawing random numbers.
 	"""
 
 	_DEFAULT_START_VALUE = 0
 	_DEFAULT_ESCAPEMENT_VARIABLE = 't'
+	_TIME_VARIABLES = ('_t_step', '_t_state')
+	_RANDOM_VARIABLE = '_random'
+	_FUNCTION_CACHE_SIZE = 8 # configurations kept per variable and kind
+	_NUMERIC_TYPES = (int, float) # recorded in typed columns by run (exactly, unlike a long)
+	_MUTABLE_TYPES = (list, dict, set, bytearray, array) # may change without being assigned
 	_TRANSITION_CHECK = 'check_state'
 	
+	# for the clock escapements (overridable for testing or another time source)
+	_clock = staticmethod(time)
+	_sleep = staticmethod(sleep)
+	
 	def __init__(self, 
 				 # Raw configuration
 				 raw_definition=None,
 				 # Simulation configuration
-				 variables=None, start=None, alias=None, escapement=None,
+				 variables=None, start=None, alias=None, escapement=None, seed=None,
 				 # State machine configuration
 				 states=None, transitions=None,
+				 # Step configuration
+				 incremental=True, index_guards=True, reuse_functions=True,
 				 # Remaining state machine configuration pass through
 				 **keyword_arguments):
 		
@@ -166,8 +234,41 @@ class Process(MixinFunctionSupport, Machine):
 								 for variable in variables)
 		
 		# To be initialized
-		self._variables = {}
+		self._variables = SimulationVariables()
 		self._functions = {}
+		self._random = seed if isinstance(seed, random.Random) else random.Random(seed)
+		
+		# For incremental stepping
+		self._incremental = incremental
+		self._dependents = {}
+		self._evaluation_order = []
+		self._evaluation_rank = {} # variable: its place in the order
+		self._impure_variables = set()
+		self._last_inputs = None # the variables as of the end of the last step
+		self._last_updated = None # and which of them its functions changed
+		self._mutable_variables = set() # and which of them hold containers
+		self._n_evaluated = 0
+		self._n_skipped = 0
+		
+		# For checking only the transition guards that could have changed
+		self._guards = []
+		self._guard_sources = []
+		self._guard_index = {}
+		self._unindexed_guards = []
+		self._guard_results = []
+		self._guarded_transitions = []
+		self._index_guards = index_guards
+		self._guards_checked = False
+		self._n_guards_evaluated = 0
+		self._n_guards_skipped = 0
+		
+		# For reusing what was resolved the last times a state was entered
+		self._reuse_functions = reuse_functions
+		self._function_cache = {}
+		self._dependency_cache = {}
+		self._guard_index_cache = {}
+		self._n_rebuilds = 0
+		self._n_rebuilds_avoided = 0
 		
 		self._escapement_definition = escapement
 		self._initialize_escapement()
@@ -196,6 +297,13 @@ class Process(MixinFunctionSupport, Machine):
 		clocks ticks forward in a simulation. Some might use an 
 		integer increment, follow wall time, follow a fake clock that
 		runs faster than normal, etc.
+		
+		The escapement's kind picks the _configure_escapement_<kind> method 
+		that makes the tick function, given the rest of the config:
+		  increment - add increment each step
+		  wall      - follow the wall clock (in seconds, from start)
+		  scaled    - follow the wall clock, but scale times faster
+		  event     - jump straight to the next time something can happen
 		"""
 		if self._escapement_definition is None:
 			self._escapement_variable = None
@@ -208,19 +316,131 @@ class Process(MixinFunctionSupport, Machine):
 		
 		self._definitions[self._escapement_variable] = self._escapement_definition
 		
-		if kind == 'increment':
-			increment = config.get('increment', 1)
-			def tick(self=self, increment=increment):
-				self._variables[self._escapement_variable] += increment
-			self._escapement = tick
-			
-		else:
+		try:
+			configure_escapement = getattr(self, '_configure_escapement_%s' % kind)
+		except AttributeError:
 			raise NotImplementedError, "Escapement not implemented yet - %s" % kind
 		
 		self._start_values[self._escapement_variable] = config.get('start', self._DEFAULT_START_VALUE)
 		self._start_values['_t_step']  = 0
 		self._start_values['_t_state'] = self._start_values[self._escapement_variable] # starts with a state, after all
 		
+		self._time_dependent = True
+		self._escapement = configure_escapement(**config)
+		
+	
+	def _configure_escapement_increment(self, increment=1, **config):
+		def tick(self=self, increment=increment):
+			self._variables[self._escapement_variable] += increment
+		return tick
+	
+	
+	def _configure_escapement_wall(self, period=None, **config):
+		if 'scale' in config:
+			raise ValueError('The wall escapement follows the wall clock, so it takes no scale (use scaled instead)')
+		return self._configure_escapement_scaled(scale=1.0, period=period, **config)
+	
+	
+	def _configure_escapement_scaled(self, scale=1.0, period=None, **config):
+		"""
+		Time is the (scaled) seconds since the simulation was made, plus the start.
+		If a period is given (in simulation seconds), each step waits out the rest 
+		of the period instead of spinning, so the steps are that far apart.
+		"""
+		start = self._start_values[self._escapement_variable]
+		origin = self._clock()
+		
+		def tick(self=self, scale=scale, period=period, start=start, origin=origin):
+			now = self._clock()
+			if period:
+				t_next = self._variables[self._escapement_variable] + period
+				wait = (t_next - start) / float(scale) - (now - origin)
+				if wait > 0:
+					self._sleep(wait)
+					now = self._clock()
+			self._variables[self._escapement_variable] = start + scale * (now - origin)
+		return tick
+	
+	
+	def _configure_escapement_event(self, increment=1, max_step=None, **config):
+		"""
+		Jump time to the next event: when a function says it changes next 
+		(like an easing starting or finishing, see _next_event_time). 
+		
+		Functions and guards that read time without saying when they change
+		(like the expression 't * 2' or '_t_state > 10') could change any time,
+		as could guards on variables that follow time (like 'level > 90' of an easing),
+		so while there are any, time moves at most by the increment.
+		If max_step is given, no jump is longer than that.
+		If nothing is pending at all, time stands still - nothing will change.
+		"""
+		def tick(self=self, increment=increment, max_step=max_step):
+			t = self._variables[self._escapement_variable]
+			t_next = self._next_event_time(t)
+			if self._time_dependent and (t_next is None or t_next > t + increment):
+				t_next = t + increment
+			if max_step is not None and (t_next is None or t_next > t + max_step):
+				t_next = t + max_step
+			if t_next is not None:
+				self._variables[self._escapement_variable] = t_next
+		return tick
+	
+	
+	def _next_event_time(self, t):
+		"""
+		The soonest time after t that a function says it will change (or None).
+		
+		Each function is asked in its own time: the variable it reads for time
+		(its argument, through its aliases - like an easing on the time since 
+		the state started). That's taken to run with the escapement, offset 
+		but not scaled, so its event is shifted back onto the escapement's time.
+		"""
+		t_next = None
+		variables = self._variables
+		for function in self._functions.values():
+			next_event = getattr(function.function, 'next_event', None)
+			if next_event is None:
+				continue
+			t_own = variables[function.sources[0]] if function.sources else t
+			t_event = next_event(t_own)
+			if t_event is None or not t_event > t_own:
+				continue
+			t_event = t + (t_event - t_own)
+			if t_next is None or t_event < t_next:
+				t_next = t_event
+		return t_next
+	
+	
+	def _resolve_time_dependence(self):
+		"""
+		True if a function or guard of the current state reads time
+		but can not say when it changes next (so time can't be skipped).
+
+		Guards are followed through the dependency graph: a guard on a variable
+		that changes with time (at any depth) could pass between events,
+		even if every function along the way says when it changes next.
+		Guards without sources are assumed to read anything.
+		"""
+		time_variables = set((self._escapement_variable,) + self._TIME_VARIABLES)
+
+		for function in self._functions.values():
+			if (time_variables.intersection(function.sources)
+				and getattr(function.function, 'next_event', None) is None):
+				return True
+
+		time_driven = set(time_variables)
+		pending = list(time_variables)
+		while pending:
+			for dependent in self._dependents.get(pending.pop(), ()):
+				if not dependent in time_driven:
+					time_driven.add(dependent)
+					pending.append(dependent)
+
+		for guard_sources in self._guard_sources:
+			if guard_sources is None or time_driven.intersection(guard_sources):
+				return True
+		return False
+		
 		
 	def _initialize(self):
 		"""
@@ -231,10 +451,11 @@ class Process(MixinFunctionSupport, Machine):
 				self._start_values[variable] = self._DEFAULT_START_VALUE
 				
 		# prime varaible listing for reference during resolution
-		self._variables = self._start_values.copy()
+		self._variables = SimulationVariables(self._start_values)
 		
 		self._variables['_n_states'] = 1
 		self._variables['_n_steps'] = 0
+		self._variables[self._RANDOM_VARIABLE] = self._random
 		
 		self._initialize_variables()
 		
@@ -244,6 +465,8 @@ class Process(MixinFunctionSupport, Machine):
 		if not self._definitions:
 			return
 		
+		n_rebuilds = self._n_rebuilds
+		
 		for variable, definition in self._definitions.items():            
 			# Do not mutate the variable that controls the stepping, if provided
 			if variable == self._escapement_variable:
@@ -264,6 +487,95 @@ class Process(MixinFunctionSupport, Machine):
 			definition['alias'] = alias 
 
 			self._functions[variable] = self._resolve_function(variable, definition)
+		
+		# once every function is one that was built before, the graph is worth keeping too
+		self._initialize_dependencies(memoize=(self._n_rebuilds == n_rebuilds))
+	
+	
+	def _initialize_dependencies(self, memoize=False):
+		"""
+		Build the dependency graph from the variables each function reads,
+		and order the functions so a variable is evaluated after its inputs.
+		
+		(Each step acts on the last step's values, so the order doesn't change 
+		 the results, but it keeps evaluation predictable and cycles are allowed.)
+		
+		If memoize, the graph is kept for the next time these same functions are in use.
+		"""
+		# new functions have not seen any inputs yet
+		self._last_updated = None
+		
+		key = tuple(sorted((variable, id(function)) for variable, function in self._functions.items()))
+		try:
+			(functions, self._dependents, self._evaluation_order, self._evaluation_rank, 
+			 self._impure_variables) = self._dependency_cache[key]
+			# (ids are only unique among live objects, so make sure they're the same ones)
+			if all(function is self._functions[variable] for variable, function in functions):
+				return
+		except KeyError:
+			pass
+		
+		inputs = dict((variable, set(function.sources)) 
+					  for variable, function in self._functions.items())
+		
+		dependents = {}
+		for variable, sources in inputs.items():
+			for source in sources:
+				dependents.setdefault(source, set()).add(variable)
+		
+		# Kahn's algorithm, ignoring inputs that are not computed here (or are the variable itself)
+		waiting = dict((variable, set(source for source in sources 
+									  if source in inputs and source != variable))
+					   for variable, sources in inputs.items())
+		order = []
+		ready = sorted(variable for variable, sources in waiting.items() if not sources)
+		while waiting:
+			if not ready: # a cycle: break it at the first remaining variable
+				ready = [min(waiting)]
+			variable = ready.pop(0)
+			if variable not in waiting:
+				continue
+			del waiting[variable]
+			order.append(variable)
+			for dependent in sorted(dependents.get(variable, ())):
+				if dependent in waiting:
+					waiting[dependent].discard(variable)
+					if not waiting[dependent]:
+						ready.append(dependent)
+		
+		self._dependents = dependents
+		self._evaluation_order = order
+		self._evaluation_rank = dict((variable, rank) for rank, variable in enumerate(order))
+		# (drawing a random number is never the same twice, whatever the function)
+		self._impure_variables = set(variable for variable, function in self._functions.items()
+									 if not self._resolve_purity(function.function)
+									 or self._RANDOM_VARIABLE in function.sources)
+		
+		if memoize:
+			self._dependency_cache[key] = (tuple(self._functions.items()), 
+										   self._dependents, self._evaluation_order, self._evaluation_rank, 
+										   self._impure_variables)
+	
+	
+	def _resolve_purity(self, some_callable):
+		"""
+		Allow mixins to declare functions that always return the same value for the same arguments.
+		Those are skipped when their arguments do not change. Anything else is called every step.
+		"""
+		return False
+	
+	
+	@property
+	def evaluations(self):
+		"""How many function (and guard) evaluations were made and skipped, in total"""
+		return {'evaluated': self._n_evaluated, 'skipped': self._n_skipped,
+				'guards evaluated': self._n_guards_evaluated, 'guards skipped': self._n_guards_skipped}
+	
+	
+	@property
+	def rebuilds(self):
+		"""How many variable functions were built, and how many rebuilds were avoided by reusing one"""
+		return {'built': self._n_rebuilds, 'avoided': self._n_rebuilds_avoided}
 	
 	
 	def _resolve_variable_definition(self, variable_definition):
@@ -307,10 +619,37 @@ class Process(MixinFunctionSupport, Machine):
 		kind = definition['kind']
 		config = getattr(self, '_configure_default_%s' % kind)(variable)
 		config.update(definition.get('config', {}))
-
-		function = getattr(self, '_configure_function_%s' % kind)(**config)
+		aliases = definition.get('alias', {})
+		
+		# The same configuration makes the same function, so reuse it if it was made before.
+		# (Kinds whose defaults depend on the moment, like an easing's start, won't match.)
+		built = self._function_cache.setdefault((variable, kind), []) if self._reuse_functions else []
+		for built_config, built_aliases, function in built:
+			if built_aliases == aliases and self._same_configuration(built_config, config):
+				self._n_rebuilds_avoided += 1
+				return function
 		
-		return self._close_function(function, definition.get('alias', {}))
+		function = self._close_function(getattr(self, '_configure_function_%s' % kind)(**config), aliases)
+		
+		built.append((config, aliases.copy(), function))
+		del built[:-self._FUNCTION_CACHE_SIZE]
+		self._n_rebuilds += 1
+		
+		return function
+	
+	
+	@staticmethod
+	def _same_configuration(configuration, other):
+		"""Configurations match if they have the same keys, and the same values of the same types"""
+		if len(configuration) != len(other):
+			return False
+		for key, value in configuration.items():
+			if not key in other:
+				return False
+			other_value = other[key]
+			if not (value is other_value or (type(value) is type(other_value) and value == other_value)):
+				return False
+		return True
 	
 	
 	def _close_function(self, function, aliases=None):
@@ -325,27 +664,32 @@ class Process(MixinFunctionSupport, Machine):
 		transitions = []
 		
 		for source, destinations in transition_definitions.items():
-			transition = {
-				'source': source,
-				'trigger': self._TRANSITION_CHECK,
-			}
-			
 			if isinstance(destinations, (str,unicode)):
-				transition['dest'] = destinations
-			else:
-				for dest, conditionals in destinations.items():
-					transition['dest'] = dest
-					
-					for check, conditional in conditionals.items():
-						if isinstance(conditional, (list,tuple,set)):
-							transition[check] = [
-								self._initialize_conditional(condition)
-								for condition 
-								in conditional]
-						else:
-							transition[check] = self._initialize_conditional(conditional)						
+				transitions.append({
+					'source': source,
+					'dest': destinations,
+					'trigger': self._TRANSITION_CHECK,
+				})
+				continue
 			
-			transitions.append(transition)
+			# each destination is its own transition, with its own guards
+			for dest, conditionals in destinations.items():
+				transition = {
+					'source': source,
+					'dest': dest,
+					'trigger': self._TRANSITION_CHECK,
+				}
+				
+				for check, conditional in conditionals.items():
+					if isinstance(conditional, (list,tuple,set)):
+						transition[check] = [
+							self._initialize_conditional(condition)
+							for condition 
+							in conditional]
+					else:
+						transition[check] = self._initialize_conditional(conditional)						
+				
+				transitions.append(transition)
 		
 		self._end_states = [state for state 
 							in self._state_variable_definitions
@@ -361,6 +705,105 @@ class Process(MixinFunctionSupport, Machine):
 		self._transition_definitions = transitions
 	
 	
+	def _initialize_guard_index(self):
+		"""
+		Index the guards of the current state's transitions by the variables they read,
+		so each step only the guards whose variables changed are checked again.
+		Transitions are kept as (condition guards, unless guards) positions, in order.
+		"""
+		# the transitions don't change, so neither does a state's index (only its results)
+		if self.state in self._guard_index_cache:
+			(self._guards, self._guard_sources, self._guard_index, 
+			 self._unindexed_guards, self._guarded_transitions) = self._guard_index_cache[self.state]
+			self._guard_results = [None] * len(self._guards)
+			self._guards_checked = False
+			return
+		
+		guards = []
+		transitions = []
+		for transition in self._transition_definitions:
+			sources = transition['source']
+			if isinstance(sources, (str, unicode)):
+				sources = [sources]
+			if not self.state in sources:
+				continue
+			
+			checks = []
+			for check in ('conditions', 'unless'):
+				check_guards = transition.get(check, [])
+				if not isinstance(check_guards, list):
+					check_guards = [check_guards]
+				checks.append(tuple(range(len(guards), len(guards) + len(check_guards))))
+				guards.extend(check_guards)
+			transitions.append(tuple(checks))
+		
+		guard_sources = [self._resolve_guard_sources(guard) for guard in guards]
+		
+		index = {}
+		unindexed = []
+		for ix, sources in enumerate(guard_sources):
+			if sources is None:
+				unindexed.append(ix)
+				continue
+			for variable in sources:
+				index.setdefault(variable, []).append(ix)
+		
+		self._guards = guards
+		self._guard_sources = guard_sources
+		self._guard_index = index
+		self._unindexed_guards = unindexed
+		self._guard_results = [None] * len(guards)
+		self._guarded_transitions = transitions
+		# nothing has been checked in this state yet
+		self._guards_checked = False
+		
+		self._guard_index_cache[self.state] = (guards, guard_sources, index, unindexed, transitions)
+	
+	
+	def _resolve_guard_sources(self, guard):
+		"""
+		The variables a guard reads, or None if it must be checked every step 
+		(when it doesn't say, it isn't pure - see _resolve_purity - or it draws random numbers).
+		"""
+		sources = getattr(guard, 'sources', None)
+		if sources is None or self._RANDOM_VARIABLE in sources:
+			return None
+		if isinstance(guard, WrappedSimulationFunction) and not self._resolve_purity(guard.function):
+			return None
+		return sources
+	
+	
+	def _check_transitions(self, changed=None):
+		"""
+		Re-evaluate the guards that read the changed variables (the ones that changed 
+		since the guards were last checked, or None if that isn't known),
+		and trigger the state machine only if a transition can pass now.
+		(The machine then takes the same first passing transition, with its callbacks.)
+		"""
+		guards = self._guards
+		results = self._guard_results
+		
+		if changed is None or not self._guards_checked:
+			stale = range(len(guards))
+		else:
+			stale = set(self._unindexed_guards)
+			index = self._guard_index
+			for variable in changed:
+				stale.update(index.get(variable, ()))
+		
+		for ix in stale:
+			results[ix] = guards[ix]()
+		
+		self._n_guards_evaluated += len(stale)
+		self._n_guards_skipped += len(guards) - len(stale)
+		self._guards_checked = True
+		
+		for conditions, unless in self._guarded_transitions:
+			if all(results[ix] for ix in conditions) and not any(results[ix] for ix in unless):
+				self.check_state()
+				return
+	
+	
 	def _initialize_conditional(self, conditional):
 		"""Conditions trigger on match"""
 		if isinstance(conditional, dict):
@@ -370,6 +813,7 @@ class Process(MixinFunctionSupport, Machine):
 						for variable, value
 						in values.items()
 					)
+			check_values.sources = tuple(conditional)
 			return check_values
 			
 		raise NotImplementedError("No conditional resolver found for '%r'" % conditional)
@@ -382,6 +826,9 @@ class Process(MixinFunctionSupport, Machine):
 			self._variables['_t_state'] = self._variables[self._escapement_variable]
 		self._definitions = self._state_variable_definitions[self.state]
 		self._initialize_variables()
+		self._initialize_guard_index()
+		if self._escapement_variable:
+			self._time_dependent = self._resolve_time_dependence()
 		
 		
 	def step(self):
@@ -396,16 +843,143 @@ class Process(MixinFunctionSupport, Machine):
 			self._escapement()
 			self._variables['_t_step'] = self._variables[self._escapement_variable] - t_prev
 		
-		new_values = {}
+		variables = self._variables
 		
-		for variable, function in self._functions.items():
-			new_values[variable] = function()
-			
-		self._variables.update(new_values)
+		if not self._incremental:
+			new_values = self._evaluate()
+			variables.update(new_values)
+			variables.assigned.clear()
+			self.check_state()
+			return
 		
-		self.check_state()
+		# What changed since the end of the last step (like time, or a variable set from a tag):
+		# what was assigned and isn't the same as it was, and anything that can change in place.
+		# This one change set serves both the functions and the guards.
+		last_inputs = self._last_inputs
+		if last_inputs is None:
+			changed = None
+		else:
+			changed = [variable for variable in variables.assigned
+					   if not (variable in last_inputs and (variables[variable] is last_inputs[variable] 
+															or variables[variable] == last_inputs[variable]))]
+			changed.extend(self._mutable_variables)
 		
+		if changed is None or self._last_updated is None:
+			dirty = None
+		else:
+			# functions see what changed outside of them, and what the last step's functions changed
+			inputs = self._last_updated.union(changed)
+			dirty = self._impure_variables.union(inputs, *(self._dependents.get(variable, ()) 
+														   for variable in inputs))
+		
+		new_values = self._evaluate(dirty)
+		
+		updated = set(variable for variable, value in new_values.iteritems()
+					  if not (variable in variables and (value is variables[variable] or value == variables[variable])))
+		variables.update(new_values)
+		variables.assigned.clear() # (what changed is known, from here it's the next step's)
+		self._last_updated = updated
+		
+		# bring the snapshot up to date (only what changed differs from the variables)
+		if changed is None:
+			self._last_inputs = variables.copy()
+			self._mutable_variables = set(variable for variable, value in variables.iteritems()
+										  if isinstance(value, self._MUTABLE_TYPES))
+		else:
+			for variable in changed:
+				last_inputs[variable] = variables[variable]
+			for variable in updated:
+				last_inputs[variable] = variables[variable]
+			changed = updated.union(changed)
+			for variable in changed:
+				if isinstance(variables[variable], self._MUTABLE_TYPES):
+					self._mutable_variables.add(variable)
+				else:
+					self._mutable_variables.discard(variable)
+		
+		if self._index_guards:
+			self._check_transitions(changed)
+		else:
+			self.check_state()
+	
+	
+	def _evaluate(self, dirty=None):
+		"""Returns the new values of the variables in dirty (or all of them, if None)"""
+		new_values = {}
+		
+		functions = self._functions
+		order = self._evaluation_order
+		if dirty is None:
+			for variable in order:
+				new_values[variable] = functions[variable]()
+		elif len(dirty) * 4 > len(order):
+			for variable in order:
+				if variable in dirty:
+					new_values[variable] = functions[variable]()
+		else:
+			# only a few, so sort those into order rather than look through it all
+			# (in order still, so random draws, say, come in the same order)
+			rank = self._evaluation_rank
+			for variable in sorted((variable for variable in dirty if variable in rank), key=rank.get):
+				new_values[variable] = functions[variable]()
 		
+		self._n_evaluated += len(new_values)
+		self._n_skipped += len(functions) - len(new_values)
+		
+		return new_values
+
+
+	def run(self, n_steps, variables=None):
+		"""
+		Step the simulation n_steps times, recording the values after each step.
+
+		Returns columns: one per variable, plus the state after each step under '_state'.
+		Variables that are numbers after the first step are recorded as floats into 
+		a preallocated array('d'), filled in place. Anything else (or a variable
+		that stops being a number) is recorded in a list. By default all variables 
+		are recorded, except the internal ones (that start with an underscore).
+		"""
+		if variables is None:
+			variables = sorted(variable for variable in self._variables
+							   if not variable.startswith('_'))
+
+		columns = {}
+		columns['_state'] = states = [None] * n_steps
+		if not n_steps:
+			columns.update((variable, []) for variable in variables)
+			return columns
+
+		current = self._variables
+		numeric = self._NUMERIC_TYPES
+		step = self.step
+		
+		step()
+		recorders = []
+		for variable in variables:
+			typed = type(current[variable]) in numeric
+			if typed:
+				column = array('d', [0.0]) * n_steps
+			else:
+				column = [None] * n_steps
+			columns[variable] = column
+			recorders.append([column, variable, typed])
+		
+		for ix in xrange(n_steps):
+			if ix:
+				step()
+			for recorder in recorders:
+				column, variable, typed = recorder
+				value = current[variable]
+				if typed and not type(value) in numeric:
+					# not a number any more, so keep what was recorded in a list from here on
+					recorder[0] = columns[variable] = column = list(column)
+					recorder[2] = False
+				column[ix] = value
+			states[ix] = self.state
+
+		return columns
+
+
 	def __repr__(self):
 		max_state_len = max(len(s) for s in self.states.keys())
 		format_string = '<Simulation: [%%%ds] {%%s}>' % max_state_len
@@ -415,20 +989,35 @@ class Process(MixinFunctionSupport, Machine):
 													  ]))
 
 
-def load_simulator(definition, mixins_package='shared.data.simulators.mixins'):
-		
-	configuration = yaml_loader(definition, FullLoader)
-	configuration['raw_definition'] = definition
-	
-	mixins = []
-	mixins += [
+def simulator_class(mixins, mixins_package='shared.data.simulators.mixins'):
+	"""Compose the Simulator class from the named mixins (in order) and Process."""
+	bases = [
 			getattr(__import__('%s.%s' % (mixins_package, mixin.lower()), 
 							   fromlist=['%sMixin' % mixin]), 
 					'%sMixin' % mixin)
-			for mixin in configuration.pop('mixins')
+			for mixin in mixins
 		]
 	
-	mixins += [Process]
+	bases += [Process]
+	
+	# the names are kept so the class can be composed again elsewhere (like in another process)
+	return type('Simulator', tuple(bases), {'_mixins': tuple(mixins), 
+											'_mixins_package': mixins_package})
+
+
+def parse_simulator(definition, mixins_package='shared.data.simulators.mixins'):
+	"""
+	Parse a definition once, returning the Simulator class and its configuration.
+	Each Simulator(**configuration) is a fresh simulation, without parsing again.
+	"""
+	configuration = yaml_loader(definition, FullLoader)
+	configuration['raw_definition'] = definition
+	
+	return simulator_class(configuration.pop('mixins'), mixins_package), configuration
+
+
+def load_simulator(definition, mixins_package='shared.data.simulators.mixins'):
 	
-	return type('Simulator', tuple(mixins), {})(**configuration)
+	Simulator, configuration = parse_simulator(definition, mixins_package)
 	
+	return Simulator(**configuration)
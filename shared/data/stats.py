@@ -5,8 +5,20 @@
 	that each ignores None values like Excel.
 
 """
-from collections import defaultdict
-import math
+from collections import defaultdict, deque
+from datetime import datetime, timedelta
+from itertools import compress, imap, islice, izip, repeat
+from array import array
+from bisect import bisect_left
+from threading import Thread
+from Queue import Queue, Empty
+import operator as op
+import math, random
+
+try:
+	import numpy
+except ImportError:
+	numpy = None
 
 class StatisticsError(ValueError): pass # Generic "this won't work" error for stats
 class InsufficientData(StatisticsError): pass # Generic "need more numbers" error
@@ -106,6 +118,8 @@ def summation(iterable):
 
 def mean(iterable):
 	"""Scans over the iterable and returns the average, ignoring None values"""
+	if isinstance(iterable, SampleBuffer):
+		return array_mean(iterable)
 	iterator = iter(iterable)
 	x = prime_on_first(iterator)
 
@@ -120,6 +134,8 @@ def geometric_mean(iterable):
 	"""Scans over the iterable and returns the log-average result of non-None values.
 	No effort was expended to make this precise.
 	"""
+	if isinstance(iterable, SampleBuffer):
+		return array_geometric_mean(iterable)
 	iterator = iter(iterable)
 	x = prime_on_first(iterator)
 
@@ -145,6 +161,8 @@ def harmonic_mean(iterable):
 	"""Scans over the iterable and returns the reciprocal of the mean of the recipricals of non-None values
 	If a value is 0, the result is zero
 	"""
+	if isinstance(iterable, SampleBuffer):
+		return array_harmonic_mean(iterable)
 	iterator = iter(iterable)
 	x = prime_on_first(iterator)
 
@@ -167,6 +185,8 @@ def harmonic_mean(iterable):
 
 def variance(iterable):
 	"""Scans over the iterable and returns the variance, ignoring None values"""
+	if isinstance(iterable, SampleBuffer):
+		return array_variance(iterable)
 	iterator = iter(iterable)
 	x = prime_on_first(iterator)
 
@@ -192,6 +212,8 @@ stdev = standard_deviation
 
 def median(iterable):
 	"""Returns the value in the middle of the iterable (after filtering out None)"""
+	if isinstance(iterable, SampleBuffer):
+		return array_median(iterable)
 	iterator = iter(iterable)
 	x = prime_on_first(iterator)
 
@@ -206,14 +228,40 @@ def median(iterable):
 		return values[(len(values)-1)/2]
 
 
+def _exclusive_quantiles(value_at_rank, count, n):
+	"""Returns the n-1 cut points for count values using the 'exclusive' method.
+	The value_at_rank function gives the value at a 1-based rank in sorted order.
+	"""
+	qs = []
+	
+	width = ((count+1.0) / n) # width of bucket
+
+	for q in range(n-1):
+		cutpoint = width*(q + 1)
+		frac = cutpoint % 1
+		
+		a = int(cutpoint // 1.0)
+
+		if frac:
+			qtile = value_at_rank(a) + ((value_at_rank(a + 1) - value_at_rank(a))*frac)
+		else:
+			qtile = value_at_rank(a)
+			
+		qs.append(round(float(qtile), 6))
+		
+	return qs
+
+
 def quantiles(iterable, n=4):
 	"""Returns the values to evenly divide the data into n spans, ignoring None values.
 	This is modeled off the 'exclusive' method in Python 3.8's statistics module.
 	"""
+	if isinstance(iterable, SampleBuffer):
+		return array_quantiles(iterable, n=n)
+	
 	if n < 1:
 		raise StatisticsError('Quantiles return n-1 values as the fenceposts')
 
-	qs = []
 	values = [x for x in iterable if x is not None]
 	
 	if len(values) < n:
@@ -223,24 +271,166 @@ def quantiles(iterable, n=4):
 	
 	if len(values) == n:
 		return values
-			
-	width = ((len(values)+1.0) / n) # width of bucket
+	
+	return _exclusive_quantiles(lambda rank: values[rank - 1], len(values), n)
 
-	for q in range(n-1):
-		cutpoint = width*(q + 1)
-		frac = cutpoint % 1
-		
-		a = int(cutpoint // 1.0) - 1
 
-		if frac:
-			b = int(a + 1)
-			qtile = values[a] + ((values[b] - values[a])*frac)
-		else:
-			qtile = values[a]
+
+class QuantileSketch(object):
+	"""Mergeable approximate quantiles in bounded memory (ignoring None values).
+	
+	This is a KLL sketch: values land in a stack of compactors, and when
+	a level fills it is sorted and every other value is promoted to the 
+	next level up at double the weight. Rank error shrinks as k grows,
+	roughly 1.7/k of n, and memory stays around 3k values no matter how
+	many are pushed. Until the first compaction the results are exact.
+	
+	Sketches built on separate threads or tags can be merged together.
+	A seed may be given to make the (randomized) compaction repeatable.
+	"""
+	__slots__ = ('k', 'n', 'min', 'max', '_compactors', '_size', '_max_size', '_random')
+	
+	def __init__(self, iterable=None, k=200, seed=None):
+		if k < 2:
+			raise StatisticsError('Sketch needs k of at least 2 to compact')
+		self.k = k
+		self.n = 0
+		self.min = None
+		self.max = None
+		
+		self._compactors = []
+		self._size = 0
+		self._max_size = 0
+		self._random = random.Random(seed)
+		self._grow()
+		
+		if iterable is not None:
+			self.extend(iterable)
+	
+	def _capacity(self, height):
+		depth = len(self._compactors) - height - 1
+		return int(math.ceil(self.k * (2.0/3.0)**depth)) + 1
+	
+	def _grow(self):
+		self._compactors.append([])
+		self._max_size = sum(self._capacity(height) 
+							 for height in range(len(self._compactors)))
+	
+	def _compress(self):
+		# the list may grow while iterating, which is fine (and intended)
+		for height, compactor in enumerate(self._compactors):
+			if len(compactor) < self._capacity(height):
+				continue
+			if height + 1 >= len(self._compactors):
+				self._grow()
 			
-		qs.append(round(float(qtile), 6))
+			compactor.sort()
+			# an odd value out stays behind so the total weight is conserved
+			leftover = compactor.pop() if len(compactor) % 2 else None
+			self._compactors[height + 1].extend(compactor[self._random.randint(0,1)::2])
+			del compactor[:]
+			if leftover is not None:
+				compactor.append(leftover)
 		
-	return qs
+		self._size = sum(len(compactor) for compactor in self._compactors)
+	
+	def push(self, x):
+		"""Add a single value to the sketch. None is ignored."""
+		if x is None:
+			return
+		
+		self._compactors[0].append(x)
+		self._size += 1
+		self.n += 1
+		
+		if self.n == 1:
+			self.min = self.max = x
+		elif x < self.min:
+			self.min = x
+		elif x > self.max:
+			self.max = x
+		
+		while self._size >= self._max_size:
+			self._compress()
+	
+	def extend(self, iterable):
+		for x in iterable:
+			self.push(x)
+	
+	def merge(self, other):
+		"""Fold another sketch's values into this one. Returns self for chaining."""
+		if not other.n:
+			return self
+		
+		while len(self._compactors) < len(other._compactors):
+			self._grow()
+		for height, compactor in enumerate(other._compactors):
+			self._compactors[height].extend(compactor)
+		
+		if not self.n:
+			self.min, self.max = other.min, other.max
+		else:
+			self.min = min((self.min, other.min))
+			self.max = max((self.max, other.max))
+		self.n += other.n
+		
+		self._size = sum(len(compactor) for compactor in self._compactors)
+		while self._size >= self._max_size:
+			self._compress()
+		
+		return self
+	
+	def __len__(self):
+		return self.n
+	
+	def _ranked(self):
+		"""Returns the retained values in order and their cumulative weights"""
+		weighted = sorted(
+			(x, 1 << height)
+			for height, compactor in enumerate(self._compactors)
+			for x in compactor)
+		
+		values = []
+		ranks = []
+		rank = 0
+		for x, weight in weighted:
+			rank += weight
+			values.append(x)
+			ranks.append(rank)
+		return values, ranks
+	
+	def _value_at_rank(self):
+		values, ranks = self._ranked()
+		return lambda rank: values[bisect_left(ranks, rank)]
+	
+	def quantiles(self, n=4):
+		"""Returns the values to evenly divide the data into n spans, like quantiles()"""
+		if n < 1:
+			raise StatisticsError('Quantiles return n-1 values as the fenceposts')
+		
+		if self.n < n:
+			raise StatisticsError('Data should be large enough to have at least one element in each quantile. Data: %r of %r buckets' % (self.n, n))
+		
+		if self.n == n and self._size == self.n:
+			return sorted(self._compactors[0])
+		
+		return _exclusive_quantiles(self._value_at_rank(), self.n, n)
+	
+	def median(self):
+		"""Returns the (approximate) value in the middle, like median()"""
+		if not self.n:
+			raise InsufficientData
+		
+		value_at_rank = self._value_at_rank()
+		
+		if self.n % 2 == 0:
+			return (value_at_rank(self.n/2) + value_at_rank(self.n/2 + 1)) / 2.0
+		else:
+			return value_at_rank((self.n + 1)/2)
+	
+	def __repr__(self):
+		return '<QuantileSketch n=%d k=%d retained=%d>' % (self.n, self.k, self._size)
+
 
 
 def multimode(iterable, truncation_magnitude=None):
@@ -277,25 +467,109 @@ def mode(iterable, truncation_magnitude=None):
 
 
 
-def histogram(iterable, buckets=None, start=None, stop=None, step=None):
-	"""Returns a list of counts for entries in iterable that fit in evenly spaced buckets."""
+class FrequentItems(object):
+	"""Tracks the most common values in bounded memory (a Misra-Gries sketch, ignoring None).
 	
-	iterator = iter(iterable)
-	x = prime_on_first(iterator)
+	At most capacity distinct values are counted. When a new value arrives 
+	and the table is full, every count is decremented instead (and any that 
+	reach zero are dropped). Each count is then a lower bound, and the true
+	count is at most error higher, where error never exceeds n/(capacity+1).
+	So any value seen more than that often is guaranteed to be in the table.
 	
-	minx = maxx = x
+	Values are snapped with truncation_magnitude the same way multimode() does.
+	Sketches with the same truncation can be merged across partitions.
+	For exact results on low cardinality data, multimode() is still the tool.
+	"""
+	__slots__ = ('capacity', 'truncation_magnitude', 'n', 'error', 'counts')
 	
-	values = [x]
-	for x in iterator:
+	def __init__(self, iterable=None, capacity=100, truncation_magnitude=None):
+		if capacity < 1:
+			raise StatisticsError('Need room to count at least one value')
+		self.capacity = capacity
+		self.truncation_magnitude = truncation_magnitude
+		self.n = 0
+		self.error = 0
+		self.counts = {}
+		
+		if iterable is not None:
+			self.extend(iterable)
+	
+	def add(self, x):
+		"""Count a value. None is ignored."""
 		if x is None:
-			continue
-		values.append(x)
+			return
+		if self.truncation_magnitude:
+			x -= x % self.truncation_magnitude
 		
-		if x < minx:
-			minx = x
-		if x > maxx:
-			maxx = x
-			
+		self.n += 1
+		counts = self.counts
+		if x in counts:
+			counts[x] += 1
+		elif len(counts) < self.capacity:
+			counts[x] = 1
+		else:
+			# the new value and one of each of the others cancel out
+			self.error += 1
+			for value in counts.keys():
+				if counts[value] == 1:
+					del counts[value]
+				else:
+					counts[value] -= 1
+	
+	def extend(self, iterable):
+		for x in iterable:
+			self.add(x)
+	
+	def merge(self, other):
+		"""Fold another sketch's counts into this one. Returns self for chaining."""
+		if self.truncation_magnitude != other.truncation_magnitude:
+			raise StatisticsError('Sketches must truncate the same way to merge')
+		
+		counts = self.counts
+		for value, count in other.counts.items():
+			counts[value] = counts.get(value, 0) + count
+		self.n += other.n
+		self.error += other.error
+		
+		if len(counts) > self.capacity:
+			# cancel out everything at or below the first count that doesn't fit
+			cutoff = sorted(counts.values(), reverse=True)[self.capacity]
+			for value in counts.keys():
+				if counts[value] <= cutoff:
+					del counts[value]
+				else:
+					counts[value] -= cutoff
+			self.error += cutoff
+		
+		return self
+	
+	def __len__(self):
+		return self.n
+	
+	def top(self, k=None):
+		"""Returns the k most common values as (value, count, error) tuples, most common first.
+		The true count of each is somewhere from count to count + error.
+		"""
+		ranked = sorted(self.counts.items(), key=lambda item: item[1], reverse=True)
+		if k is not None:
+			ranked = ranked[:k]
+		return [(value, count, self.error) for value, count in ranked]
+	
+	def multimode(self):
+		"""Returns the set of values tied for the highest (estimated) count, like multimode()"""
+		if not self.counts:
+			raise InsufficientData
+		most = max(self.counts.values())
+		return set(value for value, count in self.counts.items() if count == most)
+	
+	def __repr__(self):
+		return '<FrequentItems n=%d tracked=%d error<=%d>' % (self.n, len(self.counts), self.error)
+
+
+def _resolve_histogram_slice(minx, maxx, buckets=None, start=None, stop=None, step=None):
+	"""Returns the slice (start, stop, step) and the number of buckets for a histogram
+	spanning minx to maxx, snapping anything unconstrained to an order of magnitude.
+	"""
 	x_start = start or minx
 	x_end = stop or maxx
 		
@@ -330,6 +604,33 @@ def histogram(iterable, buckets=None, start=None, stop=None, step=None):
 		x_step = step
 		x_buckets = int(math.ceil((x_end - x_start) / float(step)))
 	
+	return slice(x_start, x_end, x_step), x_buckets
+
+
+def histogram(iterable, buckets=None, start=None, stop=None, step=None):
+	"""Returns a list of counts for entries in iterable that fit in evenly spaced buckets."""
+	if isinstance(iterable, SampleBuffer):
+		return array_histogram(iterable, None, buckets, start, stop, step)
+	
+	iterator = iter(iterable)
+	x = prime_on_first(iterator)
+	
+	minx = maxx = x
+	
+	values = [x]
+	for x in iterator:
+		if x is None:
+			continue
+		values.append(x)
+		
+		if x < minx:
+			minx = x
+		if x > maxx:
+			maxx = x
+	
+	config, x_buckets = _resolve_histogram_slice(minx, maxx, buckets, start, stop, step)
+	x_start, x_step = config.start, config.step
+	
 	counts = [0] * x_buckets
 	dropped = 0
 	for v in values:
@@ -340,16 +641,199 @@ def histogram(iterable, buckets=None, start=None, stop=None, step=None):
 			dropped += 1
 	
 #	p((slice(x_start, x_end, x_step), counts), nestedListLimit=None)
-	return slice(x_start, x_end, x_step), counts
+	return config, counts
+
+
+class StreamingHistogram(object):
+	"""Counts values into evenly spaced buckets as they arrive, in fixed memory (ignoring None).
+	
+	Give it start/stop with a step (or a number of buckets) - or just a slice,
+	like the one histogram() returns - and the buckets are fixed. Values outside
+	them are tallied as underflow and overflow.
+	
+	Otherwise the buckets are placed adaptively: the first max_buckets values
+	pick an order of magnitude for the step, snapped like histogram() does,
+	and whenever the data outgrows max_buckets the step is widened tenfold.
+	
+	Histograms with the same configuration can be merged, and to_slice_counts()
+	returns the same (slice, counts) pair as histogram() for format_histogram.
+	"""
+	__slots__ = ('n', 'underflow', 'overflow', 'max_buckets',
+				 '_fixed', '_start', '_stop', '_step', 
+				 '_exponent', '_low', '_counts', '_pending')
+	
+	def __init__(self, start=None, stop=None, step=None, buckets=None, max_buckets=100):
+		if isinstance(start, slice):
+			start, stop, step = start.start, start.stop, start.step
+		
+		self.n = 0
+		self.underflow = 0
+		self.overflow = 0
+		self.max_buckets = max_buckets
+		
+		self._fixed = start is not None and stop is not None and bool(step or buckets)
+		
+		if self._fixed:
+			config, x_buckets = _resolve_histogram_slice(start, stop, buckets, start, stop, step)
+			self._start, self._stop, self._step = config.start, config.stop, config.step
+			self._counts = [0] * x_buckets
+			self._pending = None
+		else:
+			if any(v is not None for v in (start, stop, step, buckets)):
+				raise StatisticsError('Fixed buckets need a start, stop, and either a step or bucket count')
+			self._exponent = None
+			self._low = None
+			self._counts = []
+			self._pending = []
+	
+	@property
+	def step(self):
+		if self._fixed:
+			return self._step
+		if self._exponent is None:
+			return None
+		return 10**self._exponent
+	
+	def _index(self, x):
+		# scale by an exact power of ten where possible, so 0.3 lands in 3, not 2.9999...
+		if self._exponent < 0:
+			return int(math.floor(x * 10**(-self._exponent)))
+		return int(math.floor(x / 10**self._exponent))
+	
+	def add(self, x, count=1):
+		"""Count a value into its bucket. None is ignored."""
+		if x is None:
+			return
+		self.n += count
+		
+		if self._fixed:
+			ix = int((x - self._start) // self._step)
+			if ix < 0:
+				self.underflow += count
+			elif ix >= len(self._counts):
+				self.overflow += count
+			else:
+				self._counts[ix] += count
+		elif self._pending is not None:
+			self._pending.extend([x] * count)
+			if len(self._pending) >= self.max_buckets:
+				self._settle()
+		else:
+			self._add_to_index(self._index(x), count)
+	
+	def extend(self, iterable):
+		for x in iterable:
+			self.add(x)
+	
+	def _settle(self):
+		"""Pick the step from the values seen so far and start bucketing"""
+		pending, self._pending = self._pending, None
+		minx, maxx = min(pending), max(pending)
+		span = maxx - minx
+		
+		if span:
+			oom = order_of_magnitude(10**round(math.log10(span))/10.0)
+		elif minx:
+			oom = order_of_magnitude(abs(minx)) / 10.0
+		else:
+			oom = 1
+		self._exponent = int(round(math.log10(oom)))
+		
+		for x in pending:
+			self._add_to_index(self._index(x), 1)
+	
+	def _add_to_index(self, ix, count):
+		if self._low is None:
+			self._low = ix
+			self._counts = [count]
+			return
+		
+		# widen the step until the new index fits in the budget
+		while max(ix, self._low + len(self._counts) - 1) - min(ix, self._low) >= self.max_buckets:
+			self._coarsen()
+			ix //= 10
+		
+		if ix < self._low:
+			self._counts[0:0] = [0] * (self._low - ix)
+			self._low = ix
+		elif ix >= self._low + len(self._counts):
+			self._counts.extend([0] * (ix - self._low - len(self._counts) + 1))
+		self._counts[ix - self._low] += count
+	
+	def _coarsen(self):
+		low = self._low // 10
+		high = (self._low + len(self._counts) - 1) // 10
+		counts = [0] * (high - low + 1)
+		for offset, count in enumerate(self._counts):
+			counts[(self._low + offset) // 10 - low] += count
+		self._low = low
+		self._counts = counts
+		self._exponent += 1
+	
+	def merge(self, other):
+		"""Fold another histogram's counts into this one. Returns self for chaining."""
+		if self._fixed or other._fixed:
+			if not (self._fixed and other._fixed 
+					and (self._start, self._stop, self._step) == (other._start, other._stop, other._step)):
+				raise StatisticsError('Fixed histograms can only merge with identically configured ones')
+			self._counts = [a + b for a, b in zip(self._counts, other._counts)]
+			self.underflow += other.underflow
+			self.overflow += other.overflow
+			self.n += other.n
+			return self
+		
+		if other._pending is not None:
+			self.extend(other._pending)
+			return self
+		
+		if self._pending is not None:
+			if not self._pending:
+				self._pending = None
+				self._exponent = other._exponent
+			else:
+				self._settle()
+		
+		while self._exponent < other._exponent:
+			self._coarsen()
+		
+		for offset, count in enumerate(other._counts):
+			if count:
+				# recheck the scale each time, since adding may coarsen this histogram
+				ix = (other._low + offset) // 10**(self._exponent - other._exponent)
+				self._add_to_index(ix, count)
+		self.n += other.n
+		
+		return self
+	
+	def to_slice_counts(self):
+		"""Returns the (slice(start, stop, step), counts) pair, like histogram()"""
+		if self._fixed:
+			return slice(self._start, self._stop, self._step), list(self._counts)
+		
+		if self._pending is not None:
+			if not self._pending:
+				raise InsufficientData
+			self._settle()
+		
+		step = self.step
+		return slice(self._low * step, (self._low + len(self._counts)) * step, step), list(self._counts)
+	
+	def __repr__(self):
+		return '<StreamingHistogram n=%d step=%r buckets=%d>' % (self.n, self.step, len(self._counts))
 
 
 def format_histogram(values, height=5, buckets=None, start=None, stop=None, step=None):
-	"""Returns a text-based simple histogram."""
+	"""Returns a text-based simple histogram.
+	The values may also be a StreamingHistogram, which is rendered as-is.
+	"""
 	if height < 3:
 		height = 3
 	
 	# config is a slice of the actual start, stop, and step of the histogram
-	config, counts = histogram(values, buckets, start, stop, step)
+	if isinstance(values, StreamingHistogram):
+		config, counts = values.to_slice_counts()
+	else:
+		config, counts = histogram(values, buckets, start, stop, step)
 	buckets = len(counts)
 	
 	# calculate plot verical lmits
@@ -410,55 +894,260 @@ def combine_stats(n1,mean1,variance1, n2,mean2,variance2):
 
 
 
-def describe(iterable):
-	"""Returns the basic statistics of the iterable (ignoring None values)"""
-	iterator = iter(iterable)
-	x = prime_on_first(iterator)
+class RunningDescription(object):
+	"""Accumulates the basic statistics of a stream in constant memory (ignoring None values).
+	
+	Values are pushed one at a time (or extended in bulk) and the mean and variance
+	are updated with Welford's method, so nothing but the running totals is kept.
+	The result of describe() has the same keys as the describe function.
+	"""
+	__slots__ = ('n', 'mean', 'm2', 'min', 'max', 'sum')
+	
+	def __init__(self, iterable=None):
+		self.n = 0
+		self.mean = 0.0
+		self.m2 = 0.0
+		self.min = None
+		self.max = None
+		self.sum = 0.0
+		
+		if iterable is not None:
+			self.extend(iterable)
+	
+	def push(self, x):
+		"""Add a single value to the accumulation. None is ignored."""
+		if x is None:
+			return
+		
+		self.n += 1
+		delta = x - self.mean
+		self.mean += delta / float(self.n)
+		self.m2 += delta * (x - self.mean)
+		self.sum += x
+		
+		if self.n == 1:
+			self.min = self.max = x
+		elif x < self.min:
+			self.min = x
+		elif x > self.max:
+			self.max = x
+	
+	def extend(self, iterable):
+		"""Add every value in the iterable. The loop is inlined to avoid a call per value."""
+		n, mu, m2, total, minx, maxx = self.n, self.mean, self.m2, self.sum, self.min, self.max
+		
+		for x in iterable:
+			if x is None:
+				continue
+			
+			n += 1
+			delta = x - mu
+			mu += delta / float(n)
+			m2 += delta * (x - mu)
+			total += x
+			
+			if n == 1:
+				minx = maxx = x
+			elif x < minx:
+				minx = x
+			elif x > maxx:
+				maxx = x
+		
+		self.n, self.mean, self.m2, self.sum, self.min, self.max = n, mu, m2, total, minx, maxx
+	
+	def remove(self, x):
+		"""Take a previously pushed value back out (Welford's update in reverse). None is ignored.
+		Note that min and max can not be unwound, so they are left as they were.
+		"""
+		if x is None:
+			return
+		
+		if self.n <= 1:
+			self.n = 0
+			self.mean = self.m2 = self.sum = 0.0
+			self.min = self.max = None
+			return
+		
+		prev_mean = self.mean
+		self.n -= 1
+		self.mean = (prev_mean * (self.n + 1) - x) / float(self.n)
+		# cancellation can leave a sliver below zero, but a sum of squares never is
+		self.m2 = max(self.m2 - (x - prev_mean) * (x - self.mean), 0.0)
+		self.sum -= x
+	
+	def __len__(self):
+		return self.n
+	
+	@property
+	def variance(self):
+		"""Sample variance (N-1 DoF), or None if there are too few values"""
+		if self.n < 2:
+			return None
+		return self.m2 / (self.n - 1)
+	
+	@property
+	def standard_deviation(self):
+		if self.n < 2:
+			return None
+		return math.sqrt(self.variance)
+	
+	def describe(self):
+		"""Returns the same summary as the describe function does."""
+		if not self.n:
+			raise InsufficientData
+		
+		return {
+			'n': self.n,
+			'min': self.min,
+			'max': self.max,
+			'sum': self.sum,
+			'mean': self.sum / self.n,
+			'variance': self.variance,
+			'standard deviation': self.standard_deviation,
+			'span': self.max - self.min,
+		}
+	
+	def __repr__(self):
+		return '<RunningDescription n=%d mean=%r>' % (self.n, self.mean)
 
-	values = [x]
 
-	minx = x 
-	maxx = x
-	total = float(x)
 
-	# pass one - basic stats
-	for x in iterator:
+class ExponentialMovingStatistics(object):
+	"""Exponentially weighted moving mean and variance (ignoring None values).
+	
+	Recent values count the most: each new value gets a weight of alpha 
+	and everything before it decays by (1 - alpha). Give either alpha 
+	directly or the span (in samples) it should roughly average over, 
+	where alpha = 2/(span + 1). Each push is O(1) and keeps no history.
+	"""
+	__slots__ = ('alpha', 'n', 'mean', 'variance')
+	
+	def __init__(self, alpha=None, span=None):
+		if alpha is None:
+			if span is None:
+				raise StatisticsError('Either alpha or span is needed to weight the average')
+			alpha = 2.0 / (span + 1)
+		if not 0 < alpha <= 1:
+			raise StatisticsError('Alpha must be within (0, 1]')
+		self.alpha = alpha
+		self.n = 0
+		self.mean = None
+		self.variance = None
+	
+	def push(self, x):
 		if x is None:
-			continue
+			return
+		self.n += 1
+		if self.n == 1:
+			self.mean = float(x)
+			self.variance = 0.0
+			return
+		delta = x - self.mean
+		increment = self.alpha * delta
+		self.mean += increment
+		self.variance = (1 - self.alpha) * (self.variance + delta * increment)
+	
+	def extend(self, iterable):
+		for x in iterable:
+			self.push(x)
+	
+	@property
+	def standard_deviation(self):
+		if self.variance is None:
+			return None
+		return math.sqrt(self.variance)
+	
+	def __repr__(self):
+		return '<ExponentialMovingStatistics alpha=%r mean=%r>' % (self.alpha, self.mean)
 
-		values.append(x)
-		total += x
 
-		if x < minx:
-			minx = x
-		if x > maxx:
-			maxx = x
+class RunningCovariance(object):
+	"""Covariance and correlation between two streams, updated one pair at a time.
+	
+	Pairs where either value is None are skipped. Each push is O(1) 
+	and keeps no history (Welford's method, extended to co-moments).
+	"""
+	__slots__ = ('n', 'mean_x', 'mean_y', 'm2_x', 'm2_y', 'comoment')
+	
+	def __init__(self, pairs=None):
+		self.n = 0
+		self.mean_x = self.mean_y = 0.0
+		self.m2_x = self.m2_y = 0.0
+		self.comoment = 0.0
+		
+		if pairs is not None:
+			self.extend(pairs)
+	
+	def push(self, x, y):
+		if x is None or y is None:
+			return
+		self.n += 1
+		delta_x = x - self.mean_x
+		self.mean_x += delta_x / float(self.n)
+		delta_y = y - self.mean_y
+		self.mean_y += delta_y / float(self.n)
+		self.m2_x += delta_x * (x - self.mean_x)
+		self.m2_y += delta_y * (y - self.mean_y)
+		self.comoment += delta_x * (y - self.mean_y)
+	
+	def extend(self, pairs):
+		for x, y in pairs:
+			self.push(x, y)
+	
+	@property
+	def covariance(self):
+		"""Sample covariance (N-1 DoF), or None if there are too few pairs"""
+		if self.n < 2:
+			return None
+		return self.comoment / (self.n - 1)
+	
+	@property
+	def correlation(self):
+		"""Pearson's r, or None if either stream has not varied yet"""
+		if self.n < 2 or not (self.m2_x and self.m2_y):
+			return None
+		return self.comoment / math.sqrt(self.m2_x * self.m2_y)
+	
+	def __repr__(self):
+		return '<%s n=%d>' % (type(self).__name__, self.n)
 
-	mu = total / len(values)
-	if len(values) < 2:
-		v = None
-		sd = None
-	else:
-		v = math.fsum(pow(x-mu,2) for x in values) / (len(values) - 1)
-		sd = math.sqrt(v)
-
-	return {
-		'n': len(values),
-		'min': minx,
-		'max': maxx,
-		'sum': total,
-		'mean': mu,
-		'variance': v,
-		'standard deviation': sd,
-		'span': maxx - minx,
-	}
+
+class RunningRegression(RunningCovariance):
+	"""Incremental least-squares fit of y = slope*x + intercept (see RunningCovariance)"""
+	__slots__ = ()
+	
+	@property
+	def slope(self):
+		"""Least-squares slope, or None until x has varied"""
+		if self.n < 2 or not self.m2_x:
+			return None
+		return self.comoment / self.m2_x
+	
+	@property
+	def intercept(self):
+		slope = self.slope
+		if slope is None:
+			return None
+		return self.mean_y - slope * self.mean_x
+	
+	def predict(self, x):
+		return self.slope * x + self.intercept
+
+
+def describe(iterable):
+	"""Returns the basic statistics of the iterable (ignoring None values)
+	
+	This is a single pass in constant memory, so generators are fine.
+	"""
+	return RunningDescription(iterable).describe()
 
 
 
 def combine_descriptions(desc1, desc2):
+	# a single value has no variance, but it also adds nothing to the pooled sum of squares
 	d3_n, d3_mean, d3_variance = combine_stats(
-		desc1['n'],desc1['mean'],desc1['variance'],
-		desc2['n'],desc2['mean'],desc2['variance'],
+		desc1['n'],desc1['mean'],desc1['variance'] or 0.0,
+		desc2['n'],desc2['mean'],desc2['variance'] or 0.0,
 		)
 
 	desc3 = {
@@ -477,6 +1166,98 @@ def combine_descriptions(desc1, desc2):
 
 
 
+def _describe_partition(partition):
+	"""Describe one partition, or None if it has no values (module level so it pickles)"""
+	try:
+		return describe(partition)
+	except InsufficientData:
+		return None
+
+
+def reduce_descriptions(descriptions):
+	"""Combines descriptions pairwise as a tree, skipping any that are None.
+	Pairing neighbors keeps the merged partitions similar in size, which is kinder to precision.
+	"""
+	level = [description for description in descriptions if description is not None]
+	if not level:
+		raise InsufficientData
+	
+	while len(level) > 1:
+		merged = [combine_descriptions(level[i], level[i+1]) 
+				  for i in range(0, len(level) - 1, 2)]
+		if len(level) % 2:
+			merged.append(level[-1])
+		level = merged
+	
+	return level[0]
+
+
+def parallel_map(function, items, workers=4, processes=False, name='parallel-map'):
+	"""Returns [function(item) for item in items], with the calls spread over a pool of workers.
+	
+	By default the pool is threads, which run in parallel on Jython.
+	On CPython, set processes=True to use a multiprocessing pool instead
+	(and then the function must be module level and the items picklable).
+	With one worker (or one item) the calls are simply made in order.
+	The first exception raised by any call is raised once the pool is done.
+	"""
+	items = list(items)
+	workers = max(1, min(workers, len(items)))
+	
+	if workers == 1:
+		return [function(item) for item in items]
+	
+	if processes:
+		from multiprocessing import Pool
+		pool = Pool(workers)
+		try:
+			return pool.map(function, items)
+		finally:
+			pool.close()
+	
+	results = [None] * len(items)
+	work = Queue()
+	for ix in range(len(items)):
+		work.put(ix)
+	failures = []
+	
+	def work_through_queue():
+		while True:
+			try:
+				ix = work.get_nowait()
+			except Empty:
+				return
+			try:
+				results[ix] = function(items[ix])
+			except Exception, error:
+				failures.append(error)
+				return
+	
+	threads = [Thread(target=work_through_queue, name='%s-%d' % (name, i)) 
+			   for i in range(workers)]
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
+	
+	if failures:
+		raise failures[0]
+	
+	return results
+
+
+def parallel_describe(partitions, workers=4, processes=False):
+	"""Describes each partition concurrently and combines the results, as if describe() saw it all.
+	
+	Partitions may be any iterable of iterables, like shared.tools.data.chunks(values, size).
+	The work is spread over a pool (see parallel_map): threads by default, or with
+	processes=True a multiprocessing pool, and then the partitions need to be 
+	picklable, so lists rather than generators.
+	"""
+	return reduce_descriptions(parallel_map(_describe_partition, partitions, workers, processes, 
+											name='parallel-describe'))
+
+
 NON_ROUNDING_DESCRIPTION_KEYS = set(['n','sum'])
 
 
@@ -506,6 +1287,520 @@ def apply_rounding(x, sigfigs=None, round_digits=None, skip_keys=NON_ROUNDING_DE
 	return apply_rounding(desc3, sigfigs, round_digits)
 
 
+
+
+#
+# Time windowed statistics
+#
+# Samples arrive as (timestamp, value) pairs, in time order. Timestamps may be
+# numbers (seconds), datetimes, or Java Dates; widths may be numbers or timedeltas.
+# Internally everything is converted to seconds.
+#
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def timestamp_seconds(timestamp):
+	"""Returns the timestamp (or width) as a float of seconds"""
+	if isinstance(timestamp, datetime):
+		return (timestamp - _EPOCH).total_seconds()
+	if isinstance(timestamp, timedelta):
+		return timestamp.total_seconds()
+	try: # Java Date
+		return timestamp.getTime() / 1000.0
+	except AttributeError:
+		return float(timestamp)
+
+
+class TumblingWindow(object):
+	"""Describes back-to-back, non-overlapping spans of time.
+	
+	Each window accumulates in a RunningDescription, so a sample costs O(1).
+	When a sample lands past the current window it is closed and archived
+	as (window start in seconds, description), keeping the last archive_limit.
+	"""
+	__slots__ = ('width', 'origin', 'current', 'window_start', 'completed')
+	
+	def __init__(self, width, origin=0, archive_limit=10):
+		self.width = timestamp_seconds(width)
+		if self.width <= 0:
+			raise StatisticsError('Windows must have a positive width')
+		self.origin = timestamp_seconds(origin)
+		self.current = RunningDescription()
+		self.window_start = None
+		self.completed = deque(maxlen=archive_limit)
+	
+	def push(self, timestamp, x):
+		t = timestamp_seconds(timestamp)
+		window_start = self.origin + ((t - self.origin) // self.width) * self.width
+		
+		if self.window_start is None:
+			self.window_start = window_start
+		elif window_start > self.window_start:
+			self.close()
+			self.window_start = window_start
+		elif window_start < self.window_start:
+			raise StatisticsError('Samples must arrive in time order')
+		
+		self.current.push(x)
+	
+	def extend(self, pairs):
+		for timestamp, x in pairs:
+			self.push(timestamp, x)
+	
+	def close(self):
+		"""Archive the current window (if it saw any values) and start a fresh one"""
+		if self.current.n:
+			self.completed.append((self.window_start, self.current.describe()))
+		self.current = RunningDescription()
+	
+	def describe(self):
+		"""Returns the description of the window still accumulating"""
+		return self.current.describe()
+
+
+class SlidingWindow(object):
+	"""Describes the samples within the trailing width of time from the latest timestamp.
+	
+	Samples are kept (they have to be, to leave the window), but the
+	statistics are updated incrementally: pushing and evicting are O(1),
+	and min/max are tracked with monotonic queues (O(1) amortized).
+	
+	Removing values drifts the running sums with rounding error, so once as many
+	values have been evicted as the window holds, the statistics are recomputed
+	from the samples kept (which is still O(1) amortized per sample).
+	"""
+	__slots__ = ('width', 'samples', 'running', '_minima', '_maxima', 'latest', '_evictions')
+	
+	def __init__(self, width):
+		self.width = timestamp_seconds(width)
+		if self.width <= 0:
+			raise StatisticsError('Windows must have a positive width')
+		self.samples = deque()
+		self.running = RunningDescription()
+		self._minima = deque()
+		self._maxima = deque()
+		self.latest = None
+		self._evictions = 0
+	
+	def push(self, timestamp, x):
+		t = timestamp_seconds(timestamp)
+		if self.latest is not None and t < self.latest:
+			raise StatisticsError('Samples must arrive in time order')
+		self.latest = t
+		
+		if x is not None:
+			self.samples.append((t, x))
+			self.running.push(x)
+			
+			while self._minima and self._minima[-1][1] >= x:
+				self._minima.pop()
+			self._minima.append((t, x))
+			while self._maxima and self._maxima[-1][1] <= x:
+				self._maxima.pop()
+			self._maxima.append((t, x))
+		
+		self.evict(t - self.width)
+	
+	def extend(self, pairs):
+		for timestamp, x in pairs:
+			self.push(timestamp, x)
+	
+	def evict(self, cutoff):
+		"""Drop everything at or before the cutoff (in seconds)"""
+		samples = self.samples
+		while samples and samples[0][0] <= cutoff:
+			_, x = samples.popleft()
+			self.running.remove(x)
+			self._evictions += 1
+		if self._evictions and self._evictions >= len(samples):
+			self.running = RunningDescription(x for _, x in samples)
+			self._evictions = 0
+		while self._minima and self._minima[0][0] <= cutoff:
+			self._minima.popleft()
+		while self._maxima and self._maxima[0][0] <= cutoff:
+			self._maxima.popleft()
+	
+	def __len__(self):
+		return len(self.samples)
+	
+	def describe(self):
+		"""Returns the description of the samples currently in the window"""
+		description = self.running.describe()
+		description['min'] = self._minima[0][1]
+		description['max'] = self._maxima[0][1]
+		description['span'] = description['max'] - description['min']
+		return description
+
+
+class WindowedDescription(object):
+	"""Feeds a stream of (timestamp, value) pairs to a set of labeled windows.
+	
+	>>> rollups = WindowedDescription({
+	...     '5 min':  TumblingWindow(timedelta(minutes=5)),
+	...     '1 hour': SlidingWindow(timedelta(hours=1)),
+	... })
+	>>> rollups.extend((t, t % 7) for t in range(0, 7200, 10))
+	>>> rollups.describe()['1 hour']['n']
+	360
+	"""
+	
+	def __init__(self, windows):
+		self.windows = dict(windows)
+	
+	def push(self, timestamp, x):
+		for window in self.windows.values():
+			window.push(timestamp, x)
+	
+	def extend(self, pairs):
+		windows = self.windows.values()
+		for timestamp, x in pairs:
+			for window in windows:
+				window.push(timestamp, x)
+	
+	def describe(self):
+		"""Returns the current description for each window (skipping any without data yet)"""
+		descriptions = {}
+		for label, window in self.windows.items():
+			try:
+				descriptions[label] = window.describe()
+			except InsufficientData:
+				pass
+		return descriptions
+
+
+#
+# Array-backed path
+#
+# These take a flat array.array('d') (or NumPy array) of samples and an optional
+# validity mask in place of None values. They are an option, not the default:
+# the list functions above are unchanged, and only hand SampleBuffers over here.
+#
+# With NumPy arrays the work is done in bulk, with no Python object per sample,
+# and that is where the speed is (see shared.data.benchmark.benchmark_array_path).
+# Without NumPy the work is pushed into builtins like math.fsum and sorted,
+# which runs about as fast as the list functions - the gain there is the
+# compact storage (8 bytes a sample, and a byte for its flag), not speed.
+#
+# A SampleBuffer can be used in place of both the values and mask.
+#
+
+def _is_ndarray(values):
+	return numpy is not None and isinstance(values, numpy.ndarray)
+
+
+def _check_mask(values, mask):
+	if len(mask) != len(values):
+		raise ValueError('The mask needs a flag for every value (got %d flags for %d values)' % (
+							len(mask), len(values)))
+
+
+def compact_array(values, mask=None):
+	"""Returns just the valid samples as a flat array.
+	
+	The mask is a sequence of 1 (valid) or 0 (missing) flags parallel 
+	to values (and just as long). If no mask is given the values are returned as-is.
+	"""
+	if isinstance(values, SampleBuffer):
+		return array('d', values.valid_samples())
+	if mask is None:
+		return values
+	_check_mask(values, mask)
+	if _is_ndarray(values):
+		return values[numpy.asarray(mask, dtype=bool)]
+	return array('d', compress(values, mask))
+
+
+def _valid_samples(values, mask):
+	"""Returns a fresh iterator over the valid samples and how many there are (no copy)"""
+	if isinstance(values, SampleBuffer):
+		return values.valid_samples(), values.valid_count()
+	if mask is None:
+		return iter(values), len(values)
+	_check_mask(values, mask)
+	return compress(values, mask), sum(mask)
+
+
+def array_mean(values, mask=None):
+	"""Returns the average of the valid samples"""
+	if _is_ndarray(values):
+		values = compact_array(values, mask)
+		if not len(values):
+			raise InsufficientData
+		return float(values.mean())
+	
+	samples, n = _valid_samples(values, mask)
+	if not n:
+		raise InsufficientData
+	return math.fsum(samples) / n
+
+
+def array_variance(values, mask=None):
+	"""Returns the sample variance (N-1 DoF) of the valid samples"""
+	if _is_ndarray(values):
+		values = compact_array(values, mask)
+		if len(values) < 2:
+			raise InsufficientData("Variance is calculated with N-1 DoF")
+		return float(values.var(ddof=1))
+	
+	samples, n = _valid_samples(values, mask)
+	if n < 2:
+		raise InsufficientData("Variance is calculated with N-1 DoF")
+	mu = math.fsum(samples) / n
+	
+	samples, n = _valid_samples(values, mask)
+	return math.fsum(imap(pow, imap(op.sub, samples, repeat(mu)), repeat(2))) / (n - 1)
+
+
+def array_geometric_mean(values, mask=None):
+	"""Returns the log-average of the valid samples, like geometric_mean()"""
+	if _is_ndarray(values):
+		values = compact_array(values, mask)
+		n = len(values)
+		if not n:
+			raise InsufficientData
+		negative_values = int((values < 0).sum())
+		sum_logs = float(numpy.log(numpy.abs(values)).sum())
+	else:
+		samples, n = _valid_samples(values, mask)
+		if not n:
+			raise InsufficientData
+		sum_logs = math.fsum(imap(math.log, imap(abs, samples)))
+		samples, n = _valid_samples(values, mask)
+		negative_values = sum(imap(op.lt, samples, repeat(0)))
+	
+	negative_correction_compensation = math.pow(math.pow(-1,negative_values),1.0/n)
+
+	return negative_correction_compensation * math.exp((1.0/n)*sum_logs)
+
+
+def array_harmonic_mean(values, mask=None):
+	"""Returns the reciprocal of the mean of the reciprocals of the valid samples.
+	If a value is 0, the result is zero
+	"""
+	if _is_ndarray(values):
+		values = compact_array(values, mask)
+		if not len(values):
+			raise InsufficientData
+		if not values.all():
+			return 0.0
+		return len(values) / float((1.0 / values).sum())
+	
+	samples, n = _valid_samples(values, mask)
+	if not n:
+		raise InsufficientData
+	if 0 in samples:
+		return 0.0
+	samples, n = _valid_samples(values, mask)
+	return n / math.fsum(imap(op.truediv, repeat(1.0), samples))
+
+
+def _ranked_samples(values, mask):
+	"""Returns a lookup for the value at a 1-based rank and the number of valid samples.
+	Sorted SampleBuffers are used in place, everything else gets a sorted copy.
+	"""
+	if isinstance(values, SampleBuffer) and values.is_sorted:
+		return values.value_at_rank, values.valid_count()
+	
+	if _is_ndarray(values):
+		values = numpy.sort(compact_array(values, mask))
+	else:
+		values = sorted(_valid_samples(values, mask)[0])
+	
+	return (lambda rank: float(values[rank - 1])), len(values)
+
+
+def array_quantiles(values, mask=None, n=4):
+	"""Returns the values to evenly divide the valid samples into n spans, like quantiles()"""
+	if n < 1:
+		raise StatisticsError('Quantiles return n-1 values as the fenceposts')
+	
+	value_at_rank, count = _ranked_samples(values, mask)
+	
+	if count < n:
+		raise StatisticsError('Data should be large enough to have at least one element in each quantile. Data: %r of %r buckets' % (count, n))
+	
+	if count == n:
+		return [value_at_rank(rank) for rank in range(1, n + 1)]
+	
+	return _exclusive_quantiles(value_at_rank, count, n)
+
+
+def array_median(values, mask=None):
+	"""Returns the value in the middle of the valid samples, like median()"""
+	value_at_rank, count = _ranked_samples(values, mask)
+	
+	if not count:
+		raise InsufficientData
+	
+	if count % 2 == 0:
+		return (value_at_rank(count/2) + value_at_rank(count/2 + 1)) / 2.0
+	else:
+		return value_at_rank((count + 1)/2)
+
+
+def array_histogram(values, mask=None, buckets=None, start=None, stop=None, step=None):
+	"""Returns the slice and bucket counts for the valid samples, like histogram().
+	Samples outside the buckets are dropped.
+	"""
+	if _is_ndarray(values):
+		values = compact_array(values, mask)
+		if not len(values):
+			raise InsufficientData
+		config, x_buckets = _resolve_histogram_slice(values.min(), values.max(), buckets, start, stop, step)
+		indexes = numpy.floor((values - config.start) / config.step).astype(int)
+		indexes = indexes[(indexes >= 0) & (indexes < x_buckets)]
+		return config, [int(c) for c in numpy.bincount(indexes, minlength=x_buckets)]
+	
+	samples, n = _valid_samples(values, mask)
+	if not n:
+		raise InsufficientData
+	minx = min(samples)
+	maxx = max(_valid_samples(values, mask)[0])
+	config, x_buckets = _resolve_histogram_slice(minx, maxx, buckets, start, stop, step)
+	
+	# one pass, counting straight into the buckets (nothing per sample is kept)
+	counts = array('l', [0]) * x_buckets
+	x_start, x_step = config.start, config.step
+	for x in _valid_samples(values, mask)[0]:
+		ix = int((x - x_start) // x_step)
+		if 0 <= ix < x_buckets:
+			counts[ix] += 1
+	return config, counts.tolist()
+
+
+
+class SampleBuffer(object):
+	"""A compact column of float samples with a parallel mask marking the missing ones.
+	
+	Values live in an array.array('d') (8 bytes each, instead of a boxed float
+	and a list slot) with one byte alongside flagging whether the sample is valid,
+	so None can be appended and reads back as None.
+	
+	Slicing returns a view over the same storage instead of a copy. Views are
+	read-only (no appending or sorting), and must only be taken with a step of 1. Sorting puts the valid
+	values in order (missing ones at the end) in place, and the order statistics
+	(median, quantiles) then read straight from the buffer without sorting again.
+	
+	Pass a buffer to mean, variance, median, quantiles, histogram, and friends
+	and they use the array-backed fast path. Everything else iterates it,
+	which yields None for the missing samples.
+	"""
+	__slots__ = ('values', 'mask', 'start', 'stop', 'is_sorted')
+	
+	_MISSING = float('nan')
+	
+	def __init__(self, iterable=None):
+		self.values = array('d')
+		self.mask = array('b')
+		self.start = 0
+		self.stop = None # the end of the storage, unless this is a view
+		self.is_sorted = False
+		
+		if iterable is not None:
+			self.extend(iterable)
+	
+	def _bounds(self):
+		if self.stop is None:
+			return self.start, len(self.values)
+		return self.start, self.stop
+	
+	@property
+	def is_view(self):
+		return self.stop is not None
+	
+	def append(self, x):
+		if self.is_view:
+			raise StatisticsError('Views of a sample buffer are read only')
+		if x is None:
+			self.values.append(self._MISSING)
+			self.mask.append(0)
+		else:
+			self.values.append(x)
+			self.mask.append(1)
+		self.is_sorted = False
+	
+	def extend(self, iterable):
+		if self.is_view:
+			raise StatisticsError('Views of a sample buffer are read only')
+		append_value, append_flag, missing = self.values.append, self.mask.append, self._MISSING
+		for x in iterable:
+			if x is None:
+				append_value(missing)
+				append_flag(0)
+			else:
+				append_value(x)
+				append_flag(1)
+		self.is_sorted = False
+	
+	def __len__(self):
+		start, stop = self._bounds()
+		return stop - start
+	
+	def __getitem__(self, key):
+		start, stop = self._bounds()
+		
+		if isinstance(key, slice):
+			view_start, view_stop, step = key.indices(stop - start)
+			if step != 1:
+				raise StatisticsError('Sample buffer views must be contiguous (a step of 1)')
+			view = SampleBuffer.__new__(SampleBuffer)
+			view.values = self.values
+			view.mask = self.mask
+			view.start = start + view_start
+			view.stop = start + max(view_start, view_stop)
+			# the valid samples of a sorted buffer are still first and in order in any slice of it
+			view.is_sorted = self.is_sorted
+			return view
+		
+		if key < 0:
+			key += stop - start
+		if not 0 <= key < stop - start:
+			raise IndexError('Sample buffer index out of range')
+		if self.mask[start + key]:
+			return self.values[start + key]
+		return None
+	
+	def __iter__(self):
+		start, stop = self._bounds()
+		for x, valid in izip(islice(self.values, start, stop), islice(self.mask, start, stop)):
+			yield x if valid else None
+	
+	def valid_samples(self):
+		"""Returns an iterator over just the valid samples"""
+		start, stop = self._bounds()
+		if start == 0 and self.stop is None:
+			return compress(self.values, self.mask)
+		return compress(islice(self.values, start, stop), islice(self.mask, start, stop))
+	
+	def valid_count(self):
+		start, stop = self._bounds()
+		if start == 0 and self.stop is None:
+			return sum(self.mask)
+		return sum(islice(self.mask, start, stop))
+	
+	def sort(self):
+		"""Order the valid samples in place, with the missing ones moved to the end"""
+		if self.is_view:
+			raise StatisticsError('Views of a sample buffer are read only (sort the buffer, or a copy of the view)')
+		start, stop = self._bounds()
+		ordered = array('d', sorted(self.valid_samples()))
+		n = len(ordered)
+		
+		self.values[start:start + n] = ordered
+		self.values[start + n:stop] = array('d', [self._MISSING]) * (stop - start - n)
+		self.mask[start:stop] = array('b', [1]) * n + array('b', [0]) * (stop - start - n)
+		self.is_sorted = True
+	
+	def value_at_rank(self, rank):
+		"""For a sorted buffer, the rank-th smallest valid value (1-based)"""
+		return self.values[self.start + rank - 1]
+	
+	def __repr__(self):
+		return '<SampleBuffer%s of %d samples (%d missing)>' % (
+			' view' if self.is_view else '', len(self), len(self) - self.valid_count())
+
+
 #
 #data = [
 #	4,3,1,2,2,None,None,2,1,1,3,3,5,None,6,1.5,3,4,3.33,1,2,2,1
@@ -530,4 +1825,3 @@ def apply_rounding(x, sigfigs=None, round_digits=None, skip_keys=NON_ROUNDING_DE
 #assert round(harmonic_mean([40, 60]),1) == 48.0
 #assert round(harmonic_mean([2.5, 3, 10]),1) == 3.6
 #assert round(geometric_mean([54, 24, 36]), 1) == 36.0
-
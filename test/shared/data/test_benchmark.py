@@ -0,0 +1,60 @@
+import unittest, doctest
+import os, random, tempfile
+
+from shared.data.benchmark import *
+
+
+class GeneratorTestCase(unittest.TestCase):
+
+	def test_reproducible(self):
+		for name, generator in sorted(DATA_GENERATORS.items()):
+			self.assertEqual(generator(500, 3), generator(500, 3))
+			self.assertNotEqual(generator(500, 3), generator(500, 4))
+			self.assertEqual(500, len(generator(500)))
+
+	def test_holes(self):
+		data = generate_with_holes(10000, missing_fraction=0.2)
+		self.assertAlmostEqual(0.2, data.count(None) / 10000.0, delta=0.02)
+		# the holes are punched in the generator's data, not drawn from the same stream
+		for x, y in zip(data, generate_normal(10000)):
+			self.assertTrue(x is None or x == y)
+
+	def test_globalRandomUntouched(self):
+		state = random.getstate()
+		generate_drunken_walk(100, 7)
+		self.assertEqual(state, random.getstate())
+
+
+class StatsBenchmarkTestCase(unittest.TestCase):
+
+	def test_report(self):
+		report = run_stats_benchmark(sizes=[200], datasets=['normal'],
+									 functions=['mean', 'geometric_mean', 'QuantileSketch'],
+									 iterations=1, setup_executions=1)
+		rows = dict((row['function'], row) for row in report['results'])
+		self.assertEqual(['QuantileSketch', 'geometric_mean', 'mean'], sorted(rows))
+		self.assertTrue(rows['mean']['seconds'] >= 0)
+		# an odd number of negative samples has no geometric mean, which is recorded, not raised
+		self.assertTrue('error' in rows['geometric_mean'])
+
+		path = os.path.join(tempfile.mkdtemp(), 'report.json')
+		write_benchmark_report(report, path)
+		self.assertEqual(report['results'], read_benchmark_report(path)['results'])
+
+	def test_compare(self):
+		def report(*timings):
+			return {'results': [{'function': function, 'dataset': 'normal', 'size': 100, 'seconds': seconds}
+								for function, seconds in timings]}
+		baseline = report(('mean', 1.0), ('median', 1.0), ('mode', 1.0), ('histogram', None))
+		candidate = report(('mean', 1.2), ('median', 3.0), ('mode', 2.0), ('histogram', 1.0), ('new', 1.0))
+		self.assertEqual([('median', 'normal', 100, 1.0, 3.0, 3.0),
+						  ('mode', 'normal', 100, 1.0, 2.0, 2.0)],
+						 compare_benchmark_reports(baseline, candidate))
+		self.assertEqual(3, len(compare_benchmark_reports(baseline, candidate, threshold=1.1)))
+
+
+suite = unittest.TestLoader().loadTestsFromTestCase(GeneratorTestCase)
+unittest.TextTestRunner(verbosity=2).run(suite)
+
+suite = unittest.TestLoader().loadTestsFromTestCase(StatsBenchmarkTestCase)
+unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,88 @@
+import unittest, doctest
+import random
+
+from shared.data.simulators.process import parse_simulator
+from shared.data.simulators.ensemble import run_ensemble
+
+
+# a walk that jitters by its member's own random numbers
+ENSEMBLE_DEFINITION = """
+mixins: [Expression]
+initial: walk
+variables: [x, z]
+start: {x: 0, z: 0}
+escapement: {kind: increment, config: {variable: t, increment: 1}}
+states:
+  walk:
+    x: 'x + z'
+  stopped:
+    x: 'x'
+transitions:
+  walk:
+    stopped:
+      conditions: 'x > 30'
+"""
+
+
+def jitter(z, _random):
+	return _random.gauss(0, 2)
+
+
+def start_spread(generator):
+	return {'x': generator.uniform(-5, 5)}
+
+
+class EnsembleTestCase(unittest.TestCase):
+
+	def definition(self):
+		Simulator, configuration = parse_simulator(ENSEMBLE_DEFINITION)
+		configuration['states']['walk']['z'] = jitter
+		configuration['states']['stopped']['z'] = 0
+		return Simulator, configuration
+
+	def ensemble(self, seed=0, **options):
+		return run_ensemble(self.definition(), 12, 200, seed=seed, start=start_spread, **options)
+
+	def test_sameSeedsSameEnsemble(self):
+		expected = self.ensemble(workers=1)
+		self.assertEqual(range(12), expected['seeds'])
+		# the members actually wandered (and differently)
+		finals = set(run['final']['x'] for run in expected['runs'])
+		self.assertEqual(12, len(finals))
+		
+		# however the members are run, and whatever else draws from random meanwhile
+		random.seed(17)
+		self.assertEqual(expected['runs'], self.ensemble(workers=1)['runs'])
+		self.assertEqual(expected['runs'], self.ensemble(workers=4)['runs'])
+		self.assertEqual(expected['runs'], self.ensemble(workers=12)['runs'])
+		
+		self.assertNotEqual(expected['runs'], self.ensemble(seed=100, workers=4)['runs'])
+
+	def test_processes(self):
+		try:
+			import multiprocessing
+		except ImportError: # like on Jython, where the threads are what run in parallel
+			return
+		threaded = self.ensemble(workers=4)
+		processed = self.ensemble(workers=4, processes=True)
+		self.assertEqual(threaded['runs'], processed['runs'])
+		for key in ('members', 'seeds', 'states', 'final', 'overall', 'steps'):
+			self.assertEqual(threaded[key], processed[key], key)
+
+	def test_overlappingSeeds(self):
+		# member i is seeded with seed + i, so shifted ensembles share members
+		first = self.ensemble(seed=0, workers=3)['runs']
+		second = self.ensemble(seed=6, workers=3)['runs']
+		self.assertEqual(first[6:], second[:6])
+
+	def test_summary(self):
+		summary = self.ensemble(workers=4)
+		self.assertEqual(12, summary['members'])
+		self.assertEqual(200, summary['steps'])
+		self.assertEqual(12, sum(summary['states'].values()))
+		self.assertEqual(12, summary['final']['x']['n'])
+		self.assertEqual(12 * 200, summary['overall']['x']['n'])
+
+
+suite = unittest.TestLoader().loadTestsFromTestCase(EnsembleTestCase)
+unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,548 @@
+import unittest, doctest
+import os, tempfile
+from threading import Thread, Event
+from array import array
+from json import loads, dumps
+
+from shared.data import expression as expression_module
+from shared.data.expression import Expression, CompiledExpression, ExpressionProfiler, numpy
+from shared.data.expression import ExpressionCache, convert_to_postfix, normalize_source
+from shared.data.expression import write_expression_bundle, read_expression_bundle, load_expression_bundle
+from shared.data.benchmark import fuzz_expressions
+
+
+doctest.run_docstring_examples(ExpressionProfiler, globals())
+
+
+# expressions, and the arguments to call them with
+EQUIVALENCE_CASES = [
+	('2*3+x',                     {'x': 3.5}),
+	('x + 2*3 - 4',               {'x': 7}),
+	('(1 + 2) * (3 + 4) * x',     {'x': 2}),
+	('x / 2 + 1 / 2',             {'x': 3}),
+	('x // 2 % 3 ** 2',           {'x': 17}),
+	('x + 0 + 0.0',               {'x': 3}),
+	('max(2, 3) + x',             {'x': 1.5}),
+	('min(x, y) * min(x, y)',     {'x': 4, 'y': 9}),
+	('math.pi * 2 + x',           {'x': 1}),
+	('"a" * 3 + s',               {'s': 'b'}),
+	('x, 2*3',                    {'x': 1}),
+	('x < 2 and 3 > 2',           {'x': 1}),
+	('x < 2 and 3 > 2',           {'x': 5}),
+	('x*x + x*x',                 {'x': 3}),
+	('(x+1)*(x+1) - (x+1)',       {'x': 2.5}),
+	('x.real * x.real + x.imag',  {'x': 3+4j}),
+	('x*y - y*x + 2**10',         {'x': 11, 'y': 13}),
+	('x in y',                    {'x': [1, 2], 'y': 2}),
+	('a[1] + a[1]',               {'a': [4, 5, 6]}),
+]
+
+# expressions that fail on the same call, before and after optimizing
+ERROR_CASES = [
+	('1/0 + x',                   {'x': 1},   ZeroDivisionError),
+	('x + "a" * 2',               {'x': 1},   TypeError),
+]
+
+OPTIONS = [
+	{'optimize': True},
+	{'optimize': True, 'hoist_calls': True},
+	{'optimize': False, 'hoist_calls': True},
+]
+
+
+def evaluate(backend, source, arguments, **options):
+	expression = backend(source, **options)
+	return expression(**arguments)
+
+
+class Counter(object):
+	"""Counts up every time it's read"""
+	def __init__(self):
+		self.count = 0
+	
+	@property
+	def real(self):
+		self.count += 1
+		return self.count
+
+
+class OptimizedEquivalenceTestCase(unittest.TestCase):
+
+	def test_sameResults(self):
+		for source, arguments in EQUIVALENCE_CASES:
+			expected = evaluate(Expression, source, arguments, optimize=False)
+			for backend in (Expression, CompiledExpression):
+				for options in OPTIONS:
+					result = evaluate(backend, source, arguments, **options)
+					self.assertEqual(expected, result, '%s %r %r' % (backend.__name__, source, options))
+					self.assertEqual(type(expected), type(result), '%s %r %r' % (backend.__name__, source, options))
+
+	def test_sameErrors(self):
+		for source, arguments, error in ERROR_CASES:
+			for backend in (Expression, CompiledExpression):
+				for options in OPTIONS + [{'optimize': False}]:
+					# building works - the error is only when it's called
+					expression = backend(source, **options)
+					self.assertRaises(error, expression, **arguments)
+
+	def test_constantsFolded(self):
+		expression = Expression('2*3+x')
+		self.assertIn(6, expression._constants)
+		self.assertEqual(1, len(expression._functions))
+		
+		expression = CompiledExpression('2*3+x')
+		self.assertNotIn('_t1', expression._source)
+
+	def test_callsHoisted(self):
+		self.assertEqual(1, len(Expression('max(2, 3) + x', hoist_calls=True)._functions))
+		self.assertEqual(2, len(Expression('max(2, 3) + x')._functions))
+		
+		self.assertNotIn('_t1', CompiledExpression('max(2, 3) + x', hoist_calls=True)._source)
+
+	def test_subexpressionsReused(self):
+		# (min is bound as _x0)
+		source = CompiledExpression('min(x, y) * min(x, y) + (x - y) * (x - y)')._source
+		self.assertEqual(1, source.count('_x0('))
+		self.assertEqual(1, source.count(' - '))
+		
+		source = CompiledExpression('min(x, y) * min(x, y)', optimize=False)._source
+		self.assertEqual(2, source.count('_x0('))
+
+	def test_impureNotReused(self):
+		# attributes may be properties, so they're looked up every time they appear
+		source = CompiledExpression('x.real * x.real')._source
+		self.assertEqual(2, source.count('.real'))
+		source = CompiledExpression('(x.real + 1) * (x.real + 1)')._source
+		self.assertEqual(2, source.count('.real'))
+		
+		counter = Counter()
+		self.assertEqual(1 * 2 + 3 * 4, CompiledExpression('x.real * x.real + x.real * x.real')(counter))
+
+
+# arguments that are all numbers take the specialized path, the rest fall back
+SIGNATURE_CASES = [
+	('x*x - y + 3*x',             [(3, 4), (3.5, 4.25), (2**70, 1), ([1], 2)]),
+	('x + y',                     [(1, 2.5), (True, False), ('a', 'b'), ((1,), (2,))]),
+	('x * y',                     [(3, 4), (1+2j, 2), ([1, 2], 3), ('ab', 2)]),
+	('x.real * 2 + y',            [(3+1j, 1), (2.5, 1)]),
+	('(x + 1) * (x + 1) - x',     [(1, 0), (0.5, 0)]),
+	('x < 2 and y > 3',           [(1, 4), (3, 4)]),
+	('x, y',                      [(1, 2)]),
+]
+
+
+class SignatureEquivalenceTestCase(unittest.TestCase):
+
+	def test_sameResults(self):
+		for source, calls in SIGNATURE_CASES:
+			for backend in (Expression, CompiledExpression):
+				generic = backend(source)
+				typed = backend(source, signature='infer')
+				for arguments in calls:
+					arguments = arguments[:len(generic._fields)]
+					try:
+						expected = generic(*arguments)
+					except Exception, error:
+						self.assertRaises(type(error), typed, *arguments)
+						continue
+					for repeat in range(2): # once to infer, once inferred
+						result = typed(*arguments)
+						self.assertEqual(expected, result, '%s %r %r' % (backend.__name__, source, arguments))
+						self.assertEqual(type(expected), type(result), '%s %r %r' % (backend.__name__, source, arguments))
+
+	def test_specialization(self):
+		self.assertNotEqual(None, Expression('x + y', signature=(int, float))._typed_func)
+		self.assertNotEqual(None, Expression('x + y', signature={'x': int, 'y': float})._typed_func)
+		# tuples are not numbers
+		self.assertEqual(None, Expression('x, y', signature=(int, int))._typed_func)
+		self.assertEqual(None, Expression('"a" + x', signature=(int,))._typed_func)
+
+	def test_badSignatures(self):
+		self.assertRaises(TypeError, Expression, 'x + y', signature=(str, int))
+		self.assertRaises(TypeError, Expression, 'x + y', signature=(int,))
+		self.assertRaises(TypeError, Expression, 'x + y', signature={'x': int})
+
+
+# parses that used to go wrong, and what Python says they are
+PARSER_CASES = [
+	('x - (y + 1)',               {'x': 3, 'y': 4}),
+	('x < (1 != 10)',             {'x': 3}),
+	('max(min(x, 1), 2)',         {'x': 3}),
+	('min(x.real, (y > x))',      {'x': 3, 'y': 4}),
+	('not not x',                 {'x': 3}),
+	('v[2] - v[0]',               {'v': [1, 2, 3]}),
+]
+
+
+class Point(object):
+	def __init__(self, x, y):
+		self.x = x
+		self.y = y
+
+
+# attributes with the same name as a field (which stays a field)
+ATTRIBUTE_CASES = [
+	('x + p.x',                   {'x': 5.0},    ('x', 'p')),
+	('real + x.real',             {'real': 1, 'x': 3+4j}, ('real', 'x')),
+	('p.x + x',                   {'x': 2},      ('p', 'x')),
+	('p.y + x * p.y',             {'x': 2},      ('p', 'x')),
+	('p.x + p.y',                 {},            ('p',)),
+]
+
+
+class FuzzTestCase(unittest.TestCase):
+
+	def test_parserCases(self):
+		for source, arguments in PARSER_CASES:
+			for backend in (Expression, CompiledExpression):
+				self.assertEqual(eval(source, {}, arguments), evaluate(backend, source, arguments), 
+								 '%s %r' % (backend.__name__, source))
+
+	def test_attributesNamedLikeFields(self):
+		point = Point(5.0, 7.0)
+		for source, arguments, fields in ATTRIBUTE_CASES:
+			arguments = dict(arguments, p=point)
+			expected = eval(source, {}, arguments)
+			for backend in (Expression, CompiledExpression):
+				expression = backend(source)
+				self.assertEqual(fields, expression._fields, '%s %r' % (backend.__name__, source))
+				self.assertEqual(expected, expression(**arguments), '%s %r' % (backend.__name__, source))
+
+	def test_agreesWithEval(self):
+		for backend in (Expression, CompiledExpression):
+			report = fuzz_expressions(count=300, seed=20, backend=backend, repeats=0)
+			self.assertEqual([], report['mismatches'])
+			self.assertEqual(300, report['agreed'] + report['eager'])
+
+
+# expressions over columns, and whether NumPy can take them whole
+EVALUATE_MANY_CASES = [
+	('x * 2 + y',                 True),
+	('(x - y) / 4.0',             True),
+	('x * x - 3 * y + 1',         True),
+	('x > y',                     True),
+	('max(x, y)',                 False), # the builtin wants one number at a time
+]
+
+
+class EvaluateManyTestCase(unittest.TestCase):
+
+	def setUp(self):
+		self.x = [1.5, -2.0, 3.25, 0.0, 7.0]
+		self.y = [2.0, 2.0, -1.0, 4.5, 0.5]
+
+	def columnsAs(self, kind):
+		if kind == 'list':
+			return {'x': list(self.x), 'y': list(self.y)}
+		if kind == 'array':
+			return {'x': array('d', self.x), 'y': array('d', self.y)}
+		return {'x': numpy.array(self.x), 'y': numpy.array(self.y)}
+
+	def kinds(self):
+		return ('list', 'array', 'numpy') if numpy is not None else ('list', 'array')
+
+	def test_pathsAgree(self):
+		for source, vectorizes in EVALUATE_MANY_CASES:
+			for backend in (Expression, CompiledExpression):
+				expression = backend(source)
+				expected = [expression(x, y) for x, y in zip(self.x, self.y)]
+				for kind in self.kinds():
+					columns = self.columnsAs(kind)
+					looped = expression.evaluate_many(columns, vectorize=False)
+					self.assertEqual(list, type(looped))
+					self.assertEqual(expected, looped, '%s %r %s' % (backend.__name__, source, kind))
+					
+					result = expression.evaluate_many(columns)
+					self.assertEqual(expected, list(result), '%s %r %s' % (backend.__name__, source, kind))
+					if kind != 'list' and vectorizes and numpy is not None:
+						self.assertTrue(isinstance(result, numpy.ndarray), '%s %r %s' % (backend.__name__, source, kind))
+					else:
+						self.assertEqual(list, type(result))
+
+	def test_constant(self):
+		for backend in (Expression, CompiledExpression):
+			self.assertEqual([6] * 5, backend('2 * 3').evaluate_many(self.columnsAs('list')))
+			self.assertEqual([], backend('2 * 3').evaluate_many({}))
+
+	def test_missingColumn(self):
+		for backend in (Expression, CompiledExpression):
+			self.assertRaises(TypeError, backend('x + z').evaluate_many, self.columnsAs('list'))
+
+	def test_mismatchedLengths(self):
+		for backend in (Expression, CompiledExpression):
+			for kind in self.kinds():
+				for vectorize in (True, False):
+					columns = self.columnsAs(kind)
+					columns['y'] = columns['y'][:3]
+					self.assertRaises(ValueError, backend('x + y').evaluate_many, columns, vectorize)
+					# even a column the expression doesn't read
+					self.assertRaises(ValueError, backend('x * 2').evaluate_many, columns, vectorize)
+					self.assertRaises(ValueError, backend('2 * 3').evaluate_many, columns, vectorize)
+
+
+
+class ProfilerTestCase(unittest.TestCase):
+
+	def sources(self, profiler):
+		return set(source for source, node, label in profiler.timings)
+
+	def test_nested(self):
+		outer, inner = ExpressionProfiler(), ExpressionProfiler()
+		with outer:
+			Expression('x + 1')(1)
+			with inner:
+				Expression('x + 2')(1)
+			self.assertTrue(ExpressionProfiler.current() is outer)
+			Expression('x + 3')(1)
+		self.assertEqual(None, ExpressionProfiler.current())
+		self.assertEqual(set(["Expression('x + 1')", "Expression('x + 3')"]), self.sources(outer))
+		self.assertEqual(set(["Expression('x + 2')"]), self.sources(inner))
+
+	def test_ownThreadOnly(self):
+		# two threads profiling at once, each building while the other's profiler is active
+		both_active = Event()
+		ready = []
+		profilers = {}
+		def build(name):
+			with ExpressionProfiler() as profiler:
+				profilers[name] = profiler
+				ready.append(name)
+				if len(ready) == 2:
+					both_active.set()
+				both_active.wait(5)
+				expression = Expression('x * 2 + %s' % name)
+				expression(1, 2)
+		threads = [Thread(target=build, args=(name,)) for name in ('a', 'b')]
+		for thread in threads:
+			thread.start()
+		
+		# and this thread isn't profiling at all
+		both_active.wait(5)
+		self.assertEqual(None, ExpressionProfiler.current())
+		Expression('x * 2 + c')(1, 2)
+		
+		for thread in threads:
+			thread.join()
+		self.assertTrue(both_active.is_set())
+		self.assertEqual(set(["Expression('x * 2 + a')"]), self.sources(profilers['a']))
+		self.assertEqual(set(["Expression('x * 2 + b')"]), self.sources(profilers['b']))
+
+
+class ExpressionCacheTestCase(unittest.TestCase):
+
+	def test_hits(self):
+		cache = ExpressionCache()
+		expression = cache.get('x + 1')
+		self.assertTrue(expression is cache.get('x + 1'))
+		self.assertTrue(expression is cache.get('  x   + 1 '))
+		self.assertEqual({'hits': 2, 'misses': 1, 'size': 1, 'capacity': 256}, cache.statistics)
+		
+		# whitespace inside quotes matters
+		self.assertFalse(cache.get('"a  b" + s') is cache.get('"a b" + s'))
+		self.assertEqual(3, len(cache))
+		
+		cache.clear()
+		self.assertEqual({'hits': 0, 'misses': 0, 'size': 0, 'capacity': 256}, cache.statistics)
+		self.assertFalse(expression is cache.get('x + 1'))
+
+	def test_evictionOrder(self):
+		cache = ExpressionCache(capacity=3)
+		a, b, c = [cache.get(source) for source in ('a + 1', 'b + 1', 'c + 1')]
+		self.assertTrue(a is cache.get('a + 1')) # now b is the least recently used
+		cache.get('d + 1')
+		self.assertEqual(set(['a + 1', 'c + 1', 'd + 1']), cache.sources())
+		
+		self.assertTrue(c is cache.get('c + 1'))
+		self.assertTrue(a is cache.get('a + 1'))
+		self.assertFalse(b is cache.get('b + 1')) # built again, and d goes
+		self.assertEqual(set(['a + 1', 'b + 1', 'c + 1']), cache.sources())
+		self.assertEqual(3, cache.hits)
+		self.assertEqual(5, cache.misses)
+
+	def test_capacity(self):
+		cache = ExpressionCache(capacity=10)
+		for ix in range(50):
+			cache.get('x + %d' % ix)
+			self.assertEqual(min(ix + 1, 10), len(cache))
+		self.assertEqual(set('x + %d' % ix for ix in range(40, 50)), cache.sources())
+
+	def test_keying(self):
+		cache = ExpressionCache()
+		expression = cache.get('x * y')
+		for backend, options in [(CompiledExpression, {}), 
+								 (Expression, {'optimize': False}),
+								 (Expression, {'hoist_calls': True}),
+								 (Expression, {'signature': (int, float)})]:
+			built = cache.get('x * y', backend, **options)
+			self.assertTrue(isinstance(built, backend))
+			self.assertFalse(expression is built, '%s %r' % (backend.__name__, options))
+			self.assertTrue(built is cache.get('x * y', backend, **options), '%s %r' % (backend.__name__, options))
+		self.assertEqual(5, len(cache))
+		
+		# a signature that can't be a key is built every time, and not kept
+		signature = {'x': int, 'y': int}
+		built = cache.get('x * y', signature=signature)
+		self.assertFalse(built is cache.get('x * y', signature=signature))
+		self.assertEqual(6, built(2, 3))
+		self.assertEqual(5, len(cache))
+
+	def test_profiledNotShared(self):
+		cache = ExpressionCache()
+		expression = cache.get('x + 1')
+		with ExpressionProfiler():
+			profiled = cache.get('x + 1')
+		self.assertFalse(expression is profiled)
+		self.assertTrue(expression is cache.get('x + 1'))
+		self.assertEqual(1, len(cache))
+
+
+
+BUNDLE_SOURCES = [
+	'x * 2 + y',
+	'  max(x,   y) - 1',
+	'math.pi * x + x.real',
+	'"a  b" * n',
+	'2 * 3',
+	'real + x.real',
+]
+
+BUNDLE_ARGUMENTS = {'x': 4, 'y': 1.5, 'n': 2, 'real': 0.5}
+
+
+class BundleTestCase(unittest.TestCase):
+
+	def setUp(self):
+		self.path = os.path.join(tempfile.mkdtemp(), 'expressions.json')
+
+	def test_roundTrip(self):
+		self.assertEqual(len(BUNDLE_SOURCES), write_expression_bundle(self.path, BUNDLE_SOURCES))
+		bundle = read_expression_bundle(self.path)
+		self.assertEqual(set(normalize_source(source) for source in BUNDLE_SOURCES), set(bundle))
+		for source in BUNDLE_SOURCES:
+			postfix, fields = bundle[normalize_source(source)]
+			self.assertEqual(tuple(convert_to_postfix(source)), postfix)
+			self.assertEqual(Expression(source)._fields, fields)
+
+	def test_loadedMatchParsed(self):
+		write_expression_bundle(self.path, BUNDLE_SOURCES)
+		cache = ExpressionCache()
+		self.assertEqual(len(BUNDLE_SOURCES), load_expression_bundle(self.path, cache))
+		
+		# everything in the bundle is built without parsing it again
+		convert = expression_module.convert_to_postfix
+		def not_parsed(source):
+			raise AssertionError('%r was parsed again' % source)
+		expression_module.convert_to_postfix = not_parsed
+		try:
+			loaded = [(backend, cache.get(source, backend)) 
+					  for backend in (Expression, CompiledExpression) for source in BUNDLE_SOURCES]
+		finally:
+			expression_module.convert_to_postfix = convert
+		
+		for (backend, expression), source in zip(loaded, BUNDLE_SOURCES * 2):
+			parsed = backend(source)
+			self.assertEqual(source, expression._expression)
+			self.assertEqual(parsed._fields, expression._fields)
+			self.assertEqual(parsed._postfix, expression._postfix)
+			arguments = dict((field, BUNDLE_ARGUMENTS[field]) for field in parsed._fields)
+			self.assertEqual(parsed(**arguments), expression(**arguments))
+
+	def test_rejected(self):
+		write_expression_bundle(self.path, BUNDLE_SOURCES)
+		with open(self.path) as f:
+			bundle = loads(f.read())
+		
+		bundle['expressions']['x * 2 + y']['fields'] = ['y', 'x']
+		with open(self.path, 'w') as f:
+			f.write(dumps(bundle))
+		cache = ExpressionCache()
+		load_expression_bundle(self.path, cache)
+		self.assertRaises(ValueError, cache.get, 'x * 2 + y')
+		
+		bundle['version'] = 1
+		with open(self.path, 'w') as f:
+			f.write(dumps(bundle))
+		self.assertRaises(ValueError, read_expression_bundle, self.path)
+
+
+
+class Nested(object):
+	"""Its real part is the expression evaluated again, one level down"""
+	def __init__(self, expression, depth):
+		self.expression = expression
+		self.depth = depth
+	
+	@property
+	def real(self):
+		if not self.depth:
+			return 0
+		return self.expression(Nested(self.expression, self.depth - 1), self.depth)
+
+
+class CompiledExpressionTestCase(unittest.TestCase):
+
+	def test_calling(self):
+		expression = CompiledExpression('y * 10 + x - y')
+		self.assertEqual(('y', 'x'), expression._fields)
+		self.assertEqual(21, expression(2, 3))
+		self.assertEqual(21, expression(x=3, y=2))
+		self.assertEqual(21, expression(2, x=3))
+		self.assertEqual(21, expression(2, 3, 'ignored'))
+		self.assertRaises(TypeError, expression, 2)
+
+	def test_flatFunction(self):
+		expression = CompiledExpression('(x + y) * (x + y) - z')
+		self.assertTrue('def _expression(_a0, _a1, _a2):' in expression._source)
+		self.assertEqual(1, expression._source.count('(_a0, _a1)')) # x + y once
+		# nothing is kept on the instance between calls
+		self.assertEqual([], expression._arguments)
+		self.assertEqual([], expression._functions)
+		self.assertEqual(46, expression(3, 4, 3))
+
+	def test_reentrant(self):
+		# each level's call starts before the one above it finishes
+		for backend in (Expression, CompiledExpression):
+			expression = backend('x.real + y')
+			self.assertEqual(10 + 100, expression(Nested(expression, 4), 100), backend.__name__)
+
+	def test_threads(self):
+		for backend in (Expression, CompiledExpression):
+			expression = backend('x * x - y + x * 3')
+			mismatches = []
+			def evaluate(offset):
+				for ix in range(2000):
+					x, y = ix + offset, offset - ix
+					if expression(x, y) != x * x - y + x * 3:
+						mismatches.append((x, y))
+			threads = [Thread(target=evaluate, args=(offset * 10000,)) for offset in range(8)]
+			for thread in threads:
+				thread.start()
+			for thread in threads:
+				thread.join()
+			self.assertEqual([], mismatches, backend.__name__)
+
+
+
+suite = unittest.TestLoader().loadTestsFromTestCase(OptimizedEquivalenceTestCase)
+unittest.TextTestRunner(verbosity=2).run(suite)
+
+suite = unittest.TestLoader().loadTestsFromTestCase(CompiledExpressionTestCase)
+unittest.TextTestRunner(verbosity=2).run(suite)
+
+suite = unittest.TestLoader().loadTestsFromTestCase(SignatureEquivalenceTestCase)
+unittest.TextTestRunner(verbosity=2).run(suite)
+
+suite = unittest.TestLoader().loadTestsFromTestCase(FuzzTestCase)
+unittest.TextTestRunner(verbosity=2).run(suite)
+
+suite = unittest.TestLoader().loadTestsFromTestCase(EvaluateManyTestCase)
+unittest.TextTestRunner(verbosity=2).run(suite)
+
+suite = unittest.TestLoader().loadTestsFromTestCase(ProfilerTestCase)
+unittest.TextTestRunner(verbosity=2).run(suite)
+
+suite = unittest.TestLoader().loadTestsFromTestCase(ExpressionCacheTestCase)
+unittest.TextTestRunner(verbosity=2).run(suite)
+
+suite = unittest.TestLoader().loadTestsFromTestCase(BundleTestCase)
+unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,389 @@
+import unittest, doctest
+from array import array
+
+from shared.data.easing import Easing
+from shared.data.simulators.process import load_simulator, parse_simulator
+
+
+# an easing up to 100, with a guard on it (or on something derived from it)
+EASING_DEFINITION = """
+mixins: [Easing, Expression]
+initial: fill
+variables: [level, x]
+start: {level: 0}
+escapement: {kind: event, config: {variable: t, %(escapement)s}}
+states:
+  fill:
+    level: {kind: Easing, config: {finish: 100, duration: 100}}
+    x: 'level * 0.1'
+  full:
+    level: 100
+    x: 0
+transitions:
+  fill:
+    full:
+      conditions: '%(guard)s'
+"""
+
+
+def first_time_in(columns, state):
+	for t, s in zip(columns['t'], columns['_state']):
+		if s == state:
+			return t
+	return None
+
+
+# a counter, a flag, and a variable that stops being a number partway through
+RUN_DEFINITION = """
+mixins: [Expression]
+initial: count
+variables: [n, flag, label]
+start: {n: 0, flag: 0, label: 0}
+escapement: {kind: increment, config: {variable: t, increment: 1}}
+states:
+  count:
+    n: 'n + 1'
+    flag: 'n > 2'
+    label: 'n * 0.5'
+  named:
+    n: 'n + 1'
+    label: 'n > 7'
+transitions:
+  count:
+    named:
+      conditions: 'n > 4'
+"""
+
+
+class RunTestCase(unittest.TestCase):
+
+	def test_columns(self):
+		columns = load_simulator(RUN_DEFINITION).run(10)
+		self.assertEqual(array('d', range(1, 11)), columns['t'])
+		self.assertEqual(array('d', range(1, 11)), columns['n'])
+		self.assertEqual([False, False, False, True, True, True, True, True, True, True], columns['flag'])
+		self.assertTrue(isinstance(columns['label'], list))
+		self.assertEqual([0.0, 0.5, 1.0, 1.5, 2.0, False, False, False, True, True], columns['label'])
+		self.assertEqual(['count'] * 4 + ['named'] * 6, columns['_state'])
+
+	def test_matchesStepping(self):
+		simulator = load_simulator(RUN_DEFINITION)
+		stepped = []
+		for _ in range(10):
+			simulator.step()
+			stepped.append((simulator._variables['n'], simulator._variables['label'], simulator.state))
+		columns = load_simulator(RUN_DEFINITION).run(10)
+		self.assertEqual(stepped, zip(columns['n'], columns['label'], columns['_state']))
+		self.assertEqual({'_state': [], 'n': []}, load_simulator(RUN_DEFINITION).run(0, ['n']))
+
+
+# oscillates between states that share some functions and not others,
+# with easings that restart from wherever they're entered, and every kind of guard
+OSCILLATING_DEFINITION = """
+mixins: [Easing, Expression]
+initial: fill
+variables: [level, rate, total, mode, doubled]
+start: {level: 0, rate: 1, total: 0, mode: 0, doubled: 0}
+escapement: {kind: increment, config: {variable: t, increment: 1}}
+states:
+  fill:
+    level: {kind: Easing, config: {finish: 100, duration: 20}}
+    rate: 1
+    total: 'total + rate'
+    doubled: 'level * 2'
+    mode: 'mode'
+  drain:
+    level: {kind: Easing, config: {finish: 0, duration: 15}}
+    rate: 2
+    total: 'total + rate'
+    doubled: 'level * 2'
+    mode: 'mode'
+  hold:
+    rate: 0
+    total: 'total'
+    mode: 'mode'
+transitions:
+  fill:
+    drain:
+      conditions: 'doubled > 150'
+    hold:
+      conditions: {mode: 2}
+  drain:
+    fill:
+      conditions: ['level < 10', '_t_state > 3']
+  hold:
+    fill:
+      conditions: '_t_state > 5'
+      unless: {mode: 2}
+"""
+
+
+class OptimizationEquivalenceTestCase(unittest.TestCase):
+
+	FEATURES = ('incremental', 'index_guards', 'reuse_functions')
+
+	def trajectory(self, n_steps=300, **features):
+		simulator = load_simulator(OSCILLATING_DEFINITION)
+		# the features are set as the definition would (the first state is already configured either way)
+		for feature, enabled in features.items():
+			setattr(simulator, '_' + feature, enabled)
+		
+		trajectory = []
+		for ix in range(n_steps):
+			# as if from a tag: hold for a while, then let go
+			if ix == 100:
+				simulator._variables['mode'] = 2
+			elif ix == 130:
+				simulator._variables['mode'] = 0
+			simulator.step()
+			trajectory.append((simulator.state, sorted(
+				(variable, value) for variable, value in simulator._variables.items()
+				if not variable.startswith('_'))))
+		return simulator, trajectory
+
+	def test_eachFeature(self):
+		baseline, expected = self.trajectory(**dict((feature, False) for feature in self.FEATURES))
+		# make sure every state (and every transition out of it) was exercised
+		states = [state for state, _ in expected]
+		self.assertEqual(set(['fill', 'drain', 'hold']), set(states))
+		self.assertTrue(10 < sum(1 for a, b in zip(states, states[1:]) if a != b))
+		
+		for enabled in range(1, 2**len(self.FEATURES)):
+			features = dict((feature, bool(enabled & (1 << ix))) for ix, feature in enumerate(self.FEATURES))
+			simulator, trajectory = self.trajectory(**features)
+			self.assertEqual(expected, trajectory, 'Trajectories differ with %r' % features)
+
+	def test_featuresSaveWork(self):
+		simulator, _ = self.trajectory()
+		self.assertTrue(simulator.evaluations['skipped'] > 0)
+		self.assertTrue(simulator.evaluations['guards skipped'] > 0)
+		self.assertTrue(simulator.rebuilds['avoided'] > 0)
+		
+		simulator, _ = self.trajectory(reuse_functions=False)
+		self.assertEqual(0, simulator.rebuilds['avoided'])
+
+	def test_definitionSwitches(self):
+		simulator = load_simulator(OSCILLATING_DEFINITION + "incremental: false\n")
+		simulator.run(100)
+		self.assertEqual(0, simulator.evaluations['skipped'])
+		
+		simulator = load_simulator(OSCILLATING_DEFINITION + "index_guards: false\n")
+		simulator.run(100)
+		self.assertTrue(simulator.evaluations['skipped'] > 0)
+		self.assertEqual(0, simulator.evaluations['guards evaluated'])
+		
+		simulator = load_simulator(OSCILLATING_DEFINITION + "reuse_functions: false\n")
+		simulator.run(100)
+		self.assertEqual(0, simulator.rebuilds['avoided'])
+
+
+# a list that's changed in place (as if by a script), with a function and a guard that read it
+MUTABLE_DEFINITION = """
+mixins: [Expression]
+initial: short
+variables: [biggest]
+start: {items: [0], biggest: 0}
+escapement: {kind: increment, config: {variable: t, increment: 1}}
+states:
+  short:
+    biggest: 'max(items)'
+  long:
+    biggest: 'max(items)'
+transitions:
+  short:
+    long:
+      conditions: 'max(items) > 5'
+"""
+
+
+class MutableVariableTestCase(unittest.TestCase):
+
+	def test_changedInPlace(self):
+		simulator = load_simulator(MUTABLE_DEFINITION)
+		items = simulator._variables['items']
+		trajectory = []
+		for ix in range(1, 10):
+			items.append(ix)
+			simulator.step()
+			trajectory.append((simulator._variables['biggest'], simulator.state))
+		self.assertEqual([(ix, 'short' if ix <= 5 else 'long') for ix in range(1, 10)], trajectory)
+		self.assertTrue(simulator.evaluations['skipped'] == 0)
+
+	def test_assignedOnlyIsChecked(self):
+		simulator = load_simulator(OSCILLATING_DEFINITION)
+		simulator.step()
+		simulator.step()
+		# a step only compares what was assigned since the last one (and it starts afresh)
+		self.assertEqual(set(), simulator._variables.assigned)
+		simulator._variables['mode'] = 2
+		self.assertEqual(set(['mode']), simulator._variables.assigned)
+		simulator.step()
+		self.assertEqual('hold', simulator.state)
+
+
+class EventEscapementTestCase(unittest.TestCase):
+
+	def simulate(self, guard, escapement='increment: 1', n_steps=120):
+		simulator = load_simulator(EASING_DEFINITION % {'guard': guard, 'escapement': escapement})
+		return simulator, simulator.run(n_steps)
+
+	def test_guardOnTime(self):
+		for escapement in ('increment: 1', 'max_step: 1000'):
+			simulator, columns = self.simulate('level > 50', escapement)
+			self.assertEqual(51, first_time_in(columns, 'full'))
+
+	def test_guardThroughDerivedVariable(self):
+		# x follows level, which follows time, so x can cross between the easing's events
+		for escapement in ('increment: 1', 'max_step: 1000'):
+			simulator, columns = self.simulate('x > 5', escapement)
+			self.assertEqual(52, first_time_in(columns, 'full')) # x lags level by a step
+
+	def test_jumpsWithoutTimeDependence(self):
+		simulator, columns = self.simulate('_n_states > 5')
+		self.assertFalse(simulator._time_dependent)
+		self.assertEqual(array('d', [100.0] * 3), columns['t'][:3])
+		self.assertEqual(100.0, columns['level'][1])
+		self.assertEqual(None, first_time_in(columns, 'full'))
+
+		simulator, columns = self.simulate('_n_states > 5', 'max_step: 1000')
+		self.assertEqual(array('d', [100.0, 1100.0, 2100.0]), columns['t'][:3])
+
+
+# an easing on its own clock (time since the start), so its events are on that clock too
+ALIASED_EASING_DEFINITION = """
+mixins: [Easing, Expression]
+initial: fill
+variables: [elapsed, level]
+start: {elapsed: 0, level: 0}
+escapement: {kind: event, config: {variable: t, start: 100, increment: 1000}}
+states:
+  fill:
+    elapsed: 't - 100'
+    level: {kind: Easing, config: {finish: 100, time_start: 5, duration: 10}, alias: {t: elapsed}}
+transitions: {}
+"""
+
+
+class AliasedEventTestCase(unittest.TestCase):
+
+	def test_eventsInOwnTime(self):
+		columns = load_simulator(ALIASED_EASING_DEFINITION).run(4)
+		self.assertEqual(array('d', [105.0, 115.0, 1115.0, 2115.0]), columns['t'])
+		self.assertEqual(array('d', [5.0, 15.0, 1015.0, 2015.0]), columns['elapsed'])
+		self.assertEqual(100.0, columns['level'][-1])
+
+
+# a counter on a clock that can be made to run on command
+CLOCK_DEFINITION = """
+mixins: [Expression]
+initial: count
+variables: [n]
+start: {n: 0}
+escapement: {kind: %(kind)s, config: {variable: t, %(config)s}}
+states:
+  count:
+    n: 'n + 1'
+transitions: {}
+"""
+
+
+class FakeClock(object):
+	"""Time only passes when it's slept, or when told to (as if working)"""
+	def __init__(self):
+		self.now = 1000.0
+		self.sleeps = []
+	
+	def time(self):
+		return self.now
+	
+	def sleep(self, seconds):
+		self.sleeps.append(seconds)
+		self.now += seconds
+
+
+class ClockEscapementTestCase(unittest.TestCase):
+
+	def simulate(self, kind, config, n_steps=3, work=0.1):
+		clock = FakeClock()
+		Simulator, configuration = parse_simulator(CLOCK_DEFINITION % {'kind': kind, 'config': config})
+		Clocked = type('Clocked', (Simulator,), {'_clock': staticmethod(clock.time), 
+												 '_sleep': staticmethod(clock.sleep)})
+		simulator = Clocked(**configuration)
+		times = []
+		for _ in range(n_steps):
+			clock.now += work
+			simulator.step()
+			times.append(simulator._variables['t'])
+		return times, clock.sleeps
+
+	def assertAlmostEqualLists(self, expected, actual):
+		self.assertEqual(len(expected), len(actual))
+		for x, y in zip(expected, actual):
+			self.assertAlmostEqual(x, y)
+
+	def test_wall(self):
+		times, sleeps = self.simulate('wall', 'start: 10', work=0.25)
+		self.assertAlmostEqualLists([10.25, 10.5, 10.75], times)
+		self.assertEqual([], sleeps)
+		
+		times, sleeps = self.simulate('wall', 'period: 2')
+		self.assertAlmostEqualLists([2, 4, 6], times)
+		self.assertAlmostEqualLists([1.9, 1.9, 1.9], sleeps)
+
+	def test_scaled(self):
+		times, sleeps = self.simulate('scaled', 'scale: 10')
+		self.assertAlmostEqualLists([1, 2, 3], times)
+		self.assertEqual([], sleeps)
+		
+		times, sleeps = self.simulate('scaled', 'scale: 10, period: 5')
+		self.assertAlmostEqualLists([5, 10, 15], times)
+		self.assertAlmostEqualLists([0.4, 0.4, 0.4], sleeps)
+		
+		# when the work takes longer than the period, there's no waiting
+		times, sleeps = self.simulate('scaled', 'scale: 10, period: 5', work=1.0)
+		self.assertAlmostEqualLists([10, 20, 30], times)
+		self.assertEqual([], sleeps)
+
+	def test_wallHasNoScale(self):
+		self.assertRaises(ValueError, self.simulate, 'wall', 'scale: 10')
+
+
+class EasingEventTestCase(unittest.TestCase):
+
+	def test_continuous(self):
+		easing = Easing(time_start=10, time_end=20)
+		self.assertEqual([10.0, 20.0, 20.0, None],
+						 [easing.next_event(t) for t in (0, 10, 15, 20)])
+
+	def test_stepByCount(self):
+		easing = Easing(finish=10.0, steps=4, time_end=1)
+		self.assertEqual([0.0, 1.0, 3.0, 4.0, None, None],
+						 [easing.next_event(t) for t in (-2, 0, 2.5, 3, 4, 7)])
+
+	def test_stepByIncrement(self):
+		easing = Easing(steps=2.5, time_end=10)
+		self.assertEqual([0.0, 1.0, 4.0, 4.0, None],
+						 [easing.next_event(t) for t in (-1, 0.5, 3, 3.5, 4)])
+		self.assertEqual(1.0, easing(easing.next_event(3.5)))
+
+
+suite = unittest.TestLoader().loadTestsFromTestCase(RunTestCase)
+unittest.TextTestRunner(verbosity=2).run(suite)
+
+suite = unittest.TestLoader().loadTestsFromTestCase(OptimizationEquivalenceTestCase)
+unittest.TextTestRunner(verbosity=2).run(suite)
+
+suite = unittest.TestLoader().loadTestsFromTestCase(MutableVariableTestCase)
+unittest.TextTestRunner(verbosity=2).run(suite)
+
+suite = unittest.TestLoader().loadTestsFromTestCase(EventEscapementTestCase)
+unittest.TextTestRunner(verbosity=2).run(suite)
+
+suite = unittest.TestLoader().loadTestsFromTestCase(AliasedEventTestCase)
+unittest.TextTestRunner(verbosity=2).run(suite)
+
+suite = unittest.TestLoader().loadTestsFromTestCase(ClockEscapementTestCase)
+unittest.TextTestRunner(verbosity=2).run(suite)
+
+suite = unittest.TestLoader().loadTestsFromTestCase(EasingEventTestCase)
+unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,504 @@
+import unittest, doctest
+import math, random
+from array import array
+from bisect import bisect_left
+from fractions import Fraction
+
+from shared.data.stats import *
+
+
+class RunningDescriptionTestCase(unittest.TestCase):
+
+	def setUp(self):
+		rng = random.Random(1)
+		self.data = [rng.gauss(100, 20) for _ in range(1000)]
+		self.data[10:20] = [None] * 10
+		self.valid = [x for x in self.data if x is not None]
+
+	def assertDescribes(self, values, running):
+		self.assertEqual(len(values), running.n)
+		self.assertEqual(min(values), running.min)
+		self.assertEqual(max(values), running.max)
+		self.assertAlmostEqual(mean(values), running.mean, places=9)
+		self.assertAlmostEqual(math.fsum(values), running.sum, places=6)
+		expected = math.fsum((x - mean(values))**2 for x in values) / (len(values) - 1)
+		self.assertAlmostEqual(1.0, running.variance / expected, places=9)
+
+	def test_pushMatchesExtend(self):
+		pushed = RunningDescription()
+		for x in self.data:
+			pushed.push(x)
+		extended = RunningDescription(self.data)
+		self.assertDescribes(self.valid, pushed)
+		self.assertDescribes(self.valid, extended)
+		self.assertEqual(describe(self.data), extended.describe())
+
+	def test_remove(self):
+		running = RunningDescription(self.data)
+		for x in self.data[:500]:
+			running.remove(x)
+		remaining = [x for x in self.data[500:] if x is not None]
+		self.assertEqual(len(remaining), running.n)
+		self.assertAlmostEqual(mean(remaining), running.mean, places=9)
+		self.assertAlmostEqual(1.0, running.variance / variance(remaining), places=9)
+
+	def test_tooFew(self):
+		self.assertRaises(InsufficientData, RunningDescription().describe)
+		self.assertRaises(InsufficientData, describe, [None, None])
+		single = RunningDescription([5])
+		self.assertEqual(None, single.variance)
+		self.assertEqual(None, single.standard_deviation)
+		single.remove(5)
+		self.assertEqual((0, None), (single.n, single.min))
+
+	def test_varianceWithOffset(self):
+		# variance() takes two passes with fsum, so a large offset costs it nothing
+		generator = random.Random(3)
+		values = [1e9 + generator.gauss(0, 1) for _ in range(5000)]
+		exact = [Fraction(x) for x in values]
+		mu = sum(exact) / len(exact)
+		expected = float(sum((x - mu) ** 2 for x in exact) / (len(exact) - 1))
+		self.assertAlmostEqual(1.0, variance(values) / expected, places=12)
+		# ... and the streaming accumulator stays close
+		self.assertAlmostEqual(1.0, describe(values)['variance'] / expected, places=6)
+
+
+class QuantileSketchTestCase(unittest.TestCase):
+
+	def setUp(self):
+		rng = random.Random(2)
+		self.data = [rng.expovariate(0.1) for _ in range(20000)]
+		self.ranked = sorted(self.data)
+
+	def assertRankError(self, sketch, data, n=10):
+		# the rank each cut point lands at, against the rank it was meant to be at
+		ranked = sorted(data)
+		bound = 3.0 / sketch.k * len(data) # ~1.7/k, with slack for an unlucky draw
+		for ix, cutpoint in enumerate(sketch.quantiles(n)):
+			target = (ix + 1) * (len(data) + 1.0) / n
+			self.assertTrue(abs(bisect_left(ranked, cutpoint) - target) <= bound)
+
+	def test_exactBeforeCompaction(self):
+		sketch = QuantileSketch(self.data[:100], k=200)
+		for n in (2, 4, 10):
+			self.assertEqual(quantiles(self.data[:100], n), sketch.quantiles(n))
+		self.assertEqual(median(self.data[:100]), sketch.median())
+		self.assertEqual(sorted(self.data[:4]), QuantileSketch(self.data[:4]).quantiles(4))
+
+	def test_rankError(self):
+		for k in (50, 200):
+			sketch = QuantileSketch(self.data, k=k, seed=k)
+			self.assertEqual(len(self.data), len(sketch))
+			self.assertEqual((min(self.data), max(self.data)), (sketch.min, sketch.max))
+			self.assertTrue(sketch._size < 3 * k + 10)
+			self.assertRankError(sketch, self.data)
+
+	def test_mergeMatchesSinglePass(self):
+		merged = QuantileSketch(k=100, seed=1)
+		for ix in range(0, len(self.data), 3000):
+			merged.merge(QuantileSketch(self.data[ix:ix+3000], k=100, seed=ix))
+		single = QuantileSketch(self.data, k=100, seed=1)
+		self.assertEqual((single.n, single.min, single.max), (merged.n, merged.min, merged.max))
+		self.assertRankError(merged, self.data)
+		self.assertRankError(single, self.data)
+
+	def test_seeded(self):
+		self.assertEqual(QuantileSketch(self.data, k=20, seed=5).quantiles(10),
+						 QuantileSketch(self.data, k=20, seed=5).quantiles(10))
+
+	def test_ignoresNone(self):
+		sketch = QuantileSketch([None, 3, None, 1, 2, 4])
+		self.assertEqual(4, len(sketch))
+		self.assertEqual(quantiles([3, 1, 2, 4, 5, 6], 2), QuantileSketch([3, 1, None, 2, 4, 5, 6]).quantiles(2))
+		self.assertRaises(StatisticsError, sketch.quantiles, 5)
+
+
+class FrequentItemsTestCase(unittest.TestCase):
+
+	def setUp(self):
+		rng = random.Random(7)
+		# a long tail of rare values behind a few common ones
+		self.data = [int(rng.paretovariate(1.2)) for _ in range(20000)]
+		self.counts = {}
+		for x in self.data:
+			self.counts[x] = self.counts.get(x, 0) + 1
+
+	def assertGuarantees(self, sketch):
+		self.assertEqual(len(self.data), sketch.n)
+		self.assertTrue(sketch.error <= sketch.n / (sketch.capacity + 1.0))
+		self.assertTrue(len(sketch.counts) <= sketch.capacity)
+		for x, true_count in self.counts.items():
+			count = sketch.counts.get(x, 0)
+			self.assertTrue(true_count - sketch.error <= count <= true_count)
+			if true_count > sketch.n / (sketch.capacity + 1.0):
+				self.assertTrue(x in sketch.counts)
+
+	def test_guarantees(self):
+		for capacity in (5, 20, 100):
+			self.assertGuarantees(FrequentItems(self.data + [None], capacity=capacity))
+
+	def test_merge(self):
+		for capacity in (5, 20):
+			merged = FrequentItems(capacity=capacity)
+			for ix in range(0, len(self.data), 3000):
+				merged.merge(FrequentItems(self.data[ix:ix+3000], capacity=capacity))
+			self.assertGuarantees(merged)
+		self.assertRaises(StatisticsError, FrequentItems().merge, FrequentItems(truncation_magnitude=10))
+
+	def test_exactWhenRoomy(self):
+		sketch = FrequentItems(self.data, capacity=len(self.counts))
+		self.assertEqual(0, sketch.error)
+		self.assertEqual(self.counts, sketch.counts)
+		self.assertEqual(multimode(self.data), sketch.multimode())
+		self.assertEqual(sorted(self.counts.values(), reverse=True)[:3], [c for _, c, _ in sketch.top(3)])
+
+	def test_truncation(self):
+		sketch = FrequentItems([1, 12, 15, 19, 21, 3], truncation_magnitude=10)
+		self.assertEqual({0: 2, 10: 3, 20: 1}, sketch.counts)
+		self.assertEqual(set([10]), sketch.multimode())
+		self.assertRaises(InsufficientData, FrequentItems().multimode)
+
+
+class StreamingHistogramTestCase(unittest.TestCase):
+
+	def setUp(self):
+		rng = random.Random(6)
+		self.data = [rng.gauss(50, 15) for _ in range(3000)]
+
+	def test_fixed(self):
+		streaming = StreamingHistogram(20, 80, buckets=12)
+		streaming.extend(self.data + [None])
+		inside = [x for x in self.data if 20 <= x < 80]
+		self.assertEqual(histogram(inside, buckets=12, start=20, stop=80), streaming.to_slice_counts())
+		self.assertEqual(len([x for x in self.data if x < 20]), streaming.underflow)
+		self.assertEqual(len([x for x in self.data if x >= 80]), streaming.overflow)
+		self.assertEqual(len(self.data), streaming.n)
+
+		config, counts = histogram(self.data, step=5)
+		from_slice = StreamingHistogram(config)
+		from_slice.extend(self.data)
+		self.assertEqual((config, counts), from_slice.to_slice_counts())
+
+	def test_adaptive(self):
+		streaming = StreamingHistogram()
+		streaming.extend(self.data)
+		self.assertEqual(histogram(self.data), streaming.to_slice_counts())
+
+		# a span that outgrows the buckets widens the step instead
+		widening = StreamingHistogram(max_buckets=20)
+		values = [x * 10**(ix // 500) for ix, x in enumerate(self.data)]
+		widening.extend(values)
+		config, counts = widening.to_slice_counts()
+		self.assertTrue(len(counts) <= 20)
+		self.assertEqual(len(values), sum(counts))
+		self.assertTrue(config.start <= min(values) and max(values) < config.stop)
+
+	def test_merge(self):
+		for options in ({}, {'start': 0, 'stop': 100, 'step': 2.5}):
+			single = StreamingHistogram(**options)
+			single.extend(self.data)
+			merged = StreamingHistogram(**options)
+			for ix in range(0, len(self.data), 1000):
+				part = StreamingHistogram(**options)
+				part.extend(self.data[ix:ix+1000])
+				merged.merge(part)
+			self.assertEqual(single.to_slice_counts(), merged.to_slice_counts())
+			self.assertEqual((single.n, single.underflow, single.overflow), 
+							 (merged.n, merged.underflow, merged.overflow))
+
+		self.assertRaises(StatisticsError, StreamingHistogram(0, 10, 1).merge, StreamingHistogram(0, 10, 2))
+		self.assertRaises(StatisticsError, StreamingHistogram, 0)
+		self.assertRaises(InsufficientData, StreamingHistogram().to_slice_counts)
+
+
+class ParallelDescribeTestCase(unittest.TestCase):
+
+	def setUp(self):
+		rng = random.Random(5)
+		self.data = [None if rng.random() < 0.01 else rng.lognormvariate(0, 1) for _ in range(10000)]
+		self.partitions = [self.data[ix:ix+700] for ix in range(0, len(self.data), 700)]
+
+	def assertSameDescription(self, expected, description):
+		self.assertEqual(sorted(expected), sorted(description))
+		for key in ('n', 'min', 'max', 'span'):
+			self.assertEqual(expected[key], description[key])
+		for key in ('sum', 'mean', 'variance', 'standard deviation'):
+			self.assertAlmostEqual(1.0, description[key] / expected[key], places=9)
+
+	def test_matchesDescribe(self):
+		expected = describe(self.data)
+		for workers in (1, 3, 8):
+			self.assertSameDescription(expected, parallel_describe(self.partitions, workers=workers))
+		self.assertSameDescription(expected, reduce_descriptions(describe(p) for p in self.partitions))
+
+	def test_emptyPartitions(self):
+		partitions = [[], [None]] + self.partitions + [[None, None], [3.0]]
+		self.assertSameDescription(describe(self.data + [3.0]), parallel_describe(partitions))
+		self.assertRaises(InsufficientData, parallel_describe, [[None], []])
+
+	def test_failures(self):
+		self.assertRaises(TypeError, parallel_describe, self.partitions + [['a', 'b']])
+
+
+class MovingStatisticsTestCase(unittest.TestCase):
+
+	def setUp(self):
+		rng = random.Random(8)
+		self.xs = [rng.uniform(0, 100) for _ in range(2000)]
+		self.ys = [3.0 * x - 7.0 + rng.gauss(0, 5) for x in self.xs]
+		self.ys[::50] = [None] * len(self.ys[::50])
+
+	def test_exponential(self):
+		alpha = 0.05
+		moving = ExponentialMovingStatistics(alpha=alpha)
+		moving.extend(self.xs[:200])
+		# the first value seeds the mean, and everything after is weighted in geometrically
+		expected = (1 - alpha)**199 * self.xs[0] + math.fsum(
+			alpha * (1 - alpha)**(199 - ix) * x for ix, x in enumerate(self.xs[:200]) if ix)
+		self.assertAlmostEqual(expected, moving.mean, places=9)
+		self.assertEqual(alpha, ExponentialMovingStatistics(span=39).alpha)
+
+		steady = ExponentialMovingStatistics(span=1000)
+		steady.extend(self.xs * 5)
+		self.assertAlmostEqual(1.0, steady.variance / variance(self.xs), delta=0.25)
+
+		last = ExponentialMovingStatistics(alpha=1)
+		last.extend([4, None, 9, 2])
+		self.assertEqual((3, 2.0, 0.0), (last.n, last.mean, last.variance))
+		self.assertRaises(StatisticsError, ExponentialMovingStatistics)
+		self.assertRaises(StatisticsError, ExponentialMovingStatistics, alpha=1.5)
+
+	def test_covariance(self):
+		pairs = [(x, y) for x, y in zip(self.xs, self.ys) if y is not None]
+		xs, ys = [x for x, _ in pairs], [y for _, y in pairs]
+		mx, my = mean(xs), mean(ys)
+		expected = math.fsum((x - mx) * (y - my) for x, y in pairs) / (len(pairs) - 1)
+
+		running = RunningCovariance(zip(self.xs, self.ys))
+		self.assertEqual(len(pairs), running.n)
+		self.assertAlmostEqual(1.0, running.covariance / expected, places=9)
+		self.assertAlmostEqual(expected / math.sqrt(variance(xs) * variance(ys)), running.correlation, places=9)
+		self.assertEqual(None, RunningCovariance([(1, 2), (1, 3)]).correlation)
+
+	def test_regression(self):
+		pairs = [(x, y) for x, y in zip(self.xs, self.ys) if y is not None]
+		mx, my = mean(x for x, _ in pairs), mean(y for _, y in pairs)
+		slope = (math.fsum((x - mx) * (y - my) for x, y in pairs) 
+				 / math.fsum((x - mx)**2 for x, _ in pairs))
+
+		fit = RunningRegression(zip(self.xs, self.ys))
+		self.assertAlmostEqual(slope, fit.slope, places=9)
+		self.assertAlmostEqual(my - slope * mx, fit.intercept, places=9)
+		self.assertAlmostEqual(3.0, fit.slope, delta=0.05)
+		self.assertAlmostEqual(fit.intercept + 10 * fit.slope, fit.predict(10), places=9)
+		self.assertEqual(None, RunningRegression([(1, 2)]).slope)
+
+
+class WindowTestCase(unittest.TestCase):
+
+	def setUp(self):
+		rng = random.Random(4)
+		self.pairs = [(t * 0.5, None if rng.random() < 0.05 else rng.uniform(-10, 10)) 
+					  for t in range(2000)]
+
+	def test_slidingEviction(self):
+		window = SlidingWindow(30)
+		for ix, (t, x) in enumerate(self.pairs):
+			window.push(t, x)
+			if ix % 37 or ix < 2:
+				continue
+			inside = [x for s, x in self.pairs[:ix+1] if s > t - 30 and x is not None]
+			description = window.describe()
+			self.assertEqual(len(inside), len(window))
+			self.assertEqual((min(inside), max(inside)), (description['min'], description['max']))
+			self.assertAlmostEqual(mean(inside), description['mean'], places=9)
+			self.assertAlmostEqual(variance(inside), description['variance'], places=9)
+
+	def test_tumbling(self):
+		window = TumblingWindow(100, archive_limit=100)
+		window.extend(self.pairs)
+		window.close()
+		self.assertEqual(10, len(window.completed))
+		for window_start, description in window.completed:
+			inside = [x for t, x in self.pairs if window_start <= t < window_start + 100]
+			self.assertEqual(describe(inside)['n'], description['n'])
+			self.assertAlmostEqual(mean(inside), description['mean'], places=9)
+			self.assertAlmostEqual(variance(inside), description['variance'], places=9)
+
+	def test_timeOrder(self):
+		for window in (TumblingWindow(10), SlidingWindow(10)):
+			window.push(20, 1)
+			self.assertRaises(StatisticsError, window.push, 5, 1)
+		self.assertRaises(StatisticsError, SlidingWindow, 0)
+
+	def test_windowed(self):
+		rollups = WindowedDescription({
+			'tumbling': TumblingWindow(100),
+			'sliding': SlidingWindow(100),
+		})
+		rollups.extend(self.pairs)
+		descriptions = rollups.describe()
+		self.assertEqual(describe(x for t, x in self.pairs if t >= 900), descriptions['tumbling'])
+		self.assertEqual(describe(x for t, x in self.pairs if t > 999.5 - 100)['n'], descriptions['sliding']['n'])
+
+	def test_slidingNearConstant(self):
+		# removing values that barely differ cancels down to rounding error
+		for seed in range(20):
+			rng = random.Random(seed)
+			window = SlidingWindow(rng.choice([2, 3, 5, 50]))
+			base = rng.choice([0.1, 1.0, 1e3, 1e6, 1e9])
+			for t in range(2000):
+				window.push(t, base + rng.choice([0, 1e-12, 1e-9, 1e-6]) * rng.random())
+				self.assertTrue(window.running.m2 >= 0.0)
+				description = window.describe()
+
+			values = [x for _, x in window.samples]
+			self.assertAlmostEqual(mean(values), description['mean'], delta=abs(base) * 1e-12)
+
+
+class SampleBufferTestCase(unittest.TestCase):
+
+	def setUp(self):
+		self.data = [4, 3, None, 1, 2, None, 6, 1.5]
+		self.buffer = SampleBuffer(self.data)
+
+	def test_viewsAreReadOnly(self):
+		view = self.buffer[2:6]
+		self.assertRaises(StatisticsError, view.append, 1)
+		self.assertRaises(StatisticsError, view.extend, [1])
+		self.assertRaises(StatisticsError, view.sort)
+		# ... and the buffer underneath is untouched
+		self.assertEqual(self.data, list(self.buffer))
+		self.assertEqual([None, 1, 2, None], list(view))
+
+	def test_viewsShareStorage(self):
+		view = self.buffer[1:7]
+		self.buffer.sort()
+		self.assertEqual([1, 1.5, 2, 3, 4, 6, None, None], list(self.buffer))
+		self.assertEqual([1.5, 2, 3, 4, 6, None], list(view))
+		self.assertRaises(StatisticsError, lambda: self.buffer[::2])
+
+	def test_indexing(self):
+		self.assertEqual(len(self.data), len(self.buffer))
+		self.assertEqual(6, self.buffer.valid_count())
+		self.assertEqual([None, 1.5], [self.buffer[-3], self.buffer[-1]])
+		self.assertRaises(IndexError, lambda: self.buffer[len(self.data)])
+
+		view = self.buffer[1:7][2:5]
+		self.assertEqual(self.data[3:6], list(view))
+		self.assertEqual(2, view.valid_count())
+		self.assertEqual([1, 2], list(view.valid_samples()))
+		self.assertEqual(0, len(self.buffer[5:2]))
+
+	def test_statisticsOfViews(self):
+		rng = random.Random(10)
+		data = [None if rng.random() < 0.1 else rng.uniform(1, 2) for _ in range(500)]
+		buffer = SampleBuffer(data)
+		for start, stop in [(0, 500), (0, 100), (123, 456), (490, 500)]:
+			view, values = buffer[start:stop], data[start:stop]
+			self.assertAlmostEqual(mean(values), mean(view), places=12)
+			self.assertAlmostEqual(variance(values), variance(view), places=12)
+			self.assertEqual(median(values), median(view))
+			self.assertEqual(quantiles(values), quantiles(view))
+			self.assertEqual(describe(values)['n'], view.valid_count())
+
+	def test_appendUnsorts(self):
+		self.buffer.sort()
+		self.buffer.append(0)
+		self.buffer.append(None)
+		self.assertFalse(self.buffer.is_sorted)
+		self.assertEqual(median([4, 3, 1, 2, 6, 1.5, 0]), median(self.buffer))
+
+	def test_sortedViews(self):
+		self.buffer.sort()
+		view = self.buffer[1:5]
+		self.assertTrue(view.is_sorted)
+		self.assertEqual(median([1.5, 2, 3, 4]), median(view))
+		self.assertEqual(quantiles([1, 1.5, 2, 3, 4, 6]), quantiles(self.buffer))
+
+
+class ArrayTestCase(unittest.TestCase):
+
+	def setUp(self):
+		rng = random.Random(3)
+		# kept positive, since the geometric mean is not defined for every mix of signs
+		self.data = [abs(rng.gauss(50, 15)) for _ in range(2000)] + [None] * 5
+		self.valid = [x for x in self.data if x is not None]
+		self.mask = array('b', [x is not None for x in self.data])
+		self.values = array('d', [x if x is not None else 0.0 for x in self.data])
+
+	def arrays(self):
+		"""The same samples every way the array path takes them"""
+		yield self.values, self.mask
+		yield compact_array(self.values, self.mask), None
+		yield SampleBuffer(self.data), None
+		if numpy is not None:
+			yield numpy.array(self.values), numpy.array(self.mask, dtype=bool)
+
+	def test_means(self):
+		for function, array_function in [(mean, array_mean), 
+										 (variance, array_variance),
+										 (geometric_mean, array_geometric_mean),
+										 (harmonic_mean, array_harmonic_mean)]:
+			expected = function(self.data)
+			for values, mask in self.arrays():
+				self.assertAlmostEqual(1.0, array_function(values, mask) / expected, places=9)
+
+	def test_ranked(self):
+		for values, mask in self.arrays():
+			self.assertEqual(median(self.data), array_median(values, mask))
+			for n in (2, 4, 10):
+				self.assertEqual(quantiles(self.data, n), array_quantiles(values, mask, n))
+
+	def test_empty(self):
+		values, mask = array('d', [1.0, 2.0]), array('b', [0, 0])
+		for array_function in (array_mean, array_variance, array_median, array_histogram):
+			self.assertRaises(InsufficientData, array_function, values, mask)
+		self.assertRaises(InsufficientData, array_variance, values, array('b', [0, 1]))
+
+	def test_maskLength(self):
+		functions = (array_mean, array_variance, array_geometric_mean, array_harmonic_mean,
+					 array_median, array_quantiles, array_histogram, compact_array)
+		pairs = [(self.values, self.mask[:-10]), (self.values[:-10], self.mask)]
+		if numpy is not None:
+			pairs.append((numpy.array(self.values), numpy.array(self.mask[:-10], dtype=bool)))
+		for values, mask in pairs:
+			for array_function in functions:
+				self.assertRaises(ValueError, array_function, values, mask)
+
+	def test_histogram(self):
+		for options in [{}, {'buckets': 7}, {'step': 5}, {'buckets': 10, 'start': 20, 'stop': 80}]:
+			# samples outside explicit bounds are dropped by the array path
+			inside = [x for x in self.valid if options.get('start', -1e9) <= x < options.get('stop', 1e9)]
+			expected = histogram(inside, **options)
+			for values, mask in self.arrays():
+				self.assertEqual(expected, array_histogram(values, mask, **options))
+			self.assertEqual(expected, histogram(SampleBuffer(self.data), **options))
+
+
+suite = unittest.TestLoader().loadTestsFromTestCase(RunningDescriptionTestCase)
+unittest.TextTestRunner(verbosity=2).run(suite)
+
+suite = unittest.TestLoader().loadTestsFromTestCase(QuantileSketchTestCase)
+unittest.TextTestRunner(verbosity=2).run(suite)
+
+suite = unittest.TestLoader().loadTestsFromTestCase(FrequentItemsTestCase)
+unittest.TextTestRunner(verbosity=2).run(suite)
+
+suite = unittest.TestLoader().loadTestsFromTestCase(StreamingHistogramTestCase)
+unittest.TextTestRunner(verbosity=2).run(suite)
+
+suite = unittest.TestLoader().loadTestsFromTestCase(ParallelDescribeTestCase)
+unittest.TextTestRunner(verbosity=2).run(suite)
+
+suite = unittest.TestLoader().loadTestsFromTestCase(MovingStatisticsTestCase)
+unittest.TextTestRunner(verbosity=2).run(suite)
+
+suite = unittest.TestLoader().loadTestsFromTestCase(WindowTestCase)
+unittest.TextTestRunner(verbosity=2).run(suite)
+
+suite = unittest.TestLoader().loadTestsFromTestCase(SampleBufferTestCase)
+unittest.TextTestRunner(verbosity=2).run(suite)
+
+suite = unittest.TestLoader().loadTestsFromTestCase(ArrayTestCase)
+unittest.TextTestRunner(verbosity=2).run(suite)